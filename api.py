@@ -1,24 +1,209 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 import os
-from email_classifier import classify_email
+import signal
+import sys
+import time
+import threading
+from email_classifier import classify_email, get_encoding, get_openai, get_prompt_parts
 from gmail_service import get_gmail_service
 from flask_cors import CORS
-from label_emails import fetch_primary_emails, get_or_create_label
+from label_emails import (
+    fetch_primary_emails,
+    get_or_create_label,
+    get_label_map,
+    get_message,
+    get_message_metadata,
+    MessageNotFoundError,
+    batch_modify_labels,
+    classify_and_label,
+    classify_message,
+)
 from email_classifier import get_categories_from_prompt
 from dotenv import load_dotenv
 import traceback
-from utils.feedback_db import init_db, store_feedback, get_feedback_stats
-from utils.prompt_updater import update_prompt_from_feedback
+from utils.feedback_db import (
+    init_db,
+    get_feedback_stats,
+)
+from utils.feedback_writer import get_feedback_writer
+from utils.update_trigger import get_update_trigger, run_prompt_update
+from utils.streaming import (
+    STREAM_HEADERS,
+    STREAM_MIMETYPES,
+    format_stream_event,
+    get_stream_format,
+)
+from utils import message_store
+from utils.response_cache import ResponseCache, get_mailbox_history_id
+from utils.job_queue import (
+    ClassificationJobQueue,
+    QueueFullError,
+    init_job_db,
+    get_job,
+)
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the feedback database
-init_db()
-
 app = Flask(__name__)
 CORS(app)
 
+# Listing responses keyed by query parameters and mailbox historyId
+response_cache = ResponseCache()
+
+# Background workers for asynchronous /api/emails/classify requests
+job_queue = ClassificationJobQueue(
+    process_email=classify_and_label, service_factory=get_gmail_service
+)
+
+
+_init_lock = threading.Lock()
+_initialized = False
+_warm_up_thread = None
+_warm_up_errors = {}
+_ready = threading.Event()
+
+
+def initialize():
+    """Create the databases and start the prompt update trigger (once)."""
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        init_db()
+        init_job_db()
+        # Update the prompt in-process when enough misclassifications arrive
+        if os.environ.get("PROMPT_AUTO_UPDATE", "").lower() in ("1", "true"):
+            get_update_trigger()
+        _initialized = True
+
+
+def warm_up():
+    """
+    Do the slow first-time work up front so the first real request isn't
+    slow: load Gmail credentials and client, label list, prompt, tokenizer
+    and OpenAI client. Failed steps are recorded and reported by /ready.
+    """
+    start = time.time()
+    # (name, step, required); token counting works without the encoder
+    steps = [
+        ("database", initialize, True),
+        ("gmail", lambda: get_label_map(get_gmail_service(interactive=False)), True),
+        ("prompt", get_prompt_parts, True),
+        ("encoder", get_encoding, False),
+        ("openai", get_openai, True),
+    ]
+    for name, step, required in steps:
+        try:
+            step()
+        except Exception as e:
+            print(f"Warm-up step '{name}' failed: {e}")
+            _warm_up_errors[name] = {"error": str(e), "required": required}
+    print(f"Warm-up finished in {time.time() - start:.2f}s")
+    _ready.set()
+
+
+def start_warm_up():
+    """Start warm_up() in the background, once."""
+    global _warm_up_thread
+    with _init_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(
+                target=warm_up, name="warm-up", daemon=True
+            )
+            _warm_up_thread.start()
+
+
+@app.before_request
+def ensure_initialized():
+    # WSGI servers import the app without running __main__
+    start_warm_up()
+    initialize()
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 503 until warm-up has finished its required steps."""
+    if not _ready.is_set():
+        return jsonify({"success": False, "ready": False}), 503
+    if any(error["required"] for error in _warm_up_errors.values()):
+        return (
+            jsonify({"success": False, "ready": False, "errors": _warm_up_errors}),
+            503,
+        )
+    return jsonify({"success": True, "ready": True, "errors": _warm_up_errors})
+
+
+def make_cached_response(payload, etag):
+    """JSON response (or 304 when payload is None) carrying the given ETag"""
+    response = Response(status=304) if payload is None else jsonify(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def check_response_cache(endpoint, service):
+    """
+    Look up a listing response for the current request and mailbox state.
+    Returns (cache_key, etag, response) where response is a 304 or cached
+    payload on a hit and None when the caller has to build the response.
+    """
+    history_id = get_mailbox_history_id(service)
+    cache_key = response_cache.make_key(endpoint, request.args, history_id)
+    etag = response_cache.make_etag(cache_key)
+
+    if request.if_none_match.contains(etag):
+        return cache_key, etag, make_cached_response(None, etag)
+
+    payload = response_cache.get(cache_key)
+    if payload is not None:
+        return cache_key, etag, make_cached_response(payload, etag)
+    return cache_key, etag, None
+
+
+def build_primary_email(service, msg_id):
+    """Fetch a single message and classify it for /api/primary-emails"""
+    msg = get_message(service, msg_id)
+    ai_category = classify_message(service, msg)
+
+    return {
+        "id": msg_id,
+        "subject": msg.subject,
+        "from": msg.sender,
+        "snippet": msg.snippet,
+        "category": ai_category,
+    }
+
+
+def stream_primary_emails(service, messages, stream_format):
+    """Yield each email as soon as it is fetched and classified, then a summary"""
+    start_time = time.time()
+    count = 0
+    errors = 0
+
+    for message in messages:
+        try:
+            email_data = build_primary_email(service, message["id"])
+            count += 1
+            yield format_stream_event(stream_format, "email", {"email": email_data})
+        except Exception as e:
+            errors += 1
+            print(f"Error streaming message {message['id']}: {str(e)}")
+            yield format_stream_event(
+                stream_format, "error", {"id": message["id"], "error": str(e)}
+            )
+
+    yield format_stream_event(
+        stream_format,
+        "summary",
+        {
+            "success": errors == 0,
+            "count": count,
+            "errors": errors,
+            "elapsed_seconds": round(time.time() - start_time, 3),
+        },
+    )
+
 
 @app.route("/api/primary-emails", methods=["GET"])
 def get_primary_emails():
@@ -27,6 +212,17 @@ def get_primary_emails():
         max_emails = request.args.get("max_emails", default=15, type=int)
 
         service = get_gmail_service()
+
+        # Streamed responses are not cached; everything else is revalidated
+        # against the mailbox historyId before doing any Gmail/OpenAI work
+        stream_format = get_stream_format(request.args, request.headers)
+        if not stream_format:
+            cache_key, etag, cached_response = check_response_cache(
+                "primary-emails", service
+            )
+            if cached_response is not None:
+                return cached_response
+
         messages = (
             service.users()
             .messages()
@@ -35,41 +231,25 @@ def get_primary_emails():
             .get("messages", [])
         )
 
-        emails_data = []
-
-        for message in messages:
-            msg_id = message["id"]
-            msg = (
-                service.users()
-                .messages()
-                .get(userId="me", id=msg_id, format="full")
-                .execute()
-            )
-            headers = msg["payload"]["headers"]
-
-            subject = next(
-                (h["value"] for h in headers if h["name"].lower() == "subject"),
-                "(No Subject)",
-            )
-            sender = next(
-                (h["value"] for h in headers if h["name"].lower() == "from"),
-                "(No Sender)",
+        # Stream results as NDJSON or SSE when requested via ?stream= or Accept
+        if stream_format:
+            return Response(
+                stream_with_context(
+                    stream_primary_emails(service, messages, stream_format)
+                ),
+                mimetype=STREAM_MIMETYPES[stream_format],
+                headers=STREAM_HEADERS,
             )
 
-            snippet = msg.get("snippet", "")
-            ai_category = classify_email(subject, snippet)
-
-            emails_data.append(
-                {
-                    "id": msg_id,
-                    "subject": subject,
-                    "from": sender,
-                    "snippet": snippet,
-                    "category": ai_category,
-                }
-            )
+        emails_data = [
+            build_primary_email(service, message["id"]) for message in messages
+        ]
 
-        return jsonify({"success": True, "emails": emails_data})
+        payload = {"success": True, "emails": emails_data}
+        response_cache.put(cache_key, payload)
+        return make_cached_response(payload, etag)
+    except MessageNotFoundError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -136,6 +316,7 @@ def label_email():
         service.users().messages().modify(
             userId="me", id=data["message_id"], body={"addLabelIds": [label_id]}
         ).execute()
+        message_store.update_message_labels([data["message_id"]], [label_id])
 
         return jsonify(
             {
@@ -171,6 +352,13 @@ def get_primary_emails_api():
                 403,
             )
 
+        # Serve from cache (or 304) if the mailbox hasn't changed
+        cache_key, etag, cached_response = check_response_cache(
+            "emails-primary", service
+        )
+        if cached_response is not None:
+            return cached_response
+
         # Get categories and their label IDs
         try:
             categories = get_categories_from_prompt()
@@ -225,50 +413,21 @@ def get_primary_emails_api():
                 500,
             )
 
-        # Process messages to return
-        email_data = []
-        for msg in messages:
-            try:
-                msg_id = msg["id"]
-
-                # Get full message details
-                msg_data = (
-                    service.users().messages().get(userId="me", id=msg_id).execute()
-                )
-
-                # Extract email details
-                headers = msg_data.get("payload", {}).get("headers", [])
-                subject = next(
-                    (h["value"] for h in headers if h["name"].lower() == "subject"),
-                    "(No Subject)",
-                )
-                sender = next(
-                    (h["value"] for h in headers if h["name"].lower() == "from"),
-                    "(No Sender)",
-                )
-                date = next(
-                    (h["value"] for h in headers if h["name"].lower() == "date"), ""
-                )
-                snippet = msg_data.get("snippet", "")
+        # Messages already carry the parsed details we return
+        email_data = [
+            {
+                "id": msg.id,
+                "subject": msg.subject,
+                "from": msg.sender,
+                "date": msg.date,
+                "snippet": msg.snippet,
+            }
+            for msg in messages
+        ]
 
-                email_data.append(
-                    {
-                        "id": msg_id,
-                        "subject": subject,
-                        "from": sender,
-                        "date": date,
-                        "snippet": snippet,
-                    }
-                )
-            except Exception as process_error:
-                print(
-                    f"Error processing message {msg.get('id', 'unknown')}: {str(process_error)}"
-                )
-                # Continue processing other messages
-
-        return jsonify(
-            {"status": "success", "count": len(email_data), "emails": email_data}
-        )
+        payload = {"status": "success", "count": len(email_data), "emails": email_data}
+        response_cache.put(cache_key, payload)
+        return make_cached_response(payload, etag)
 
     except Exception as e:
         print(f"Unexpected error in API: {str(e)}")
@@ -281,50 +440,83 @@ def get_primary_emails_api():
 
 @app.route("/api/emails/classify", methods=["POST"])
 def classify_email_api():
-    """API endpoint to classify an email and apply a label"""
+    """API endpoint to classify an email and apply a label.
+
+    Passing "email_ids" or "async": true queues the work instead and returns
+    202 with a job ID that can be polled at /api/jobs/<job_id>.
+    """
     try:
         data = request.json
-        if not data or "email_id" not in data:
+        if not data or ("email_id" not in data and "email_ids" not in data):
             return (
                 jsonify({"status": "error", "message": "Missing email_id in request"}),
                 400,
             )
 
-        email_id = data["email_id"]
+        if "email_ids" in data or data.get("async"):
+            email_ids = data.get("email_ids") or [data.get("email_id")]
+            if not isinstance(email_ids, list) or not all(
+                isinstance(email_id, str) and email_id for email_id in email_ids
+            ):
+                return (
+                    jsonify(
+                        {
+                            "status": "error",
+                            "message": "email_ids must be a non-empty list of IDs",
+                        }
+                    ),
+                    400,
+                )
 
-        # Get Gmail service
-        service = get_gmail_service()
+            try:
+                job_id = job_queue.submit(email_ids)
+            except QueueFullError as e:
+                return jsonify({"status": "error", "message": str(e)}), 429
 
-        # Get email details
-        msg_data = service.users().messages().get(userId="me", id=email_id).execute()
+            return (
+                jsonify(
+                    {
+                        "status": "accepted",
+                        "job_id": job_id,
+                        "status_url": f"/api/jobs/{job_id}",
+                    }
+                ),
+                202,
+            )
 
-        # Extract subject and snippet
-        headers = msg_data.get("payload", {}).get("headers", [])
-        subject = next(
-            (h["value"] for h in headers if h["name"].lower() == "subject"),
-            "(No Subject)",
-        )
-        snippet = msg_data.get("snippet", "")
+        email_id = data["email_id"]
 
-        # Classify the email
-        category = classify_email(subject, snippet)
+        # Get Gmail service
+        service = get_gmail_service()
 
-        # Apply the label
-        label_id = get_or_create_label(service, category)
-        service.users().messages().modify(
-            userId="me", id=email_id, body={"addLabelIds": [label_id]}
-        ).execute()
+        # Fetch, classify and apply the label
+        category = classify_and_label(service, email_id)
 
         return jsonify(
             {"status": "success", "email_id": email_id, "category": category}
         )
 
+    except MessageNotFoundError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
     except Exception as e:
         print(f"Error in API: {str(e)}")
         print(traceback.format_exc())
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    """Return the state and per-email results of a classification job"""
+    try:
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": "Job not found"}), 404
+        return jsonify({"status": "success", "job": job})
+    except Exception as e:
+        print(f"Error in API: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
 @app.route("/api/feedback", methods=["POST"])
 def submit_feedback():
     """Endpoint to submit feedback about email classification"""
@@ -349,34 +541,28 @@ def submit_feedback():
         # Get email details if not provided
         subject = data.get("subject", "")
         snippet = data.get("snippet", "")
+        sender = data.get("sender", "")
 
-        if not subject or not snippet:
+        if not subject or not snippet or not sender:
             try:
                 service = get_gmail_service()
-                msg_data = (
-                    service.users()
-                    .messages()
-                    .get(userId="me", id=data["message_id"])
-                    .execute()
-                )
-
-                headers = msg_data.get("payload", {}).get("headers", [])
-                subject = next(
-                    (h["value"] for h in headers if h["name"].lower() == "subject"),
-                    "(No Subject)",
-                )
-                snippet = msg_data.get("snippet", "")
+                msg = get_message(service, data["message_id"])
+                subject = subject or msg.subject
+                snippet = snippet or msg.snippet
+                sender = sender or msg.sender_address
             except Exception as e:
                 print(f"Error fetching email details: {e}")
-                # Continue with empty subject/snippet if we can't fetch them
+                # Enrichment is best-effort: store the correction with
+                # whatever fields were sent
 
-        # Store the feedback
-        success = store_feedback(
+        # Queue the feedback; the background writer persists it in batches
+        success = get_feedback_writer().enqueue(
             message_id=data["message_id"],
             subject=subject,
             snippet=snippet,
             ai_category=data["ai_category"],
             user_category=data["user_category"],
+            sender=sender,
         )
 
         if not success:
@@ -412,6 +598,11 @@ def submit_feedback():
                     service.users().messages().modify(
                         userId="me", id=data["message_id"], body=modify_request
                     ).execute()
+                    message_store.update_message_labels(
+                        [data["message_id"]],
+                        [label_id],
+                        [ai_label_id] if ai_label_id else None,
+                    )
             except Exception as e:
                 print(f"Error updating labels: {e}")
                 # Continue even if label update fails
@@ -423,6 +614,127 @@ def submit_feedback():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/api/feedback/batch", methods=["POST"])
+def submit_feedback_batch():
+    """Endpoint to submit many classification corrections in one request"""
+    try:
+        data = request.json
+        items = data.get("feedback") if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": "Request body must contain a non-empty 'feedback' array",
+                    }
+                ),
+                400,
+            )
+
+        required_fields = ("message_id", "ai_category", "user_category")
+        invalid_indexes = [
+            i
+            for i, item in enumerate(items)
+            if not isinstance(item, dict)
+            or any(field not in item for field in required_fields)
+        ]
+        if invalid_indexes:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": "Missing required fields: message_id, ai_category, user_category",
+                        "invalid_indexes": invalid_indexes,
+                    }
+                ),
+                400,
+            )
+
+        # Later corrections for the same message win, matching INSERT OR REPLACE
+        entries = {}
+        for item in items:
+            entries[item["message_id"]] = {
+                "message_id": item["message_id"],
+                "subject": item.get("subject", ""),
+                "snippet": item.get("snippet", ""),
+                "sender": item.get("sender", ""),
+                "ai_category": item["ai_category"],
+                "user_category": item["user_category"],
+            }
+        entries = list(entries.values())
+
+        # Fetch missing subjects/snippets/senders with batched metadata requests
+        service = None
+        missing_ids = [
+            entry["message_id"]
+            for entry in entries
+            if not entry["subject"] or not entry["snippet"] or not entry["sender"]
+        ]
+        if missing_ids:
+            try:
+                service = get_gmail_service()
+                details = get_message_metadata(service, missing_ids)
+                for entry in entries:
+                    msg = details.get(entry["message_id"])
+                    if msg:
+                        entry["subject"] = entry["subject"] or msg.subject
+                        entry["snippet"] = entry["snippet"] or msg.snippet
+                        entry["sender"] = entry["sender"] or msg.sender_address
+            except Exception as e:
+                print(f"Error fetching email details: {e}")
+                # Continue with empty subject/snippet if we can't fetch them
+
+        # Through the writer, so older buffered corrections can't overwrite these
+        if not get_feedback_writer().store_now(entries):
+            return jsonify({"success": False, "error": "Failed to store feedback"}), 500
+
+        # Group corrections by label change so each group is one batchModify call
+        labels_updated = 0
+        corrections = [
+            entry for entry in entries if entry["ai_category"] != entry["user_category"]
+        ]
+        if corrections:
+            try:
+                service = service or get_gmail_service()
+                label_map = get_label_map(service)
+
+                label_changes = {}
+                for entry in corrections:
+                    add_id = get_or_create_label(
+                        service, entry["user_category"], label_map=label_map
+                    )
+                    remove_id = label_map.get(entry["ai_category"].lower())
+                    if remove_id == add_id:
+                        remove_id = None
+                    label_changes.setdefault((add_id, remove_id), []).append(
+                        entry["message_id"]
+                    )
+
+                for (add_id, remove_id), message_ids in label_changes.items():
+                    labels_updated += batch_modify_labels(
+                        service,
+                        message_ids,
+                        add_label_ids=[add_id] if add_id else None,
+                        remove_label_ids=[remove_id] if remove_id else None,
+                    )
+            except Exception as e:
+                print(f"Error updating labels: {e}")
+                # Continue even if label update fails
+
+        return jsonify(
+            {
+                "success": True,
+                "message": f"Recorded feedback for {len(entries)} emails",
+                "stored": len(entries),
+                "labels_updated": labels_updated,
+            }
+        )
+    except Exception as e:
+        print(f"Error in batch feedback submission: {e}")
+        print(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @app.route("/api/feedback/stats", methods=["GET"])
 def get_stats():
     """Get statistics about classification feedback"""
@@ -440,8 +752,15 @@ def trigger_prompt_update():
         data = request.json
         min_feedback = data.get("min_feedback", 20) if data else 20
 
-        success = update_prompt_from_feedback(min_feedback_count=min_feedback)
+        success = run_prompt_update(min_feedback_count=min_feedback)
 
+        if success is None:
+            return (
+                jsonify(
+                    {"success": False, "message": "A prompt update is already running"}
+                ),
+                409,
+            )
         if success:
             return jsonify({"success": True, "message": "Prompt updated successfully"})
         else:
@@ -459,5 +778,8 @@ def trigger_prompt_update():
 
 
 if __name__ == "__main__":
+    # Exit through SystemExit on SIGTERM so atexit flushes buffered feedback
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     port = int(os.environ.get("PORT", 5001))
+    start_warm_up()
     app.run(host="0.0.0.0", port=port, debug=True)
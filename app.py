@@ -1,82 +1,196 @@
 import streamlit as st
 import pandas as pd
-from email_classifier import fetch_emails, classify_email
+from concurrent.futures import ThreadPoolExecutor
+from gmail_service import get_gmail_service
+from email_classifier import classify_email, get_categories_from_prompt
+from label_emails import fetch_email_page
 from utils.excel_conversion import convert_csv_to_excel
-from utils.feedback_db import init_db, store_feedback
+from utils.feedback_db import init_db, store_feedback_batch
 
-# Initialize the feedback database
-init_db()
+PAGE_SIZE = 20
+CLASSIFY_WORKERS = 8
 
 st.set_page_config(page_title="📧 AI Email Classifier", layout="wide")
 st.title("📧 AI Email Classifier with Manual Override")
 
-# Load emails
-emails = fetch_emails(5)
-feedback_data = []
-
-# UI for each email
-for i, mail in enumerate(emails):
-    subject = mail["subject"]
-    sender = mail["from"]
-    snippet = mail["snippet"]
-    message_id = mail.get("id", f"local_{i}")  # Use message ID if available
-    ai_label = classify_email(subject, snippet)
-
-    category_options = [
-        "Sports",
-        "Entertainment",
-        "Job Applications",
-        "Conferences",
-        "Promotions",
-        "Work",
-        "Other",
-    ]
 
-    with st.expander(f"Email #{i+1}: {subject}"):
-        st.markdown(f"**From**: {sender}")
+@st.cache_resource
+def get_service():
+    # Initialize the feedback database once per server process
+    init_db()
+    return get_gmail_service()
+
+
+@st.cache_data
+def get_category_options():
+    return get_categories_from_prompt()
+
+
+# Everything fetched or computed is kept in the session, so widget clicks
+# (each of which reruns this script) never refetch or reclassify an email
+state = st.session_state
+if "emails" not in state:
+    state.emails = []  # Loaded emails, in Gmail's order
+    state.classifications = {}  # Message ID -> AI category
+    state.user_labels = {}  # Message ID -> category chosen by the user
+    state.submitted = {}  # Message ID -> category last stored as feedback
+    state.next_page_token = None
+    state.page = 0
+
+
+def load_next_page():
+    """Fetch and classify the next page of emails from Gmail."""
+    messages, state.next_page_token = fetch_email_page(
+        get_service(), PAGE_SIZE, state.next_page_token
+    )
+    seen = {mail["id"] for mail in state.emails}
+    new = [msg for msg in messages if msg.id not in seen]
+    with ThreadPoolExecutor(max_workers=CLASSIFY_WORKERS) as executor:
+        categories = executor.map(
+            lambda msg: classify_email(msg.subject, msg.snippet), new
+        )
+        for msg, category in zip(new, categories):
+            state.classifications[msg.id] = category
+    state.emails.extend(
+        {
+            "id": msg.id,
+            "subject": msg.subject,
+            "from": msg.sender,
+            "sender_address": msg.sender_address,
+            "snippet": msg.snippet,
+        }
+        for msg in new
+    )
+
+
+def has_more():
+    return state.next_page_token is not None
+
+
+def current_label(message_id):
+    return state.user_labels.get(message_id, state.classifications[message_id])
+
+
+def remember_label(message_id):
+    # Widget state is dropped when its page isn't shown, so keep a copy
+    state.user_labels[message_id] = state[f"user_label_{message_id}"]
+
+
+if not state.emails:
+    with st.spinner("Loading emails..."):
+        load_next_page()
+
+category_options = get_category_options()
+page_count = -(-len(state.emails) // PAGE_SIZE)
+
+# Page navigation; moving past the last loaded page loads another from Gmail
+col1, col2, col3 = st.columns([1, 1, 4])
+with col1:
+    if st.button("◀ Previous", disabled=state.page == 0):
+        state.page -= 1
+        st.rerun()
+with col2:
+    if st.button("Next ▶", disabled=state.page >= page_count - 1 and not has_more()):
+        if state.page >= page_count - 1:
+            with st.spinner("Loading emails..."):
+                load_next_page()
+        if (state.page + 1) * PAGE_SIZE < len(state.emails):
+            state.page += 1
+        st.rerun()
+with col3:
+    st.caption(
+        f"Page {state.page + 1} · {len(state.emails)} emails loaded, "
+        f"{len(state.submitted)} corrections submitted"
+    )
+
+# UI for each email on the current page
+start = state.page * PAGE_SIZE
+for i, mail in enumerate(state.emails[start : start + PAGE_SIZE], start=start):
+    message_id = mail["id"]
+    ai_label = state.classifications[message_id]
+    user_label = current_label(message_id)
+    options = (
+        category_options
+        if ai_label in category_options
+        else category_options + [ai_label]
+    )
+
+    with st.expander(f"Email #{i+1}: {mail['subject']}"):
+        st.markdown(f"**From**: {mail['from']}")
         st.markdown("**Snippet:**")
-        st.code(snippet, language="text")
+        st.code(mail["snippet"], language="text")
         st.markdown(f"**AI Prediction**:  `{ai_label}`")
 
-        user_label = st.radio(
+        st.radio(
             f"📝 Your category for Email #{i+1}:",
-            options=category_options,
-            index=(
-                category_options.index(ai_label)
-                if ai_label in category_options
-                else category_options.index("Other")
-            ),
-            key=f"user_label_{i}",
+            options=options,
+            index=options.index(user_label if user_label in options else ai_label),
+            key=f"user_label_{message_id}",
+            on_change=remember_label,
+            args=(message_id,),
         )
 
-        # Store feedback if user changed the classification
         if user_label != ai_label:
             st.info(
                 f"You changed the classification from '{ai_label}' to '{user_label}'"
             )
 
-            # Store feedback in database
-            store_feedback(
-                message_id=message_id,
-                subject=subject,
-                snippet=snippet,
-                ai_category=ai_label,
-                user_category=user_label,
-            )
 
-        feedback_data.append(
-            {
-                "Subject": subject,
-                "From": sender,
-                "Snippet": snippet,
-                "AI_Category": ai_label,
-                "User_Category": user_label,
-            }
+# Corrections are only stored when submitted, and only once each
+def pending_corrections():
+    return [
+        mail
+        for mail in state.emails
+        if current_label(mail["id"]) != state.classifications[mail["id"]]
+        and current_label(mail["id"]) != state.submitted.get(mail["id"])
+    ]
+
+
+def submit_corrections():
+    entries = [
+        {
+            "message_id": mail["id"],
+            "subject": mail["subject"],
+            "snippet": mail["snippet"],
+            "sender": mail["sender_address"],
+            "ai_category": state.classifications[mail["id"]],
+            "user_category": current_label(mail["id"]),
+        }
+        for mail in pending_corrections()
+    ]
+    if store_feedback_batch(entries):
+        state.submitted.update(
+            (entry["message_id"], entry["user_category"]) for entry in entries
         )
+        state.submit_result = ("success", f"✅ Stored {len(entries)} corrections")
+    else:
+        state.submit_result = ("error", "❌ Could not store feedback")
+
+
+pending_count = len(pending_corrections())
+st.button(
+    f"Submit {pending_count} Corrections",
+    disabled=not pending_count,
+    on_click=submit_corrections,
+)
+if "submit_result" in state:
+    kind, message = state.pop("submit_result")
+    getattr(st, kind)(message)
 
 # Save feedback
 if st.button("Save Feedback to CSV"):
-    df = pd.DataFrame(feedback_data)
+    df = pd.DataFrame(
+        [
+            {
+                "Subject": mail["subject"],
+                "From": mail["from"],
+                "Snippet": mail["snippet"],
+                "AI_Category": state.classifications[mail["id"]],
+                "User_Category": current_label(mail["id"]),
+            }
+            for mail in state.emails
+        ]
+    )
     df.to_csv("email_classification_log.csv", index=False)
     convert_csv_to_excel("email_classification_log.csv")
     st.success("✅ Feedback saved to `email_classification_log.csv`")
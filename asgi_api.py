@@ -0,0 +1,811 @@
+# asgi_api.py
+#
+# Async deployment of the routes in api.py with the same response contracts.
+# Gmail and OpenAI calls go through shared pooled async clients, so one process
+# serves many concurrent requests without a thread per request. Run with:
+#
+#   uvicorn asgi_api:app --host 0.0.0.0 --port 5001
+
+import asyncio
+import os
+import time
+import traceback
+import httpx
+from dotenv import load_dotenv
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+from async_gmail_service import get_async_gmail_client
+from email_classifier import (
+    classify_email_async,
+    classify_email_with_body_fallback_async,
+    get_async_openai_client,
+    get_categories_from_prompt,
+    get_encoding,
+    get_prompt_parts,
+)
+from utils.feedback_db import (
+    init_db,
+    record_classification,
+    get_feedback_stats,
+)
+from label_emails import MessageNotFoundError
+from utils.feedback_writer import get_feedback_writer
+from utils.update_trigger import get_update_trigger, run_prompt_update
+from utils.job_queue import (
+    MAX_PENDING,
+    init_job_db,
+    create_job,
+    update_job_item,
+    get_job,
+)
+from utils import message_store
+from utils.email_body import extract_body_text
+from utils.gmail_message import GmailMessage
+from utils.response_cache import ResponseCache
+from utils.streaming import (
+    STREAM_HEADERS,
+    STREAM_MIMETYPES,
+    format_stream_event,
+    get_stream_format,
+)
+
+# Load environment variables
+load_dotenv()
+
+# Per-request fan-out limit for Gmail gets and OpenAI calls
+MAX_CONCURRENCY = int(os.environ.get("ASGI_MAX_CONCURRENCY", 10))
+# Upper bound on pooled connections to the Gmail API
+MAX_CONNECTIONS = int(os.environ.get("ASGI_MAX_CONNECTIONS", 100))
+# Update the prompt in-process when enough misclassifications arrive
+AUTO_UPDATE_PROMPT = os.environ.get("PROMPT_AUTO_UPDATE", "").lower() in ("1", "true")
+
+app = cors(Quart(__name__))
+
+gmail = None
+background_tasks = set()
+response_cache = ResponseCache()
+job_semaphore = None
+warm_up_task = None
+warm_up_errors = {}
+
+
+@app.before_serving
+async def startup():
+    global gmail, job_semaphore, warm_up_task
+    await asyncio.to_thread(init_db)
+    await asyncio.to_thread(init_job_db)
+    if AUTO_UPDATE_PROMPT:
+        get_update_trigger()
+    gmail = await get_async_gmail_client(max_connections=MAX_CONNECTIONS)
+    job_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    warm_up_task = asyncio.create_task(warm_up())
+
+
+async def warm_up():
+    """
+    Do the slow first-time work in the background once serving starts, so the
+    first real request isn't slow. Failed steps are reported by /ready.
+    """
+    start = time.time()
+    # (name, step, required); token counting works without the encoder
+    steps = [
+        ("gmail", gmail.get_label_map, True),
+        ("prompt", lambda: asyncio.to_thread(get_prompt_parts), True),
+        ("encoder", lambda: asyncio.to_thread(get_encoding), False),
+        ("openai", lambda: asyncio.to_thread(get_async_openai_client), True),
+    ]
+    for name, step, required in steps:
+        try:
+            await step()
+        except Exception as e:
+            print(f"Warm-up step '{name}' failed: {e}")
+            warm_up_errors[name] = {"error": str(e), "required": required}
+    print(f"Warm-up finished in {time.time() - start:.2f}s")
+
+
+@app.route("/ready", methods=["GET"])
+async def ready():
+    """Readiness probe: 503 until warm-up has finished its required steps."""
+    if warm_up_task is None or not warm_up_task.done():
+        return jsonify({"success": False, "ready": False}), 503
+    if any(error["required"] for error in warm_up_errors.values()):
+        return (
+            jsonify({"success": False, "ready": False, "errors": warm_up_errors}),
+            503,
+        )
+    return jsonify({"success": True, "ready": True, "errors": warm_up_errors})
+
+
+@app.after_serving
+async def shutdown():
+    if background_tasks:
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+    await gmail.aclose()
+    await asyncio.to_thread(get_feedback_writer().close)
+
+
+async def gather_bounded(coros, limit=MAX_CONCURRENCY):
+    """Run coroutines concurrently, at most `limit` at a time, keeping order."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+
+def make_cached_response(payload, etag):
+    """JSON response (or 304 when payload is None) carrying the given ETag"""
+    response = Response("", status=304) if payload is None else jsonify(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+async def check_response_cache(endpoint):
+    """Async counterpart of api.check_response_cache"""
+    profile = await gmail.get_profile()
+    cache_key = response_cache.make_key(endpoint, request.args, profile["historyId"])
+    etag = response_cache.make_etag(cache_key)
+
+    if request.if_none_match.contains(etag):
+        return cache_key, etag, make_cached_response(None, etag)
+
+    payload = response_cache.get(cache_key)
+    if payload is not None:
+        return cache_key, etag, make_cached_response(payload, etag)
+    return cache_key, etag, None
+
+
+async def fetch_message(msg_id):
+    """Fetch a message's metadata from Gmail and store it in the local mirror"""
+    try:
+        resource = await gmail.get_message(
+            msg_id,
+            format="metadata",
+            metadata_headers=list(message_store.STORED_HEADERS),
+        )
+    except httpx.HTTPStatusError as e:
+        # Gmail answers 400 for malformed IDs and 404 for unknown ones
+        if e.response.status_code in (400, 404):
+            raise MessageNotFoundError(f"Message {msg_id} not found") from e
+        raise
+    msg = GmailMessage.from_resource(resource)
+    await asyncio.to_thread(message_store.upsert_messages, [msg])
+    return msg
+
+
+async def get_message(msg_id):
+    """Async counterpart of label_emails.get_message"""
+    stored = await asyncio.to_thread(message_store.get_messages, [msg_id])
+    if msg_id in stored:
+        return stored[msg_id]
+    return await fetch_message(msg_id)
+
+
+async def classify_message(msg):
+    """
+    Classify a GmailMessage, fetching its body only if the snippet isn't
+    enough, and add the result to the classification history.
+    """
+
+    async def get_body(max_chars):
+        resource = await gmail.get_message(msg.id, format="full")
+        return extract_body_text(resource["payload"], max_chars)
+
+    category, confidence = await classify_email_with_body_fallback_async(
+        msg.subject, msg.snippet, get_body
+    )
+    await asyncio.to_thread(
+        record_classification, msg.id, msg.sender_address, category, confidence
+    )
+    return category
+
+
+async def build_primary_email(msg_id):
+    """Fetch a single message and classify it for /api/primary-emails"""
+    msg = await get_message(msg_id)
+    ai_category = await classify_message(msg)
+
+    return {
+        "id": msg_id,
+        "subject": msg.subject,
+        "from": msg.sender,
+        "snippet": msg.snippet,
+        "category": ai_category,
+    }
+
+
+async def stream_primary_emails(messages, stream_format):
+    """Yield emails in completion order as they are classified, then a summary"""
+    start_time = time.time()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    count = 0
+    errors = 0
+
+    async def run(msg_id):
+        async with semaphore:
+            try:
+                return msg_id, await build_primary_email(msg_id), None
+            except Exception as e:
+                return msg_id, None, e
+
+    for next_done in asyncio.as_completed([run(m["id"]) for m in messages]):
+        msg_id, email_data, error = await next_done
+        if error is None:
+            count += 1
+            yield format_stream_event(stream_format, "email", {"email": email_data})
+        else:
+            errors += 1
+            print(f"Error streaming message {msg_id}: {str(error)}")
+            yield format_stream_event(
+                stream_format, "error", {"id": msg_id, "error": str(error)}
+            )
+
+    yield format_stream_event(
+        stream_format,
+        "summary",
+        {
+            "success": errors == 0,
+            "count": count,
+            "errors": errors,
+            "elapsed_seconds": round(time.time() - start_time, 3),
+        },
+    )
+
+
+@app.route("/api/primary-emails", methods=["GET"])
+async def get_primary_emails():
+    try:
+        max_emails = request.args.get("max_emails", default=15, type=int)
+
+        stream_format = get_stream_format(request.args, request.headers)
+        if not stream_format:
+            cache_key, etag, cached_response = await check_response_cache(
+                "primary-emails"
+            )
+            if cached_response is not None:
+                return cached_response
+
+        response = await gmail.list_messages(
+            q="category:primary", max_results=max_emails
+        )
+        messages = response.get("messages", [])
+
+        if stream_format:
+            return Response(
+                stream_primary_emails(messages, stream_format),
+                mimetype=STREAM_MIMETYPES[stream_format],
+                headers=STREAM_HEADERS,
+            )
+
+        emails_data = await gather_bounded(
+            build_primary_email(message["id"]) for message in messages
+        )
+        payload = {"success": True, "emails": emails_data}
+        response_cache.put(cache_key, payload)
+        return make_cached_response(payload, etag)
+    except MessageNotFoundError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/classify", methods=["POST"])
+async def classify():
+    try:
+        data = await request.get_json()
+        if not data or "subject" not in data or "snippet" not in data:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": "Missing required fields: subject and snippet",
+                    }
+                ),
+                400,
+            )
+
+        category = await classify_email_async(data["subject"], data["snippet"])
+        return jsonify({"success": True, "category": category})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/label", methods=["POST"])
+async def label_email():
+    try:
+        data = await request.get_json()
+        if not data or "message_id" not in data or "category" not in data:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": "Missing required fields: message_id and category",
+                    }
+                ),
+                400,
+            )
+
+        label_id = await gmail.get_or_create_label(data["category"])
+        await gmail.modify_message(data["message_id"], add_label_ids=[label_id])
+
+        return jsonify(
+            {
+                "success": True,
+                "message": f"Applied label '{data['category']}' to message",
+            }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+async def fetch_primary_emails(max_results=10, label_ids_to_exclude=None):
+    """
+    Async counterpart of label_emails.fetch_primary_emails. Pages through the
+    Primary category and fetches metadata, concurrently, only for as many
+    messages as are still needed, stopping once 2 * max_results messages
+    without any of the excluded labels are found. Returns the newest
+    max_results of them.
+    """
+    excluded = set(label_ids_to_exclude or [])
+    limit = max_results * 2
+    valid_messages = []
+    page_token = None
+
+    async def fetch_listed(msg_id):
+        # Deleted since it was listed
+        try:
+            return await fetch_message(msg_id)
+        except MessageNotFoundError:
+            return None
+
+    while len(valid_messages) < limit:
+        results = await gmail.list_messages(
+            q="category:primary", max_results=100, page_token=page_token
+        )
+        msg_ids = [msg["id"] for msg in results.get("messages", [])]
+        if not msg_ids:
+            break
+
+        while msg_ids and len(valid_messages) < limit:
+            needed = limit - len(valid_messages)
+            chunk, msg_ids = msg_ids[:needed], msg_ids[needed:]
+            page = await gather_bounded(fetch_listed(msg_id) for msg_id in chunk)
+            valid_messages.extend(
+                msg
+                for msg in page
+                if msg is not None and not excluded.intersection(msg.label_ids)
+            )
+
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+
+    valid_messages.sort(key=lambda m: m.internal_date, reverse=True)
+    return valid_messages[:max_results]
+
+
+@app.route("/api/emails/primary", methods=["GET"])
+async def get_primary_emails_api():
+    """API endpoint to fetch primary emails that haven't been categorized yet"""
+    try:
+        max_results = request.args.get("max_results", default=10, type=int)
+
+        cache_key, etag, cached_response = await check_response_cache("emails-primary")
+        if cached_response is not None:
+            return cached_response
+
+        try:
+            categories = get_categories_from_prompt()
+            label_map = await gmail.get_label_map()
+            category_label_ids = [
+                label_map[category.lower()]
+                for category in categories
+                if category.lower() in label_map
+            ]
+        except Exception as category_error:
+            print(f"Error getting categories or labels: {str(category_error)}")
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": f"Failed to get categories or labels: {str(category_error)}",
+                        "error_type": "categories_labels",
+                    }
+                ),
+                500,
+            )
+
+        try:
+            messages = await fetch_primary_emails(
+                max_results=max_results, label_ids_to_exclude=category_label_ids
+            )
+        except Exception as fetch_error:
+            print(f"Error fetching emails: {str(fetch_error)}")
+            print(traceback.format_exc())
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": f"Failed to fetch emails: {str(fetch_error)}",
+                        "error_type": "fetch_emails",
+                    }
+                ),
+                500,
+            )
+
+        # Metadata responses already carry everything we return
+        email_data = [
+            {
+                "id": msg.id,
+                "subject": msg.subject,
+                "from": msg.sender,
+                "date": msg.date,
+                "snippet": msg.snippet,
+            }
+            for msg in messages
+        ]
+
+        payload = {"status": "success", "count": len(email_data), "emails": email_data}
+        response_cache.put(cache_key, payload)
+        return make_cached_response(payload, etag)
+
+    except Exception as e:
+        print(f"Unexpected error in API: {str(e)}")
+        print(traceback.format_exc())
+        return (
+            jsonify({"status": "error", "message": str(e), "error_type": "general"}),
+            500,
+        )
+
+
+async def classify_and_label(email_id):
+    """Fetch a message, classify it and apply the resulting label."""
+    msg = await get_message(email_id)
+    category = await classify_message(msg)
+    label_id = await gmail.get_or_create_label(category)
+    await gmail.modify_message(email_id, add_label_ids=[label_id])
+    await asyncio.to_thread(
+        message_store.update_message_labels, [email_id], add_label_ids=[label_id]
+    )
+    return category
+
+
+async def run_job_item(job_id, email_id):
+    async with job_semaphore:
+        try:
+            await asyncio.to_thread(update_job_item, job_id, email_id, "running")
+            category = await classify_and_label(email_id)
+            await asyncio.to_thread(
+                update_job_item, job_id, email_id, "completed", category=category
+            )
+        except Exception as e:
+            print(f"Job {job_id}: error processing email {email_id}: {e}")
+            await asyncio.to_thread(
+                update_job_item, job_id, email_id, "failed", error=str(e)
+            )
+
+
+@app.route("/api/emails/classify", methods=["POST"])
+async def classify_email_api():
+    """API endpoint to classify an email and apply a label.
+
+    Passing "email_ids" or "async": true queues the work instead and returns
+    202 with a job ID that can be polled at /api/jobs/<job_id>.
+    """
+    try:
+        data = await request.get_json()
+        if not data or ("email_id" not in data and "email_ids" not in data):
+            return (
+                jsonify({"status": "error", "message": "Missing email_id in request"}),
+                400,
+            )
+
+        if "email_ids" in data or data.get("async"):
+            email_ids = data.get("email_ids") or [data.get("email_id")]
+            if not isinstance(email_ids, list) or not all(
+                isinstance(email_id, str) and email_id for email_id in email_ids
+            ):
+                return (
+                    jsonify(
+                        {
+                            "status": "error",
+                            "message": "email_ids must be a non-empty list of IDs",
+                        }
+                    ),
+                    400,
+                )
+
+            email_ids = list(dict.fromkeys(email_ids))
+            if len(background_tasks) + len(email_ids) > MAX_PENDING:
+                return (
+                    jsonify(
+                        {
+                            "status": "error",
+                            "message": f"Too many emails queued ({len(background_tasks)} pending, limit {MAX_PENDING})",
+                        }
+                    ),
+                    429,
+                )
+
+            job_id = await asyncio.to_thread(create_job, email_ids)
+            for email_id in email_ids:
+                task = asyncio.create_task(run_job_item(job_id, email_id))
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+
+            return (
+                jsonify(
+                    {
+                        "status": "accepted",
+                        "job_id": job_id,
+                        "status_url": f"/api/jobs/{job_id}",
+                    }
+                ),
+                202,
+            )
+
+        email_id = data["email_id"]
+        category = await classify_and_label(email_id)
+
+        return jsonify(
+            {"status": "success", "email_id": email_id, "category": category}
+        )
+
+    except MessageNotFoundError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        print(f"Error in API: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+async def get_job_status(job_id):
+    """Return the state and per-email results of a classification job"""
+    try:
+        job = await asyncio.to_thread(get_job, job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": "Job not found"}), 404
+        return jsonify({"status": "success", "job": job})
+    except Exception as e:
+        print(f"Error in API: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+async def fetch_feedback_details(msg_id):
+    """Return (subject, snippet, sender) for a message, or None if it can't be fetched"""
+    try:
+        msg = await get_message(msg_id)
+    except Exception as e:
+        print(f"Error fetching email details for {msg_id}: {e}")
+        return None
+    return msg.subject, msg.snippet, msg.sender_address
+
+
+@app.route("/api/feedback", methods=["POST"])
+async def submit_feedback():
+    """Endpoint to submit feedback about email classification"""
+    try:
+        data = await request.get_json()
+        if (
+            not data
+            or "message_id" not in data
+            or "ai_category" not in data
+            or "user_category" not in data
+        ):
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": "Missing required fields: message_id, ai_category, user_category",
+                    }
+                ),
+                400,
+            )
+
+        subject = data.get("subject", "")
+        snippet = data.get("snippet", "")
+        sender = data.get("sender", "")
+
+        if not subject or not snippet or not sender:
+            details = await fetch_feedback_details(data["message_id"])
+            if details:
+                subject = subject or details[0]
+                snippet = snippet or details[1]
+                sender = sender or details[2]
+
+        success = get_feedback_writer().enqueue(
+            message_id=data["message_id"],
+            subject=subject,
+            snippet=snippet,
+            ai_category=data["ai_category"],
+            user_category=data["user_category"],
+            sender=sender,
+        )
+
+        if not success:
+            return jsonify({"success": False, "error": "Failed to store feedback"}), 500
+
+        # If AI was wrong and user corrected it, apply the correct label
+        if data["ai_category"] != data["user_category"]:
+            try:
+                label_map = await gmail.get_label_map()
+                label_id = await gmail.get_or_create_label(
+                    data["user_category"], label_map=label_map
+                )
+                ai_label_id = label_map.get(data["ai_category"].lower())
+                await gmail.modify_message(
+                    data["message_id"],
+                    add_label_ids=[label_id] if label_id else None,
+                    remove_label_ids=[ai_label_id] if ai_label_id else None,
+                )
+            except Exception as e:
+                print(f"Error updating labels: {e}")
+
+        return jsonify({"success": True, "message": "Feedback recorded successfully"})
+    except Exception as e:
+        print(f"Error in feedback submission: {e}")
+        print(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/feedback/batch", methods=["POST"])
+async def submit_feedback_batch():
+    """Endpoint to submit many classification corrections in one request"""
+    try:
+        data = await request.get_json()
+        items = data.get("feedback") if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": "Request body must contain a non-empty 'feedback' array",
+                    }
+                ),
+                400,
+            )
+
+        required_fields = ("message_id", "ai_category", "user_category")
+        invalid_indexes = [
+            i
+            for i, item in enumerate(items)
+            if not isinstance(item, dict)
+            or any(field not in item for field in required_fields)
+        ]
+        if invalid_indexes:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": "Missing required fields: message_id, ai_category, user_category",
+                        "invalid_indexes": invalid_indexes,
+                    }
+                ),
+                400,
+            )
+
+        entries = {}
+        for item in items:
+            entries[item["message_id"]] = {
+                "message_id": item["message_id"],
+                "subject": item.get("subject", ""),
+                "snippet": item.get("snippet", ""),
+                "sender": item.get("sender", ""),
+                "ai_category": item["ai_category"],
+                "user_category": item["user_category"],
+            }
+        entries = list(entries.values())
+
+        missing = [
+            entry
+            for entry in entries
+            if not entry["subject"] or not entry["snippet"] or not entry["sender"]
+        ]
+        details = await gather_bounded(
+            fetch_feedback_details(entry["message_id"]) for entry in missing
+        )
+        for entry, message_details in zip(missing, details):
+            if message_details:
+                entry["subject"] = entry["subject"] or message_details[0]
+                entry["snippet"] = entry["snippet"] or message_details[1]
+                entry["sender"] = entry["sender"] or message_details[2]
+
+        # Through the writer, so older buffered corrections can't overwrite these
+        if not await asyncio.to_thread(get_feedback_writer().store_now, entries):
+            return jsonify({"success": False, "error": "Failed to store feedback"}), 500
+
+        labels_updated = 0
+        corrections = [
+            entry for entry in entries if entry["ai_category"] != entry["user_category"]
+        ]
+        if corrections:
+            try:
+                label_map = await gmail.get_label_map()
+                label_changes = {}
+                for entry in corrections:
+                    add_id = await gmail.get_or_create_label(
+                        entry["user_category"], label_map=label_map
+                    )
+                    remove_id = label_map.get(entry["ai_category"].lower())
+                    if remove_id == add_id:
+                        remove_id = None
+                    label_changes.setdefault((add_id, remove_id), []).append(
+                        entry["message_id"]
+                    )
+
+                for (add_id, remove_id), message_ids in label_changes.items():
+                    labels_updated += await gmail.batch_modify(
+                        message_ids,
+                        add_label_ids=[add_id] if add_id else None,
+                        remove_label_ids=[remove_id] if remove_id else None,
+                    )
+            except Exception as e:
+                print(f"Error updating labels: {e}")
+
+        return jsonify(
+            {
+                "success": True,
+                "message": f"Recorded feedback for {len(entries)} emails",
+                "stored": len(entries),
+                "labels_updated": labels_updated,
+            }
+        )
+    except Exception as e:
+        print(f"Error in batch feedback submission: {e}")
+        print(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/feedback/stats", methods=["GET"])
+async def get_stats():
+    """Get statistics about classification feedback"""
+    try:
+        stats = await asyncio.to_thread(get_feedback_stats)
+        return jsonify({"success": True, "stats": stats})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/prompt/update", methods=["POST"])
+async def trigger_prompt_update():
+    """Manually trigger a prompt update based on feedback"""
+    try:
+        data = await request.get_json(silent=True)
+        min_feedback = data.get("min_feedback", 20) if data else 20
+
+        success = await asyncio.to_thread(
+            run_prompt_update, min_feedback_count=min_feedback
+        )
+
+        if success is None:
+            return (
+                jsonify(
+                    {"success": False, "message": "A prompt update is already running"}
+                ),
+                409,
+            )
+        if success:
+            return jsonify({"success": True, "message": "Prompt updated successfully"})
+        else:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "message": "Not enough feedback or update failed",
+                    }
+                ),
+                400,
+            )
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.environ.get("PORT", 5001))
+    uvicorn.run("asgi_api:app", host="0.0.0.0", port=port)
@@ -0,0 +1,166 @@
+# async_gmail_service.py
+
+import asyncio
+import logging
+import httpx
+from gmail_service import get_account_credential_manager, get_credentials
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("async_gmail_service")
+
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1/users/me"
+
+
+class AsyncGmailClient:
+    """
+    Minimal async client for the Gmail REST endpoints used by the API. All
+    requests share one pooled httpx.AsyncClient and one set of credentials,
+    which the credential manager refreshes and saves.
+    """
+
+    def __init__(self, creds, credential_manager, max_connections=100, timeout=30.0):
+        self._creds = creds
+        self._credential_manager = credential_manager
+        self._refresh_lock = asyncio.Lock()
+        self._http = httpx.AsyncClient(
+            base_url=GMAIL_API_URL,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+
+    async def _refresh_credentials(self, stale_token=None):
+        # Concurrent callers share one refresh: whoever gets the lock second
+        # sees the new token and skips it
+        async with self._refresh_lock:
+            if not self._creds.valid or self._creds.token == stale_token:
+                logger.info("Refreshing Gmail credentials")
+                # google-auth only ships a blocking transport
+                await asyncio.to_thread(
+                    self._credential_manager.refresh, stale_token or self._creds.token
+                )
+
+    async def _request(self, method, path, params=None, json=None):
+        if not self._creds.valid:
+            await self._refresh_credentials()
+
+        if params:
+            params = {key: value for key, value in params.items() if value is not None}
+
+        for attempt in range(2):
+            token = self._creds.token
+            response = await self._http.request(
+                method,
+                path,
+                params=params,
+                json=json,
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            # Token revoked or expired between checks: refresh once and retry
+            if response.status_code == 401 and attempt == 0:
+                await self._refresh_credentials(stale_token=token)
+                continue
+            break
+
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    async def get_profile(self):
+        return await self._request("GET", "/profile")
+
+    async def list_messages(
+        self, q=None, max_results=100, page_token=None, label_ids=None
+    ):
+        return await self._request(
+            "GET",
+            "/messages",
+            params={
+                "q": q,
+                "maxResults": max_results,
+                "pageToken": page_token,
+                "labelIds": label_ids,
+                "includeSpamTrash": "false",
+            },
+        )
+
+    async def get_message(self, msg_id, format="full", metadata_headers=None):
+        return await self._request(
+            "GET",
+            f"/messages/{msg_id}",
+            params={"format": format, "metadataHeaders": metadata_headers},
+        )
+
+    async def modify_message(self, msg_id, add_label_ids=None, remove_label_ids=None):
+        body = {}
+        if add_label_ids:
+            body["addLabelIds"] = list(add_label_ids)
+        if remove_label_ids:
+            body["removeLabelIds"] = list(remove_label_ids)
+        return await self._request("POST", f"/messages/{msg_id}/modify", json=body)
+
+    async def batch_modify(
+        self, msg_ids, add_label_ids=None, remove_label_ids=None, chunk_size=1000
+    ):
+        """Apply the same label changes to many messages with batchModify."""
+        body = {}
+        if add_label_ids:
+            body["addLabelIds"] = list(add_label_ids)
+        if remove_label_ids:
+            body["removeLabelIds"] = list(remove_label_ids)
+        if not body or not msg_ids:
+            return 0
+
+        for start in range(0, len(msg_ids), chunk_size):
+            await self._request(
+                "POST",
+                "/messages/batchModify",
+                json={"ids": list(msg_ids[start : start + chunk_size]), **body},
+            )
+        return len(msg_ids)
+
+    async def get_label_map(self):
+        """Return a mapping of lower-cased label name to label ID."""
+        response = await self._request("GET", "/labels")
+        return {
+            label["name"].lower(): label["id"] for label in response.get("labels", [])
+        }
+
+    async def get_or_create_label(self, label_name, label_map=None):
+        """Retrieve label ID if it exists, or create it if not."""
+        if label_map is None:
+            label_map = await self.get_label_map()
+
+        label_id = label_map.get(label_name.lower())
+        if label_id:
+            return label_id
+
+        logger.info(f"Label '{label_name}' not found, creating new label")
+        created_label = await self._request(
+            "POST",
+            "/labels",
+            json={
+                "name": label_name,
+                "labelListVisibility": "labelShow",
+                "messageListVisibility": "show",
+            },
+        )
+        label_map[label_name.lower()] = created_label["id"]
+        return created_label["id"]
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+async def get_async_gmail_client(max_connections=100):
+    """Load credentials (off the event loop) and return a pooled client."""
+    creds = await asyncio.to_thread(get_credentials)
+    manager = get_account_credential_manager()
+    manager.start_background_refresh()
+    return AsyncGmailClient(creds, manager, max_connections=max_connections)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import time
+import sqlite3
+import logging
+import argparse
+import statistics
+from jinja2 import Template
+from email_classifier import (
+    PROMPT_FILE,
+    build_messages,
+    count_message_tokens,
+    get_completion_options,
+    get_model,
+    get_openai,
+    get_prompt_parts,
+    parse_categories,
+)
+from utils.feedback_db import DB_PATH
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("benchmark_prompt")
+
+
+def load_samples(limit):
+    """Read (subject, snippet) pairs from the feedback database."""
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    rows = conn.execute(
+        "SELECT subject, snippet FROM classification_feedback ORDER BY id DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+    conn.close()
+    return [(subject or "", snippet or "") for subject, snippet in rows]
+
+
+def legacy_messages(template, subject, snippet):
+    """The previous layout: the whole prompt file rendered as one user message."""
+    prompt = template.render(subject=subject, snippet=snippet)
+    return [{"role": "user", "content": prompt.strip()}]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(name, samples, make_messages, options, live):
+    """
+    Print the mean prompt tokens for a layout and, if live, the billed tokens
+    and latency of requests made with the given completion options.
+    """
+    tokens = [count_message_tokens(make_messages(*sample)) for sample in samples]
+    print(f"{name}: mean {statistics.mean(tokens):.1f} prompt tokens (tiktoken)")
+    if not live:
+        return
+
+    latencies = []
+    prompt_tokens = []
+    cached_tokens = []
+    for sample in samples:
+        start = time.time()
+        response = get_openai().chat.completions.create(
+            messages=make_messages(*sample), **options
+        )
+        latencies.append(time.time() - start)
+        prompt_tokens.append(response.usage.prompt_tokens)
+        details = getattr(response.usage, "prompt_tokens_details", None)
+        cached_tokens.append(getattr(details, "cached_tokens", 0) or 0)
+
+    print(
+        f"{name}: {statistics.mean(prompt_tokens):.1f} billed prompt tokens, "
+        f"{sum(cached_tokens) / max(sum(prompt_tokens), 1):.0%} cached, "
+        f"latency p50 {percentile(latencies, 50) * 1000:.0f}ms "
+        f"p95 {percentile(latencies, 95) * 1000:.0f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the legacy and system/user prompt layouts"
+    )
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument(
+        "--live", action="store_true", help="also call the API to measure latency"
+    )
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples)
+    if not samples:
+        print(f"No feedback samples found in {DB_PATH}")
+        return
+
+    with open(PROMPT_FILE, "r") as f:
+        prompt_text = f.read()
+    template = Template(prompt_text)
+
+    print(f"{len(samples)} samples, model {get_model()}")
+    # The legacy layout has no code list, so its replies are category names
+    measure(
+        "before",
+        samples,
+        lambda subject, snippet: legacy_messages(template, subject, snippet),
+        get_completion_options(("", template, parse_categories(prompt_text))),
+        args.live,
+    )
+    measure(
+        "after",
+        samples,
+        build_messages,
+        get_completion_options(get_prompt_parts()),
+        args.live,
+    )
+
+
+if __name__ == "__main__":
+    main()
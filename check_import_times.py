@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import re
+import sys
+import argparse
+import subprocess
+
+# Cold-import budgets in milliseconds. Commands like label_emails.py run from
+# cron and pay the import cost on every run, so heavy dependencies (openai,
+# tiktoken, jinja2, the Google API client) should only be imported when used.
+IMPORT_BUDGETS_MS = {
+    "email_classifier": 60,
+    "gmail_service": 200,
+    "label_emails": 300,
+    "api": 600,
+}
+
+_IMPORT_TIME_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)")
+
+
+def measure_import_ms(module):
+    """Import a module in a fresh interpreter and return its cumulative import time."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+    for line in reversed(result.stderr.splitlines()):
+        match = _IMPORT_TIME_LINE.match(line)
+        if match and match.group(2) == module:
+            return int(match.group(1)) / 1000
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check cold import times against their budgets"
+    )
+    parser.add_argument("modules", nargs="*", help="modules to check (default: all)")
+    parser.add_argument(
+        "--runs", type=int, default=3, help="take the fastest of this many imports"
+    )
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in args.modules or IMPORT_BUDGETS_MS:
+        elapsed = min(measure_import_ms(module) for _ in range(args.runs))
+        budget = IMPORT_BUDGETS_MS.get(module)
+        status = "ok" if budget is None or elapsed <= budget else "OVER BUDGET"
+        over_budget |= status != "ok"
+        print(f"{module}: {elapsed:.0f}ms (budget {budget or '-'}ms) {status}")
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
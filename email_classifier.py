@@ -1,121 +1,508 @@
 import os
-import ssl
-import email
 import re
+import math
+import difflib
+import html
 import logging
 from dotenv import load_dotenv
-import openai
 import traceback
-from jinja2 import Template
-from gmail_service import get_gmail_service
-import tiktoken
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+import threading
+
+# openai, tiktoken and jinja2 are slow to import, so they're imported on first
+# use; importing this module has no side effects beyond defining it.
 logger = logging.getLogger("email_classifier")
 
-# Load environment variables
-logger.info("Loading environment variables")
-load_dotenv()
-EMAIL = os.getenv("EMAIL_ADDRESS")
-PASSWORD = os.getenv("EMAIL_PASSWORD")
-openai.api_key = os.getenv("OPENAI_API_KEY")
+PROMPT_FILE = "email_classifier_prompt.txt"
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+# Used when a reply can't be mapped to a category or the request fails
+FALLBACK_CATEGORY = "Other"
+# Enough for a category name if the reply can't be constrained to a code
+MAX_COMPLETION_TOKENS = 5
+_code_bias_cache = {}
+
+_env_loaded = False
+_openai = None
+_openai_lock = threading.Lock()
+
+
+def load_environment():
+    """Load variables from .env into the environment (once)."""
+    global _env_loaded
+    if not _env_loaded:
+        logger.info("Loading environment variables")
+        load_dotenv()
+        _env_loaded = True
+
+
+def get_model():
+    """Return the classifier model, from OPENAI_CLASSIFIER_MODEL if set."""
+    load_environment()
+    return os.getenv("OPENAI_CLASSIFIER_MODEL", DEFAULT_MODEL)
+
+
+def get_openai():
+    """
+    Return the openai module, importing it and loading the API key from the
+    environment (and .env) on first use.
+    """
+    global _openai
+    if _openai is None:
+        with _openai_lock:
+            if _openai is None:
+                load_environment()
+                import openai
+
+                openai.api_key = os.getenv("OPENAI_API_KEY")
+                if not openai.api_key:
+                    logger.warning("OPENAI_API_KEY not found in environment variables")
+                else:
+                    logger.info("OpenAI API key loaded successfully")
+                _openai = openai
+    return _openai
+
+
+def get_encoding(model=None):
+    """Return the tiktoken encoding for a model (loaded once, then cached by tiktoken)."""
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model or get_model())
 
-if not openai.api_key:
-    logger.warning("OPENAI_API_KEY not found in environment variables")
-else:
-    logger.info("OpenAI API key loaded successfully")
 
 # Initialize token counter
 total_tokens_used = 0
 total_prompt_tokens = 0
 total_completion_tokens = 0
+_token_lock = threading.Lock()
 
 
-def count_tokens(text, model="gpt-3.5-turbo"):
+def count_tokens(text, model=None):
     """Count the number of tokens in a text string."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        encoding = get_encoding(model)
         return len(encoding.encode(text))
     except Exception as e:
         logger.error(f"Error counting tokens: {e}")
         return 0
 
 
+def parse_categories(prompt_text):
+    """Extract the category names from the Categories section of a prompt."""
+    categories_match = re.search(r"Categories:\s*\n((?:- .*\n)+)", prompt_text)
+    if not categories_match:
+        return []
+    # Extract each category (removing the "- " prefix)
+    return [
+        line.strip()[2:]
+        for line in categories_match.group(1).split("\n")
+        if line.strip().startswith("- ")
+    ]
+
+
 def get_categories_from_prompt():
-    """Extract categories from the email_classifier_prompt.txt file"""
-    logger.info("Extracting categories from prompt file")
+    """Return the categories from the email_classifier_prompt.txt file"""
     try:
-        with open("email_classifier_prompt.txt", "r") as file:
-            logger.info("Reading email_classifier_prompt.txt")
-            content = file.read()
-            # Look for the Categories section and extract the categories
-            categories_match = re.search(r"Categories:\s*\n((?:- .*\n)+)", content)
-            if categories_match:
-                categories_section = categories_match.group(1)
-                # Extract each category (removing the "- " prefix)
-                categories = [
-                    line.strip()[2:]
-                    for line in categories_section.split("\n")
-                    if line.strip().startswith("- ")
-                ]
-                logger.info(f"Found {len(categories)} categories: {categories}")
-                return categories
-            logger.warning("No categories found in the prompt file")
-            return []
+        return list(get_prompt_parts()[2])
     except Exception as e:
         logger.error(f"Failed to read categories from prompt file: {e}")
         logger.debug(traceback.format_exc())
         return []
 
 
-# Classify email with OpenAI
-def classify_email(subject, snippet):
-    global total_tokens_used, total_prompt_tokens, total_completion_tokens
+# Marks the end of the static instructions in the prompt file
+EMAIL_MARKER = "Classify the following:"
 
-    logger.info(f"Classifying email - Subject: '{subject[:30]}...' (truncated)")
+MAX_SUBJECT_CHARS = 200
+MAX_SNIPPET_CHARS = 500
+
+# Answers below this confidence are retried with part of the email body,
+# which is capped at this many tokens (estimated at 4 characters per token
+# when the encoding isn't available)
+DEFAULT_BODY_CONFIDENCE_THRESHOLD = 0.75
+DEFAULT_BODY_MAX_TOKENS = 400
+CHARS_PER_TOKEN = 4
+
+# Zero-width and other invisible characters used as padding and trackers in
+# marketing emails (soft hyphen, combining grapheme joiner, ZWSP/ZWNJ/ZWJ,
+# bidi marks, word joiner, BOM, ...)
+_INVISIBLE_CHARS = re.compile(
+    "[\u00ad\u034f\u061c\u115f\u1160\u17b4\u17b5\u180e"
+    "\u200b-\u200f\u202a-\u202e\u2060-\u206f\u3164\ufeff\uffa0]"
+)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_email_text(text, max_chars):
+    """
+    Clean up a subject or snippet before it is put in the prompt: decode HTML
+    entities, drop invisible characters, collapse whitespace and cap the length.
+    """
+    if not text:
+        return ""
+    text = html.unescape(text)
+    text = _INVISIBLE_CHARS.sub("", text)
+    text = _WHITESPACE.sub(" ", text).strip()
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip()
+    return text
+
+
+def format_output_instructions(categories):
+    """Ask for the category's number only, so one output token is enough."""
+    codes = "\n".join(f"{code}. {name}" for code, name in enumerate(categories, 1))
+    return f"Reply with only the number of the category:\n{codes}"
+
+
+def split_prompt(prompt_text):
+    """
+    Split the prompt file into a static system prompt, a template for the
+    per-email user message and the category list. Everything before
+    EMAIL_MARKER goes in the system prompt, followed by the numbered category
+    codes the model must answer with; the lines with template variables make
+    up the user message. Comment lines are dropped.
+    """
+    from jinja2 import Template
+
+    categories = parse_categories(prompt_text)
+    lines = [line for line in prompt_text.splitlines() if not line.startswith("#")]
+    head, marker, tail = "\n".join(lines).partition(EMAIL_MARKER)
+    if not marker:
+        # No marker: fall back to sending the whole rendered prompt as the user message
+        return "", Template(head.strip()), categories
+
+    email_lines = [line for line in tail.splitlines() if "{{" in line]
+    system_prompt = head.strip()
+    if categories:
+        # The answer format is fixed here, replacing the file's own instructions
+        system_prompt += "\n\n" + format_output_instructions(categories)
+    else:
+        instructions = [
+            line for line in tail.splitlines() if line.strip() and "{{" not in line
+        ]
+        system_prompt += "\n\n" + "\n".join(instructions)
+    return system_prompt.strip(), Template("\n".join(email_lines)), categories
+
+
+_prompt_parts = None
+_prompt_mtime = None
+_prompt_lock = threading.Lock()
+
+
+def get_prompt_parts():
+    """
+    Return (system prompt, user template, categories), reloading when the
+    prompt file changes.
+    """
+    global _prompt_parts, _prompt_mtime
+
+    mtime = os.stat(PROMPT_FILE).st_mtime_ns
+    with _prompt_lock:
+        if _prompt_parts is None or mtime != _prompt_mtime:
+            logger.info("Loading classification prompt template")
+            with open(PROMPT_FILE, "r") as file:
+                _prompt_parts = split_prompt(file.read())
+            _prompt_mtime = mtime
+        return _prompt_parts
+
+
+def get_body_settings():
+    """
+    Return (confidence threshold, body token budget), from
+    BODY_CONFIDENCE_THRESHOLD and BODY_MAX_TOKENS if set.
+    """
+    load_environment()
+    return (
+        float(
+            os.getenv("BODY_CONFIDENCE_THRESHOLD", DEFAULT_BODY_CONFIDENCE_THRESHOLD)
+        ),
+        int(os.getenv("BODY_MAX_TOKENS", DEFAULT_BODY_MAX_TOKENS)),
+    )
+
+
+def prepare_body(body, max_tokens):
+    """Normalize body text and cut it to at most max_tokens tokens."""
+    text = normalize_email_text(body, max_tokens * CHARS_PER_TOKEN)
     try:
-        # Load and render prompt
-        logger.info("Loading classification prompt template")
-        with open("email_classifier_prompt.txt", "r") as file:
-            template = Template(file.read())
-            prompt = template.render(subject=subject, snippet=snippet)
-            logger.debug(f"Generated prompt: {prompt[:100]}... (truncated)")
-
-        # Count prompt tokens
-        prompt_tokens = count_tokens(prompt)
+        encoding = get_encoding()
+        tokens = encoding.encode(text)
+    except Exception:
+        return text
+    if len(tokens) > max_tokens:
+        text = encoding.decode(tokens[:max_tokens]).rstrip()
+    return text
+
+
+def build_messages(subject, snippet, prompt_parts=None, body=None):
+    """
+    Build the chat messages for classifying an email. The system message is
+    the same for every email; only the short user message varies. prompt_parts (from split_prompt)
+    defaults to the current prompt file. body, a prepared excerpt of the
+    email body (see prepare_body), is sent in place of the snippet, which
+    Gmail takes from the start of the body anyway.
+    """
+    system_prompt, user_template, _ = prompt_parts or get_prompt_parts()
+    user_prompt = user_template.render(
+        subject=normalize_email_text(subject, MAX_SUBJECT_CHARS),
+        snippet=body or normalize_email_text(snippet, MAX_SNIPPET_CHARS),
+    )
+    messages = [{"role": "user", "content": user_prompt.strip()}]
+    if system_prompt:
+        messages.insert(0, {"role": "system", "content": system_prompt})
+    logger.debug(f"Generated user message: {user_prompt[:100]}... (truncated)")
+    return messages
+
+
+def count_message_tokens(messages, model=None):
+    """Count the content tokens of a list of chat messages."""
+    return sum(count_tokens(message["content"], model) for message in messages)
+
+
+def record_token_usage(usage):
+    """Add the usage of one OpenAI response to the running totals."""
+    global total_tokens_used, total_completion_tokens
+
+    with _token_lock:
+        total_completion_tokens += usage.completion_tokens
+        total_tokens_used += usage.total_tokens
+
+    logger.info(
+        f"Token usage - Prompt: {usage.prompt_tokens}, Completion: {usage.completion_tokens}, Total: {usage.total_tokens}"
+    )
+
+
+def get_code_logit_bias(count):
+    """
+    Return a logit_bias that only allows the tokens for category codes
+    1..count, or {} if a code isn't a single token (or the encoding can't be
+    loaded) and the reply is left unconstrained.
+    """
+    if count not in _code_bias_cache:
+        bias = {}
+        try:
+            encoding = get_encoding()
+            tokens = [encoding.encode(str(code)) for code in range(1, count + 1)]
+            if all(len(token) == 1 for token in tokens):
+                bias = {str(token[0]): 100 for token in tokens}
+        except Exception as e:
+            logger.warning(f"Could not build category code logit bias: {e}")
+        _code_bias_cache[count] = bias
+    return _code_bias_cache[count]
+
+
+def parse_category(reply, categories):
+    """
+    Map a model reply to one of the canonical categories. Replies are
+    expected to be category codes; names, "Category: X" and sentences are
+    matched as a fallback, and anything unrecognized becomes "Other".
+    """
+    reply = (reply or "").strip()
+    if not categories:
+        return reply or FALLBACK_CATEGORY
+
+    code_match = re.match(r"\d+", reply)
+    if code_match and 1 <= int(code_match.group()) <= len(categories):
+        return categories[int(code_match.group()) - 1]
+
+    by_name = {name.lower(): name for name in categories}
+    cleaned = re.sub(r"^(category|label)\s*[:-]\s*", "", reply, flags=re.IGNORECASE)
+    cleaned = cleaned.strip(" .'\"*").lower()
+    if cleaned in by_name:
+        return by_name[cleaned]
+
+    # Longest first so "Job Applications" wins over a shorter name inside it
+    for name in sorted(by_name, key=len, reverse=True):
+        if re.search(rf"\b{re.escape(name)}\b", cleaned):
+            return by_name[name]
+
+    close = difflib.get_close_matches(cleaned, by_name, n=1, cutoff=0.6)
+    if close:
+        return by_name[close[0]]
+
+    fallback = FALLBACK_CATEGORY if FALLBACK_CATEGORY in categories else categories[-1]
+    logger.warning(f"Unrecognized category reply '{reply}', using '{fallback}'")
+    return fallback
+
+
+def has_category_codes(prompt_parts):
+    """Whether split_prompt added the numbered category codes to the system prompt."""
+    system_prompt, _, categories = prompt_parts
+    return bool(categories) and system_prompt.endswith(
+        format_output_instructions(categories)
+    )
+
+
+def get_completion_options(prompt_parts):
+    """
+    Completion options for a prompt from split_prompt. The reply is
+    constrained to a category code only if the prompt lists the codes;
+    otherwise the model answers with a name, which parse_category maps.
+    """
+    categories = prompt_parts[2]
+    options = {
+        "model": get_model(),
+        "temperature": 0,
+        "max_tokens": MAX_COMPLETION_TOKENS,
+    }
+    if categories:
+        logit_bias = (
+            get_code_logit_bias(len(categories))
+            if has_category_codes(prompt_parts)
+            else None
+        )
+        if logit_bias:
+            options["logit_bias"] = logit_bias
+            options["max_tokens"] = 1
+        options["logprobs"] = True
+    return options
+
+
+def prepare_request(subject, snippet, body=None):
+    """Build the messages and constrained completion options for an email."""
+    global total_prompt_tokens
+
+    prompt_parts = get_prompt_parts()
+    messages = build_messages(subject, snippet, prompt_parts, body)
+
+    # Count prompt tokens
+    prompt_tokens = count_message_tokens(messages)
+    with _token_lock:
         total_prompt_tokens += prompt_tokens
 
+    return messages, prompt_parts[2], get_completion_options(prompt_parts)
+
+
+def read_response(response, categories):
+    """Return (category, confidence) from a chat completion response."""
+    record_token_usage(response.usage)
+
+    choice = response.choices[0]
+    category = parse_category(choice.message.content, categories)
+    confidence = None
+    logprobs = getattr(choice, "logprobs", None)
+    if logprobs and logprobs.content:
+        confidence = math.exp(logprobs.content[0].logprob)
+    logger.info(f"Classification result: '{category}' (confidence: {confidence})")
+    return category, confidence
+
+
+def classify_email_with_confidence(subject, snippet, body=None):
+    """
+    Classify an email into one of the prompt's categories. Returns
+    (category, confidence), where confidence is the probability the model
+    gave its answer, or None if it isn't available.
+    """
+    logger.info(f"Classifying email - Subject: '{subject[:30]}...' (truncated)")
+    try:
+        messages, categories, options = prepare_request(subject, snippet, body)
+
         # Send to OpenAI
         logger.info("Sending request to OpenAI API")
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt.strip()}],
-        )
+        response = get_openai().chat.completions.create(messages=messages, **options)
+        return read_response(response, categories)
+    except Exception as e:
+        logger.error(f"Failed to classify email: {e}")
+        logger.debug(traceback.format_exc())
+        return FALLBACK_CATEGORY, None
 
-        # Track token usage
-        completion_tokens = response.usage.completion_tokens
-        prompt_tokens_used = response.usage.prompt_tokens
-        total_tokens = response.usage.total_tokens
 
-        total_completion_tokens += completion_tokens
-        total_tokens_used += total_tokens
+def needs_body(confidence, threshold):
+    """Whether a snippet classification is unsure enough to retry with the body."""
+    return confidence is not None and confidence < threshold
 
-        logger.info(
-            f"Token usage - Prompt: {prompt_tokens_used}, Completion: {completion_tokens}, Total: {total_tokens}"
-        )
 
-        category = response.choices[0].message.content.strip()
-        logger.info(f"Classification result: '{category}'")
-        return category
+def pick_body_result(first, retried):
+    """Keep the snippet result if retrying with the body failed."""
+    return first if retried[1] is None else retried
+
+
+def classify_email_with_body_fallback(subject, snippet, get_body):
+    """
+    Classify from the subject and snippet, and only if the answer is
+    low-confidence, call get_body(max_chars) for the email's body text and
+    classify again with a token-budgeted excerpt of it. Fetching bodies is
+    slow and they cost far more tokens than snippets, so confident answers
+    never pay for it. Returns (category, confidence).
+    """
+    result = classify_email_with_confidence(subject, snippet)
+    threshold, max_tokens = get_body_settings()
+    if not needs_body(result[1], threshold):
+        return result
+
+    logger.info(f"Low confidence ({result[1]:.2f}), classifying again with the body")
+    try:
+        body = prepare_body(get_body(max_tokens * CHARS_PER_TOKEN), max_tokens)
+    except Exception as e:
+        logger.error(f"Failed to get email body: {e}")
+        return result
+    if len(body) <= len(normalize_email_text(snippet, MAX_SNIPPET_CHARS)):
+        # The snippet already was the whole body
+        return result
+    return pick_body_result(
+        result, classify_email_with_confidence(subject, snippet, body)
+    )
+
+
+# Classify email with OpenAI
+def classify_email(subject, snippet):
+    return classify_email_with_confidence(subject, snippet)[0]
+
+
+_async_client = None
+
+
+def get_async_openai_client():
+    """Return the shared AsyncOpenAI client (one connection pool per process)."""
+    global _async_client
+    if _async_client is None:
+        openai = get_openai()
+        _async_client = openai.AsyncOpenAI(api_key=openai.api_key)
+    return _async_client
+
+
+async def classify_email_with_confidence_async(subject, snippet, body=None):
+    """Async variant of classify_email_with_confidence."""
+    logger.info(f"Classifying email - Subject: '{subject[:30]}...' (truncated)")
+    try:
+        messages, categories, options = prepare_request(subject, snippet, body)
+
+        logger.info("Sending async request to OpenAI API")
+        response = await get_async_openai_client().chat.completions.create(
+            messages=messages, **options
+        )
+        return read_response(response, categories)
     except Exception as e:
         logger.error(f"Failed to classify email: {e}")
         logger.debug(traceback.format_exc())
-        return "Other"
+        return FALLBACK_CATEGORY, None
+
+
+async def classify_email_with_body_fallback_async(subject, snippet, get_body):
+    """
+    Async variant of classify_email_with_body_fallback; get_body(max_chars)
+    is a coroutine function.
+    """
+    result = await classify_email_with_confidence_async(subject, snippet)
+    threshold, max_tokens = get_body_settings()
+    if not needs_body(result[1], threshold):
+        return result
+
+    logger.info(f"Low confidence ({result[1]:.2f}), classifying again with the body")
+    try:
+        body = prepare_body(await get_body(max_tokens * CHARS_PER_TOKEN), max_tokens)
+    except Exception as e:
+        logger.error(f"Failed to get email body: {e}")
+        return result
+    if len(body) <= len(normalize_email_text(snippet, MAX_SNIPPET_CHARS)):
+        return result
+    return pick_body_result(
+        result, await classify_email_with_confidence_async(subject, snippet, body)
+    )
+
+
+async def classify_email_async(subject, snippet):
+    """Async variant of classify_email using the shared AsyncOpenAI client."""
+    return (await classify_email_with_confidence_async(subject, snippet))[0]
 
 
 def get_token_usage():
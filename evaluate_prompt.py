@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import json
+import argparse
+from utils.prompt_eval import compare_prompts, load_eval_rows, should_promote
+from utils.prompt_updater import read_current_prompt
+
+
+def print_report(name, report):
+    latency = (
+        f"p50 {report['latency_p50'] * 1000:.0f}ms, p95 {report['latency_p95'] * 1000:.0f}ms"
+        if report["latency_p95"] is not None
+        else "n/a"
+    )
+    print(
+        f"{name}: accuracy {report['accuracy']:.3f} on {report['evaluated']} emails "
+        f"({report['errors']} failed), {report['prompt_tokens_per_email']:.1f} prompt tokens/email, "
+        f"latency {latency}"
+    )
+    for category, stats in sorted(report["per_category"].items()):
+        print(
+            f"  {category}: {stats['correct']}/{stats['total']} ({stats['recall']:.0%})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Evaluate a candidate prompt against the current one on feedback.db"
+    )
+    parser.add_argument("candidate", help="path to the candidate prompt file")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--confusion", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.candidate, "r") as f:
+        candidate_prompt = f.read()
+
+    current, candidate = compare_prompts(
+        read_current_prompt(), candidate_prompt, load_eval_rows(args.limit)
+    )
+    print_report("current", current)
+    print_report("candidate", candidate)
+    if args.confusion:
+        print(
+            json.dumps(
+                {"current": current["confusion"], "candidate": candidate["confusion"]},
+                indent=2,
+            )
+        )
+
+    promote, reasons = should_promote(current, candidate)
+    print("promote" if promote else f"reject: {'; '.join(reasons)}")
+
+
+if __name__ == "__main__":
+    main()
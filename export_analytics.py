@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import time
+import logging
+import argparse
+from utils.parquet_export import EXPORT_DIR, export_all
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("export_analytics")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Append new feedback and prompt history to Parquet files for analytics"
+    )
+    parser.add_argument("--export-dir", default=EXPORT_DIR)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        help="keep running, exporting every INTERVAL seconds",
+    )
+    args = parser.parse_args()
+
+    while True:
+        results = export_all(args.export_dir)
+        logger.info(f"Export finished: {results}")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,54 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import requests
-import json
-import os
-from utils.feedback_db import init_db, get_feedback_stats
-from utils.prompt_updater import read_current_prompt, update_prompt_from_feedback
+from datetime import datetime, timedelta
+from utils.feedback_db import (
+    TIME_BUCKETS,
+    init_db,
+    get_feedback_stats,
+    get_feedback_time_series,
+    get_feedback_version,
+    get_misclassified_feedback,
+)
+from utils.excel_conversion import export_feedback_to_excel
+from utils.prompt_updater import read_current_prompt
+from utils.update_trigger import run_prompt_update
+
+PAGE_SIZE = 50
+# Each time range with the bucket size that keeps its chart to a few hundred points
+TIME_RANGES = {
+    "Last 7 days": (7, "hour"),
+    "Last 30 days": (30, "day"),
+    "Last 365 days": (365, "week"),
+    "All": (None, "month"),
+}
+
+
+@st.cache_resource
+def initialize():
+    # Once per server process rather than on every rerun
+    init_db()
+
+
+# The cached loaders take the feedback version as an argument, so their
+# results are reused across reruns until new feedback is stored
+
+
+@st.cache_data(max_entries=4)
+def load_stats(version):
+    return get_feedback_stats()
 
-# Initialize the database
-init_db()
+
+@st.cache_data(max_entries=16)
+def load_time_series(version, bucket, since):
+    return pd.DataFrame(get_feedback_time_series(bucket, since))
+
+
+@st.cache_data(max_entries=64)
+def load_misclassified(version, before_id, user_category):
+    return get_misclassified_feedback(PAGE_SIZE, before_id, user_category)
+
+
+initialize()
 
 st.set_page_config(
     page_title="📊 Email Classification Feedback Dashboard", layout="wide"
@@ -19,20 +59,36 @@ st.title("📊 Email Classification Feedback Dashboard")
 st.sidebar.header("Actions")
 
 if st.sidebar.button("Refresh Data"):
-    st.experimental_rerun()
+    st.rerun()
 
 if st.sidebar.button("Trigger Prompt Update"):
     with st.spinner("Updating prompt..."):
-        success = update_prompt_from_feedback(
+        success = run_prompt_update(
             min_feedback_count=10
         )  # Lower threshold for manual updates
-        if success:
+        if success is None:
+            st.sidebar.warning("A prompt update is already running")
+        elif success:
+            # Feedback was marked as processed, which the version doesn't track
+            st.cache_data.clear()
             st.sidebar.success("✅ Prompt updated successfully!")
         else:
             st.sidebar.error("❌ Not enough feedback or update failed")
 
+if st.sidebar.button("Export Feedback to Excel"):
+    with st.spinner("Exporting feedback..."):
+        export_feedback_to_excel("feedback_export.xlsx")
+    with open("feedback_export.xlsx", "rb") as f:
+        st.sidebar.download_button(
+            label="Download Excel",
+            data=f,
+            file_name="feedback_export.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+
 # Get feedback statistics
-stats = get_feedback_stats()
+version = get_feedback_version()
+stats = load_stats(version)
 
 # Display overall metrics
 col1, col2, col3 = st.columns(3)
@@ -44,20 +100,35 @@ with col3:
     accuracy = stats["accuracy"] * 100 if stats["total_feedback"] > 0 else 0
     st.metric("Accuracy", f"{accuracy:.1f}%")
 
+# Display accuracy over time
+st.header("Accuracy Over Time")
+col1, col2 = st.columns(2)
+with col1:
+    time_range = st.selectbox("Time range", list(TIME_RANGES), index=1)
+days, default_bucket = TIME_RANGES[time_range]
+with col2:
+    bucket = st.selectbox(
+        "Group by", list(TIME_BUCKETS), index=list(TIME_BUCKETS).index(default_bucket)
+    )
+
+# Truncated to the day so the cache key stays the same between reruns
+since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d") if days else None
+series = load_time_series(version, bucket, since)
+if not series.empty:
+    series = series.set_index("bucket")
+    st.line_chart(series["accuracy"] * 100, y_label="Accuracy (%)")
+    st.bar_chart(series[["total", "incorrect"]], y_label="Feedback", stack=False)
+else:
+    st.info("No feedback in this time range")
+
 # Display category distribution
 st.header("Category Distribution")
 if stats["category_distribution"]:
-    categories = list(stats["category_distribution"].keys())
-    counts = list(stats["category_distribution"].values())
-
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.bar(categories, counts)
-    ax.set_xlabel("Category")
-    ax.set_ylabel("Count")
-    ax.set_title("Email Categories Distribution")
-    plt.xticks(rotation=45, ha="right")
-    plt.tight_layout()
-    st.pyplot(fig)
+    st.bar_chart(
+        pd.Series(stats["category_distribution"], name="Count"),
+        x_label="Category",
+        y_label="Count",
+    )
 else:
     st.info("No category data available yet")
 
@@ -78,6 +149,46 @@ if stats["common_errors"]:
 else:
     st.info("No misclassification data available yet")
 
+# Browse misclassified emails, one page at a time
+st.header("Misclassified Emails")
+category_filter = st.selectbox(
+    "Correct category", ["All"] + list(stats["category_distribution"])
+)
+user_category = None if category_filter == "All" else category_filter
+
+# Stack of the before_id used for each page shown so far
+if (
+    "misclassified_pages" not in st.session_state
+    or st.session_state.misclassified_filter != user_category
+):
+    st.session_state.misclassified_filter = user_category
+    st.session_state.misclassified_pages = [None]
+pages = st.session_state.misclassified_pages
+
+rows = load_misclassified(version, pages[-1], user_category)
+if rows:
+    st.dataframe(
+        pd.DataFrame(rows).set_index("id"),
+        column_config={
+            "ai_category": "AI Prediction",
+            "user_category": "Correct Category",
+        },
+    )
+else:
+    st.info("No misclassified emails")
+
+col1, col2, col3 = st.columns([1, 1, 4])
+with col1:
+    if st.button("Newer", disabled=len(pages) == 1):
+        pages.pop()
+        st.rerun()
+with col2:
+    if st.button("Older", disabled=len(rows) < PAGE_SIZE):
+        pages.append(rows[-1]["id"])
+        st.rerun()
+with col3:
+    st.caption(f"Page {len(pages)}")
+
 # Display current prompt
 st.header("Current Classification Prompt")
 current_prompt = read_current_prompt()
@@ -1,48 +1,123 @@
 # gmail_service.py
 
 import os.path
-import pickle
 import logging
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+import threading
+import time
+import httplib2
+from utils.credential_manager import get_credential_manager
+
+# The Google client libraries are imported where they're used: they're slow
+# to import and many commands never build a service
 logger = logging.getLogger("gmail_service")
 
-SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
+# Managing filters needs the settings scope. Tokens authorized before it was
+# added still work for everything else; see get_credentials.
+SETTINGS_SCOPE = "https://www.googleapis.com/auth/gmail.settings.basic"
+SCOPES = ["https://www.googleapis.com/auth/gmail.modify", SETTINGS_SCOPE]
+
+# Per-account tokens live here; the default account keeps using token.json
+TOKEN_DIR = "tokens"
+
+
+def get_token_path(account=None):
+    """Return the credential file for an account (None is the default account)."""
+    if account is None:
+        return "token.json"
+    return os.path.join(TOKEN_DIR, f"{account}.json")
+
 
+def get_legacy_token_path(account=None):
+    """Pickled credential file used by earlier versions; converted on first use."""
+    if account is None:
+        return "token.pickle"
+    return os.path.join(TOKEN_DIR, f"{account}.pickle")
 
-def get_gmail_service():
+
+def get_account_credential_manager(account=None):
+    """Return the process-wide credential manager for an account."""
+    return get_credential_manager(
+        get_token_path(account), SCOPES, legacy_path=get_legacy_token_path(account)
+    )
+
+
+def get_credentials(account=None, interactive=True, required_scopes=()):
+    """
+    Load the saved OAuth credentials, refreshing them if they have expired
+    and running the OAuth flow only if there are none (or they were revoked),
+    or if they weren't granted the required_scopes. With interactive=False
+    (headless workers) an error is raised instead of opening a browser.
+    """
+    manager = get_account_credential_manager(account)
     logger.info("Starting Gmail service authentication process")
-    creds = None
-    if os.path.exists("token.pickle"):
-        logger.info("Found existing token.pickle file")
-        with open("token.pickle", "rb") as token:
-            logger.info("Loading credentials from token.pickle")
-            creds = pickle.load(token)
-            logger.info("Credentials loaded successfully")
-
-    if not creds or not creds.valid:
-        logger.info("No valid credentials found, initiating OAuth flow")
-        try:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            logger.info("Running local server for authentication")
-            creds = flow.run_local_server(port=0)
-            logger.info("Authentication successful")
-            with open("token.pickle", "wb") as token:
-                logger.info("Saving new credentials to token.pickle")
-                pickle.dump(creds, token)
-                logger.info("Credentials saved successfully")
-        except Exception as e:
-            logger.error(f"Authentication failed: {e}")
+    try:
+        creds = manager.get_credentials()
+    except Exception as e:
+        if not interactive:
             raise
+        logger.warning(f"Could not refresh saved credentials: {e}")
+        creds = None
+
+    if creds and creds.valid and creds.has_scopes(required_scopes):
+        return creds
+    if not interactive:
+        raise RuntimeError(
+            f"No valid credentials with the required scopes in {manager.token_path}; "
+            "authorize the account first"
+        )
+
+    logger.info("No valid credentials found, initiating OAuth flow")
+    try:
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+        logger.info("Running local server for authentication")
+        creds = flow.run_local_server(port=0)
+        logger.info("Authentication successful")
+        manager.save(creds)
+        logger.info(f"Saved new credentials to {manager.token_path}")
+    except Exception as e:
+        logger.error(f"Authentication failed: {e}")
+        raise
+
+    return creds
+
+
+class RateLimitedHttp(httplib2.Http):
+    """httplib2 transport that spaces requests to stay under a per-second quota."""
+
+    def __init__(self, requests_per_second, **kwargs):
+        super().__init__(**kwargs)
+        self._min_interval = 1.0 / requests_per_second
+        self._next_request_at = 0.0
+        self._lock = threading.Lock()
+
+    def request(self, *args, **kwargs):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_request_at - now
+            self._next_request_at = max(now, self._next_request_at) + self._min_interval
+        if wait > 0:
+            time.sleep(wait)
+        return super().request(*args, **kwargs)
+
+
+def get_gmail_service(
+    account=None, requests_per_second=None, interactive=True, required_scopes=()
+):
+    from googleapiclient.discovery import build
+
+    creds = get_credentials(account, interactive, required_scopes)
+    # Long-running callers keep using this service; refresh ahead of expiry
+    get_account_credential_manager(account).start_background_refresh()
 
     logger.info("Building Gmail API service")
-    service = build("gmail", "v1", credentials=creds)
+    if requests_per_second:
+        from google_auth_httplib2 import AuthorizedHttp
+
+        http = AuthorizedHttp(creds, http=RateLimitedHttp(requests_per_second))
+        service = build("gmail", "v1", http=http)
+    else:
+        service = build("gmail", "v1", credentials=creds)
     logger.info("Gmail API service created successfully")
     return service
@@ -1,27 +1,55 @@
+import heapq
 import logging
 import time
 from gmail_service import get_gmail_service
-from email_classifier import classify_email, get_token_usage
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
+from email_classifier import (
+    classify_email_with_body_fallback,
+    get_categories_from_prompt,
+    get_token_usage,
 )
+from googleapiclient.errors import HttpError
+from utils import message_store
+from utils.email_body import BODY_MAX_CHARS, extract_body_text
+from utils.gmail_message import GmailMessage
+
 logger = logging.getLogger("label_emails")
 
+CLASSIFICATION_LABELS = [
+    "Sports",
+    "Entertainment",
+    "Job Applications",
+    "Conferences",
+    "Promotions",
+    "Work",
+    "Other",
+]
 
-def get_or_create_label(service, label_name):
-    """Retrieve label ID if it exists, or create it if not."""
-    logger.info(f"Looking for label: '{label_name}'")
+
+class MessageNotFoundError(Exception):
+    """Raised when a message does not exist or could not be fetched."""
+
+
+def get_label_map(service):
+    """Return a mapping of lower-cased label name to label ID."""
     labels = service.users().labels().list(userId="me").execute().get("labels", [])
     logger.info(f"Found {len(labels)} total labels in Gmail account")
+    return {label["name"].lower(): label["id"] for label in labels}
 
-    for label in labels:
-        if label["name"].lower() == label_name.lower():
-            logger.info(f"Found existing label '{label_name}' with ID: {label['id']}")
-            return label["id"]
+
+def get_or_create_label(service, label_name, label_map=None):
+    """Retrieve label ID if it exists, or create it if not.
+
+    When a label_map from get_label_map is passed it is used instead of listing
+    the labels again, and any newly created label is added to it.
+    """
+    logger.info(f"Looking for label: '{label_name}'")
+    if label_map is None:
+        label_map = get_label_map(service)
+
+    label_id = label_map.get(label_name.lower())
+    if label_id:
+        logger.info(f"Found existing label '{label_name}' with ID: {label_id}")
+        return label_id
 
     logger.info(f"Label '{label_name}' not found, creating new label")
     label = {
@@ -34,20 +62,22 @@ def get_or_create_label(service, label_name):
             service.users().labels().create(userId="me", body=label).execute()
         )
         logger.info(f"Created new label '{label_name}' with ID: {created_label['id']}")
+        label_map[label_name.lower()] = created_label["id"]
         return created_label["id"]
     except Exception as e:
         logger.error(f"Error creating label '{label_name}': {e}")
         raise
 
 
-def label_email(service, msg_id, label_name):
+def label_email(service, msg_id, label_name, label_map=None):
     """Apply a label to a Gmail message."""
     logger.info(f"Applying label '{label_name}' to message ID: {msg_id}")
     try:
-        label_id = get_or_create_label(service, label_name)
+        label_id = get_or_create_label(service, label_name, label_map)
         service.users().messages().modify(
             userId="me", id=msg_id, body={"addLabelIds": [label_id]}
         ).execute()
+        message_store.update_message_labels([msg_id], add_label_ids=[label_id])
         logger.info(
             f"Successfully applied label '{label_name}' to message ID: {msg_id}"
         )
@@ -56,89 +86,333 @@ def label_email(service, msg_id, label_name):
         raise
 
 
-def fetch_primary_emails(service, max_results=10, label_ids_to_exclude=None):
+def fetch_message_body(service, msg_id, max_chars=BODY_MAX_CHARS):
+    """
+    Return up to max_chars of a message's body text. Gmail can't return a
+    single MIME part, so the full payload is fetched (without attachments),
+    but only the text part is decoded, and only as far as the budget needs.
+    """
+    resource = (
+        service.users()
+        .messages()
+        .get(userId="me", id=msg_id, format="full", fields="payload")
+        .execute()
+    )
+    return extract_body_text(resource["payload"], max_chars)
+
+
+def classify_message_with_confidence(service, msg, account=None):
     """
-    Fetch and return the most recent messages from the Primary inbox category that don't
-    already have the specified labels. Messages are sorted by internalDate (newest first).
+    Classify a GmailMessage from its snippet, fetching the body only when the
+    snippet alone gives a low-confidence answer. The result is added to the
+    classification history that sender filters are mined from, under account
+    (the name of the mailbox's account, None for the default one). Returns
+    (category, confidence); confidence is None if the request failed.
     """
+    # Imported here: feedback_db configures logging when imported
+    from utils.feedback_db import record_classification
+
+    category, confidence = classify_email_with_body_fallback(
+        msg.subject,
+        msg.snippet,
+        lambda max_chars: fetch_message_body(service, msg.id, max_chars),
+    )
+    record_classification(msg.id, msg.sender_address, category, confidence, account)
+    return category, confidence
+
+
+def classify_message(service, msg, account=None):
+    """Classify a GmailMessage; see classify_message_with_confidence."""
+    return classify_message_with_confidence(service, msg, account)[0]
+
+
+def classify_and_label(service, msg_id):
+    """Fetch a message, classify it and apply the resulting label."""
+    msg = get_message(service, msg_id)
+
+    category = classify_message(service, msg)
+    label_email(service, msg_id, category)
+    return category
+
+
+def batch_get_messages(
+    service, msg_ids, metadata_headers=message_store.STORED_HEADERS, batch_size=50
+):
+    """
+    Fetch metadata-format messages using Gmail batch HTTP requests.
+    Returns a dict of message ID to message resource; messages that could not
+    be fetched are left out.
+    """
+    logger.info(f"Fetching metadata for {len(msg_ids)} messages in batches")
+    messages = {}
+
+    def handle_response(request_id, response, exception):
+        if exception is not None:
+            logger.error(
+                f"Error fetching metadata for message {request_id}: {exception}"
+            )
+            return
+        messages[request_id] = response
+
+    for start in range(0, len(msg_ids), batch_size):
+        batch = service.new_batch_http_request(callback=handle_response)
+        for msg_id in msg_ids[start : start + batch_size]:
+            batch.add(
+                service.users()
+                .messages()
+                .get(
+                    userId="me",
+                    id=msg_id,
+                    format="metadata",
+                    metadataHeaders=list(metadata_headers),
+                ),
+                request_id=msg_id,
+            )
+        batch.execute()
+
+    logger.info(f"Fetched metadata for {len(messages)}/{len(msg_ids)} messages")
+    return messages
+
+
+def get_message_metadata(service, msg_ids):
+    """
+    Return metadata for the given messages as a dict of ID to GmailMessage.
+    Messages already in the local mirror are read from it; the rest are
+    fetched from Gmail in batches and stored.
+    """
+    messages = message_store.get_messages(msg_ids)
+    missing_ids = [
+        msg_id for msg_id in dict.fromkeys(msg_ids) if msg_id not in messages
+    ]
+    logger.info(
+        f"Metadata for {len(messages)} messages found locally, fetching {len(missing_ids)}"
+    )
+
+    if missing_ids:
+        fetched = [
+            GmailMessage.from_resource(msg)
+            for msg in batch_get_messages(service, missing_ids).values()
+        ]
+        message_store.upsert_messages(fetched)
+        messages.update((msg.id, msg) for msg in fetched)
+    return messages
+
+
+def get_message(service, msg_id):
+    """Return a single message's metadata as a GmailMessage."""
+    msg = get_message_metadata(service, [msg_id]).get(msg_id)
+    if msg is None:
+        raise MessageNotFoundError(f"Message {msg_id} not found")
+    return msg
+
+
+def sync_message_store(service):
+    """
+    Bring label changes and deletions in the local mirror up to date using
+    users.history.list since the last synced historyId.
+    """
+    start_history_id = message_store.get_sync_history_id()
+    if start_history_id is None:
+        history_id = service.users().getProfile(userId="me").execute()["historyId"]
+        logger.info(f"Starting message store sync at historyId {history_id}")
+        message_store.set_sync_history_id(history_id)
+        return
+
+    label_sets = {}
+    deleted_ids = []
+    page_token = None
+    try:
+        while True:
+            response = (
+                service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["labelAdded", "labelRemoved", "messageDeleted"],
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+            for record in response.get("history", []):
+                # Label events carry the message's full current label set
+                for change in record.get("labelsAdded", []) + record.get(
+                    "labelsRemoved", []
+                ):
+                    message = change["message"]
+                    label_sets[message["id"]] = message.get("labelIds", [])
+                for change in record.get("messagesDeleted", []):
+                    deleted_ids.append(change["message"]["id"])
+
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+        # The start historyId is too old; labels may be stale so start over
+        logger.warning("History window expired, resetting message store")
+        message_store.clear_messages()
+        message_store.set_sync_history_id(
+            service.users().getProfile(userId="me").execute()["historyId"]
+        )
+        return
+
+    message_store.set_message_labels(label_sets)
+    message_store.delete_messages(deleted_ids)
+    message_store.set_sync_history_id(response["historyId"])
+    logger.info(
+        f"Synced message store: {len(label_sets)} label changes, {len(deleted_ids)} deletions"
+    )
+
+
+def batch_modify_labels(
+    service, msg_ids, add_label_ids=None, remove_label_ids=None, chunk_size=1000
+):
+    """Apply the same label changes to many messages with messages.batchModify."""
+    body = {}
+    if add_label_ids:
+        body["addLabelIds"] = list(add_label_ids)
+    if remove_label_ids:
+        body["removeLabelIds"] = list(remove_label_ids)
+    if not body or not msg_ids:
+        return 0
+
+    logger.info(f"Batch modifying labels on {len(msg_ids)} messages: {body}")
+    # batchModify accepts at most 1000 message IDs per call
+    for start in range(0, len(msg_ids), chunk_size):
+        service.users().messages().batchModify(
+            userId="me", body={"ids": list(msg_ids[start : start + chunk_size]), **body}
+        ).execute()
+    message_store.update_message_labels(msg_ids, add_label_ids, remove_label_ids)
+    return len(msg_ids)
+
+
+def iter_primary_emails(
+    service,
+    max_results=10,
+    label_ids_to_exclude=None,
+    newest_first=False,
+    query="category:primary",
+):
+    """
+    Yield GmailMessages from the Primary inbox category that don't have any
+    of label_ids_to_exclude. Messages are yielded as each page of IDs is
+    listed, and only one page is held at a time. With newest_first, the first
+    2 * max_results matching messages are considered and the newest
+    max_results of them are yielded at the end, keeping only a bounded heap.
+    Metadata is read from the local mirror where possible, so each message
+    costs at most one Gmail get.
+    """
+    if max_results is None and newest_first:
+        raise ValueError("newest_first needs max_results")
     logger.info(
         f"Fetching up to {max_results} primary emails (excluding {len(label_ids_to_exclude or [])} labels)"
     )
-    all_valid_messages = []
+    sync_message_store(service)
+
+    exclude = set(label_ids_to_exclude or [])
+    if max_results is None:
+        limit = float("inf")
+    else:
+        # Consider more than needed so the newest ones can be picked
+        limit = max_results * 2 if newest_first else max_results
+    newest = []  # Min-heap of (internal_date, -position, message)
+    found = 0
+    total_messages_checked = 0
     page_token = None
     batch_size = 100  # Gmail's max allowed batch size
-    total_messages_checked = 0
 
-    while len(all_valid_messages) < max_results:
+    while found < limit:
         logger.info(f"Fetching batch of messages (page token: {page_token or 'None'})")
-        # Query to focus only on Primary inbox (filtering out other tabs)
         try:
             results = (
                 service.users()
                 .messages()
                 .list(
                     userId="me",
-                    q="category:primary",
+                    q=query,
                     maxResults=batch_size,
                     pageToken=page_token,
                     includeSpamTrash=False,
                 )
                 .execute()
             )
+            page_ids = [msg["id"] for msg in results.get("messages", [])]
+            page = get_message_metadata(service, page_ids) if page_ids else {}
+        except Exception as e:
+            logger.error(f"Error fetching messages: {e}")
+            break
 
-            messages = results.get("messages", [])
-            logger.info(f"Fetched {len(messages)} messages in this batch")
-            total_messages_checked += len(messages)
-
-            if not messages:
-                logger.info("No more messages to fetch")
-                break  # No more messages
-
-            for msg in messages:
-                if len(all_valid_messages) >= max_results * 2:
-                    logger.info(
-                        f"Collected enough messages ({len(all_valid_messages)}) for sorting"
-                    )
-                    break  # Collect more than needed to sort & slice later
-
-                msg_id = msg["id"]
-                logger.debug(f"Fetching details for message ID: {msg_id}")
-                msg_data = (
-                    service.users().messages().get(userId="me", id=msg_id).execute()
-                )
-
-                # Skip if message has excluded labels
-                if label_ids_to_exclude:
-                    msg_labels = msg_data.get("labelIds", [])
-                    if any(label_id in msg_labels for label_id in label_ids_to_exclude):
-                        logger.debug(f"Skipping message {msg_id} - has excluded label")
-                        continue
-
-                all_valid_messages.append(msg_data)
-                logger.debug(
-                    f"Added message {msg_id} to processing queue (total: {len(all_valid_messages)})"
-                )
+        logger.info(f"Fetched {len(page_ids)} messages in this batch")
+        total_messages_checked += len(page_ids)
+        if not page_ids:
+            logger.info("No more messages to fetch")
+            break
 
-            page_token = results.get("nextPageToken")
-            if not page_token:
-                logger.info("No more pages of results")
+        for msg_id in page_ids:
+            msg = page.get(msg_id)
+            # Stored label sets are kept current by sync_message_store
+            if msg is None or exclude.intersection(msg.label_ids):
+                continue
+            found += 1
+            if not newest_first:
+                yield msg
+            elif len(newest) < max_results:
+                heapq.heappush(newest, (msg.internal_date, -found, msg))
+            else:
+                heapq.heappushpop(newest, (msg.internal_date, -found, msg))
+            if found >= limit:
                 break
 
-        except Exception as e:
-            logger.error(f"Error fetching messages: {e}")
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            logger.info("No more pages of results")
             break
 
-    # Sort collected messages by internalDate (newest first)
-    logger.info(f"Sorting {len(all_valid_messages)} collected messages by date")
-    sorted_msgs = sorted(
-        all_valid_messages, key=lambda m: int(m["internalDate"]), reverse=True
+    logger.info(
+        f"Found {found} matching messages (checked {total_messages_checked} total)"
+    )
+    for _, _, msg in sorted(newest, reverse=True):
+        yield msg
+
+
+def fetch_primary_emails(service, max_results=10, label_ids_to_exclude=None):
+    """
+    Return the most recent messages from the Primary inbox category that don't
+    already have the specified labels, newest first (by internalDate). See
+    iter_primary_emails to process messages as they are listed instead.
+    """
+    return list(
+        iter_primary_emails(
+            service, max_results, label_ids_to_exclude, newest_first=True
+        )
     )
 
-    result_msgs = sorted_msgs[:max_results]
-    logger.info(
-        f"Returning {len(result_msgs)} messages (checked {total_messages_checked} total)"
+
+def fetch_email_page(service, page_size=20, page_token=None, query="category:primary"):
+    """
+    Fetch one page of messages, newest first, for browsing. Returns
+    (messages, next_page_token); the token is None after the last page.
+    Metadata already in the local mirror isn't fetched again.
+    """
+    logger.info(f"Fetching page of {page_size} emails (page token: {page_token})")
+    results = (
+        service.users()
+        .messages()
+        .list(
+            userId="me",
+            q=query,
+            maxResults=page_size,
+            pageToken=page_token,
+            includeSpamTrash=False,
+        )
+        .execute()
     )
-    return result_msgs
+    page_ids = [msg["id"] for msg in results.get("messages", [])]
+    messages = get_message_metadata(service, page_ids)
+    page = [messages[msg_id] for msg_id in page_ids if msg_id in messages]
+    return page, results.get("nextPageToken")
 
 
 def delete_emails_with_label(service, label_name="Promotions", max_to_delete=10):
@@ -213,117 +487,101 @@ def delete_emails_with_label(service, label_name="Promotions", max_to_delete=10)
     logger.info(f"Total messages deleted with label '{label_name}': {deleted_count}")
 
 
-def main():
-    logger.info("=== Starting email labeling process ===")
-    start_time = time.time()
-
-    logger.info("Getting Gmail service")
-    service = get_gmail_service()
-
-    logger.info("Starting deletion of promotional emails")
-    delete_emails_with_label(service, label_name="Promotions", max_to_delete=10)
-
-    classification_labels = [
-        "Sports",
-        "Entertainment",
-        "Job Applications",
-        "Conferences",
-        "Promotions",
-        "Work",
-        "Other",
-    ]
-    logger.info(f"Using classification labels: {classification_labels}")
-
-    # Preload label name-to-ID mapping
+def preload_classification_labels(service, label_map):
+    """
+    Return {name: label ID} for CLASSIFICATION_LABELS and the prompt's
+    categories, creating missing labels.
+    """
     logger.info("Preloading label IDs")
     label_names_to_ids = {}
-    for name in classification_labels:
+    for name in dict.fromkeys(CLASSIFICATION_LABELS + get_categories_from_prompt()):
         try:
-            label_names_to_ids[name] = get_or_create_label(service, name)
+            label_names_to_ids[name] = get_or_create_label(service, name, label_map)
         except Exception as e:
             logger.error(f"Error preloading label '{name}': {e}")
 
     logger.info(f"Preloaded {len(label_names_to_ids)} label IDs")
+    return label_names_to_ids
+
+
+def label_mailbox(service, emails_to_process=10, delete_promotions=True, account=None):
+    """
+    Classify and label up to emails_to_process unlabeled emails in one mailbox,
+    the one of the named account (None for the default account).
+    Returns a stats dict (processed, labeled, errors, elapsed seconds and the
+    tokens used by this run).
+    """
+    start_time = time.time()
+    tokens_before = get_token_usage()
+    stats = {"processed": 0, "labeled": 0, "errors": 0}
+
+    if delete_promotions:
+        logger.info("Starting deletion of promotional emails")
+        delete_emails_with_label(service, label_name="Promotions", max_to_delete=10)
 
-    # Number of emails to process in one run
-    emails_to_process = 10  # Increased to process more emails
+    label_map = get_label_map(service)
+    label_names_to_ids = preload_classification_labels(service, label_map)
     logger.info(f"Will process up to {emails_to_process} emails")
 
-    # Fetch emails that don't have our classification labels
-    logger.info("Fetching unlabeled emails")
-    messages = fetch_primary_emails(
+    # Unlabeled emails are classified as each page is listed. Gmail lists
+    # newest first, so there's no need to collect and sort them beforehand.
+    messages = iter_primary_emails(
         service,
         max_results=emails_to_process,
         label_ids_to_exclude=list(label_names_to_ids.values()),
     )
 
-    logger.info(f"Found {len(messages)} unlabeled emails to process")
-
-    # Debug: Print the dates of the messages we're processing
-    if messages:
-        logger.info("Processing emails with the following details:")
-        for i, msg in enumerate(messages):
-            try:
-                msg_data = (
-                    service.users().messages().get(userId="me", id=msg["id"]).execute()
-                )
-                headers = msg_data.get("payload", {}).get("headers", [])
-                date = next(
-                    (h["value"] for h in headers if h["name"].lower() == "date"),
-                    "Unknown date",
-                )
-                subject = next(
-                    (h["value"] for h in headers if h["name"].lower() == "subject"),
-                    "No subject",
-                )
-                logger.info(f"  {i+1}. Date: {date} | Subject: {subject}")
-            except Exception as e:
-                logger.error(f"Error getting email details for message {i+1}: {e}")
-
-    # Process each message
     logger.info("Starting email classification and labeling")
     for i, msg in enumerate(messages):
-        msg_id = msg["id"]
-        logger.info(f"Processing message {i+1}/{len(messages)} (ID: {msg_id})")
+        msg_id = msg.id
+        logger.info(f"Processing message {i+1} (ID: {msg_id})")
+        stats["processed"] += 1
 
         try:
-            # Get full message details
-            logger.debug(f"Getting full details for message {msg_id}")
-            msg_data = service.users().messages().get(userId="me", id=msg_id).execute()
-
-            # Extract subject and snippet
-            subject = ""
-            snippet = msg_data.get("snippet", "")
-            headers = msg_data.get("payload", {}).get("headers", [])
-            for header in headers:
-                if header["name"] == "Subject":
-                    subject = header["value"]
-                    break
-
-            logger.info(f"Message {i+1} - Subject: '{subject}'")
+            logger.info(
+                f"Message {i+1} - Date: {msg.date or 'Unknown date'} | Subject: '{msg.subject}'"
+            )
 
             # Classify and label
             logger.info(f"Classifying message {msg_id}")
-            category = classify_email(subject, snippet)
+            category = classify_message(service, msg, account)
             logger.info(f"Classified message {msg_id} as: {category}")
 
             logger.info(f"Applying label '{category}' to message {msg_id}")
-            label_email(service, msg_id, category)
-            logger.info(f"Successfully processed message {i+1}/{len(messages)}")
+            label_email(service, msg_id, category, label_map)
+            stats["labeled"] += 1
+            logger.info(f"Successfully processed message {i+1}")
         except Exception as e:
+            stats["errors"] += 1
             logger.error(f"Error processing message {msg_id}: {e}")
 
-    # Log completion
-    elapsed_time = time.time() - start_time
+    # Token usage is process-wide, so report only what this run added
+    tokens_after = get_token_usage()
+    for key, value in tokens_after.items():
+        stats[key] = value - tokens_before[key]
+    stats["elapsed_seconds"] = time.time() - start_time
+    return stats
+
+
+def main():
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    logger.info("=== Starting email labeling process ===")
+
+    logger.info("Getting Gmail service")
+    service = get_gmail_service()
 
-    # Get token usage statistics
-    token_usage = get_token_usage()
+    stats = label_mailbox(service)
 
     logger.info(
-        f"=== Email labeling process completed in {elapsed_time:.2f} seconds ==="
+        f"=== Email labeling process completed in {stats['elapsed_seconds']:.2f} seconds ==="
     )
     logger.info(
-        f"=== Token Usage: Prompt: {token_usage['prompt_tokens']}, Completion: {token_usage['completion_tokens']}, Total: {token_usage['total_tokens']} ==="
+        f"=== Token Usage: Prompt: {stats['prompt_tokens']}, Completion: {stats['completion_tokens']}, Total: {stats['total_tokens']} ==="
     )
 
 
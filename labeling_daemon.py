@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+import os
+import time
+import queue
+import signal
+import logging
+import threading
+from gmail_service import get_gmail_service
+from email_classifier import get_body_settings, get_prompt_parts
+from label_emails import (
+    batch_modify_labels,
+    classify_message,
+    fetch_primary_emails,
+    get_label_map,
+    get_or_create_label,
+    preload_classification_labels,
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("labeling_daemon")
+
+PAGE_SIZE = int(os.environ.get("DAEMON_PAGE_SIZE", 50))
+CLASSIFY_WORKERS = int(os.environ.get("DAEMON_CLASSIFY_WORKERS", 4))
+QUEUE_SIZE = int(os.environ.get("DAEMON_QUEUE_SIZE", 100))
+POLL_INTERVAL = float(os.environ.get("DAEMON_POLL_INTERVAL", 30))
+LABEL_BATCH_SIZE = 50
+STATS_INTERVAL = 60
+
+# Marks the end of a stage's input when draining
+_DONE = object()
+
+
+class StageStats:
+    """Thread-safe item, error and busy-time counters for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items, busy_seconds, errors=0):
+        with self._lock:
+            self.items += items
+            self.errors += errors
+            self.busy_seconds += busy_seconds
+
+    def summary(self, elapsed):
+        with self._lock:
+            rate = self.items / elapsed if elapsed else 0.0
+            return (
+                f"{self.name}: {self.items} items ({rate:.2f}/s), "
+                f"{self.errors} errors, {self.busy_seconds:.1f}s busy"
+            )
+
+
+class LabelingDaemon:
+    """
+    Long-running fetch -> classify -> label pipeline. Each stage runs in its
+    own thread(s) and stages are connected by bounded queues, so a slow stage
+    applies backpressure upstream while the fetcher prefetches the next page
+    during classification. The Gmail services, label IDs and prompt template
+    are loaded once and reused for every email.
+    """
+
+    def __init__(
+        self,
+        page_size=PAGE_SIZE,
+        classify_workers=CLASSIFY_WORKERS,
+        queue_size=QUEUE_SIZE,
+        poll_interval=POLL_INTERVAL,
+    ):
+        self.page_size = page_size
+        self.classify_workers = classify_workers
+        self.poll_interval = poll_interval
+        self.classify_queue = queue.Queue(maxsize=queue_size)
+        self.label_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.stats = {name: StageStats(name) for name in ("fetch", "classify", "label")}
+
+        # Messages between fetch and label; they're skipped by later fetches
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+        self._threads = []
+        self._started_at = None
+        self.fetch_service = None
+        self.label_service = None
+        self.label_map = {}
+        self.label_ids = {}
+
+    def _put(self, target_queue, item):
+        """Block on a full queue, giving up if the daemon is stopping."""
+        while True:
+            try:
+                target_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                if self.stop_event.is_set():
+                    return False
+
+    def fetch_loop(self):
+        service = self.fetch_service
+        label_ids = list(self.label_ids.values())
+
+        while not self.stop_event.is_set():
+            start = time.time()
+            with self._in_flight_lock:
+                in_flight = set(self._in_flight)
+            try:
+                messages = fetch_primary_emails(
+                    service,
+                    max_results=self.page_size + len(in_flight),
+                    label_ids_to_exclude=label_ids,
+                )
+                messages = [msg for msg in messages if msg.id not in in_flight][
+                    : self.page_size
+                ]
+                errors = 0
+            except Exception as e:
+                logger.error(f"Error fetching emails: {e}")
+                messages = []
+                errors = 1
+            self.stats["fetch"].record(len(messages), time.time() - start, errors)
+
+            for msg in messages:
+                with self._in_flight_lock:
+                    self._in_flight.add(msg.id)
+                if not self._put(self.classify_queue, msg):
+                    break
+
+            # A full page means more mail is waiting, so fetch again right away
+            if len(messages) < self.page_size:
+                self.stop_event.wait(self.poll_interval)
+
+        for _ in range(self.classify_workers):
+            self.classify_queue.put(_DONE)
+
+    def classify_loop(self, service):
+        while True:
+            msg = self.classify_queue.get()
+            if msg is _DONE:
+                self.label_queue.put(_DONE)
+                return
+
+            start = time.time()
+            try:
+                category = classify_message(service, msg)
+            except Exception as e:
+                logger.error(f"Error classifying message {msg.id}: {e}")
+                self.stats["classify"].record(0, time.time() - start, 1)
+                # Let a later fetch pick it up again
+                with self._in_flight_lock:
+                    self._in_flight.discard(msg.id)
+                continue
+            self.stats["classify"].record(1, time.time() - start)
+            self.label_queue.put((msg.id, category))
+
+    def label_loop(self):
+        service = self.label_service
+        label_map = self.label_map
+        finished_workers = 0
+
+        while finished_workers < self.classify_workers:
+            # Collect whatever is ready (up to a batch) to label in few calls
+            batch = []
+            item = self.label_queue.get()
+            while True:
+                if item is _DONE:
+                    finished_workers += 1
+                else:
+                    batch.append(item)
+                if len(batch) >= LABEL_BATCH_SIZE:
+                    break
+                try:
+                    item = self.label_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            by_category = {}
+            for msg_id, category in batch:
+                by_category.setdefault(category, []).append(msg_id)
+
+            for category, msg_ids in by_category.items():
+                start = time.time()
+                try:
+                    label_id = get_or_create_label(service, category, label_map)
+                    batch_modify_labels(service, msg_ids, add_label_ids=[label_id])
+                    self.stats["label"].record(len(msg_ids), time.time() - start)
+                except Exception as e:
+                    logger.error(f"Error applying label '{category}': {e}")
+                    self.stats["label"].record(0, time.time() - start, len(msg_ids))
+
+            with self._in_flight_lock:
+                self._in_flight.difference_update(msg_id for msg_id, _ in batch)
+
+    def log_stats(self):
+        elapsed = time.time() - self._started_at
+        logger.info(
+            f"Pipeline stats after {elapsed:.0f}s "
+            f"(queues: classify {self.classify_queue.qsize()}, label {self.label_queue.qsize()})"
+        )
+        for stage in self.stats.values():
+            logger.info(f"  {stage.summary(elapsed)}")
+
+    def start(self):
+        logger.info(
+            f"Starting labeling daemon ({self.classify_workers} classify workers, page size {self.page_size})"
+        )
+        self._started_at = time.time()
+
+        # httplib2 isn't thread-safe, so every stage thread gets a service.
+        # They're all built here so a credential problem stops the daemon
+        # before any thread starts; classify workers use theirs to fetch the
+        # bodies of low-confidence emails.
+        self.fetch_service = get_gmail_service(interactive=False)
+        self.label_service = get_gmail_service(interactive=False)
+        classify_services = [
+            get_gmail_service(interactive=False) for _ in range(self.classify_workers)
+        ]
+        self.label_map = get_label_map(self.label_service)
+        self.label_ids = preload_classification_labels(
+            self.label_service, self.label_map
+        )
+        get_prompt_parts()
+        # Fail on unparseable BODY_* settings now rather than per message
+        get_body_settings()
+
+        targets = [("fetch", self.fetch_loop, ()), ("label", self.label_loop, ())]
+        targets += [
+            (f"classify-{i}", self.classify_loop, (service,))
+            for i, service in enumerate(classify_services)
+        ]
+        for name, target, args in targets:
+            thread = threading.Thread(target=target, name=name, args=args, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop fetching and wait for messages already fetched to be labeled."""
+        logger.info("Draining labeling pipeline")
+        self.stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        self.log_stats()
+        logger.info("Labeling daemon stopped")
+
+    def run(self):
+        """Run until SIGTERM or SIGINT, then drain and exit."""
+
+        def handle_signal(signum, frame):
+            logger.info(f"Received signal {signum}")
+            self.stop_event.set()
+
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
+
+        self.start()
+        while not self.stop_event.wait(STATS_INTERVAL):
+            self.log_stats()
+        self.stop()
+
+
+if __name__ == "__main__":
+    LabelingDaemon().run()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from gmail_service import get_credentials, get_gmail_service
+from label_emails import label_mailbox
+from utils import message_store
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("multi_account")
+
+ACCOUNTS_FILE = "accounts.json"
+ACCOUNTS_DIR = "accounts"
+STATS_FILE = "account_stats.json"
+
+DEFAULT_MAX_EMAILS = 50
+# Gmail allows 250 quota units per user per second; metadata gets cost 5 each
+DEFAULT_REQUESTS_PER_SECOND = 40
+MAX_BACKOFF_SECONDS = 3600
+
+COUNTERS = (
+    "processed",
+    "labeled",
+    "errors",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+)
+
+
+def load_accounts():
+    """Return the configured accounts from accounts.json."""
+    if not os.path.exists(ACCOUNTS_FILE):
+        return []
+    with open(ACCOUNTS_FILE, "r") as f:
+        return json.load(f)
+
+
+def save_accounts(accounts):
+    with open(ACCOUNTS_FILE, "w") as f:
+        json.dump(accounts, f, indent=2)
+
+
+def add_account(name, max_emails=DEFAULT_MAX_EMAILS, requests_per_second=None):
+    """Authorize a mailbox interactively and add it to accounts.json."""
+    get_credentials(name)
+
+    accounts = [a for a in load_accounts() if a["name"] != name]
+    accounts.append(
+        {
+            "name": name,
+            "max_emails": max_emails,
+            "requests_per_second": requests_per_second or DEFAULT_REQUESTS_PER_SECOND,
+        }
+    )
+    save_accounts(accounts)
+    logger.info(f"Added account '{name}' ({len(accounts)} accounts configured)")
+
+
+def label_account(account):
+    """Label one mailbox. Runs in a pool worker process."""
+    name = account["name"]
+
+    # Each account gets its own metadata mirror so history syncs don't collide
+    account_dir = os.path.join(ACCOUNTS_DIR, name)
+    os.makedirs(account_dir, exist_ok=True)
+    message_store.DB_PATH = os.path.join(account_dir, "messages.db")
+
+    service = get_gmail_service(
+        name,
+        requests_per_second=account.get(
+            "requests_per_second", DEFAULT_REQUESTS_PER_SECOND
+        ),
+        interactive=False,
+    )
+    return label_mailbox(
+        service,
+        emails_to_process=account.get("max_emails", DEFAULT_MAX_EMAILS),
+        delete_promotions=account.get("delete_promotions", False),
+        account=name,
+    )
+
+
+def new_account_stats():
+    stats = {counter: 0 for counter in COUNTERS}
+    stats.update(
+        {
+            "runs": 0,
+            "failures": 0,
+            "consecutive_failures": 0,
+            "busy_seconds": 0.0,
+            "emails_per_minute": 0.0,
+            "last_run": None,
+            "last_error": None,
+        }
+    )
+    return stats
+
+
+def record_result(stats, result=None, error=None):
+    """Fold one account run into that account's running stats."""
+    stats["runs"] += 1
+    stats["last_run"] = datetime.now().isoformat()
+    if error is not None:
+        stats["failures"] += 1
+        stats["consecutive_failures"] += 1
+        stats["last_error"] = str(error)
+        return
+
+    stats["consecutive_failures"] = 0
+    stats["last_error"] = None
+    for counter in COUNTERS:
+        stats[counter] += result.get(counter, 0)
+    stats["busy_seconds"] += result.get("elapsed_seconds", 0.0)
+    if stats["busy_seconds"]:
+        stats["emails_per_minute"] = stats["processed"] / stats["busy_seconds"] * 60
+
+
+def write_stats(account_stats):
+    """Write per-account and total stats to STATS_FILE."""
+    totals = {counter: 0 for counter in COUNTERS + ("runs", "failures")}
+    for stats in account_stats.values():
+        for key in totals:
+            totals[key] += stats[key]
+
+    tmp_path = f"{STATS_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                "updated_at": datetime.now().isoformat(),
+                "totals": totals,
+                "accounts": account_stats,
+            },
+            f,
+            indent=2,
+        )
+    os.replace(tmp_path, STATS_FILE)
+    return totals
+
+
+def run_supervisor(accounts, workers=None, interval=60, once=False):
+    """
+    Keep every account labeled using a process pool. Each account is
+    rescheduled `interval` seconds after its previous run finishes, so a slow
+    or failing mailbox never holds up the others; failing accounts back off
+    exponentially and a crashed worker process only costs a pool restart.
+    """
+    if not accounts:
+        logger.warning(f"No accounts configured in {ACCOUNTS_FILE}")
+        return {}
+
+    workers = workers or min(len(accounts), os.cpu_count() or 1)
+    logger.info(f"Supervising {len(accounts)} accounts with {workers} workers")
+
+    by_name = {account["name"]: account for account in accounts}
+    account_stats = {name: new_account_stats() for name in by_name}
+    next_run = {name: 0.0 for name in by_name}
+    running = {}
+    executor = ProcessPoolExecutor(max_workers=workers)
+
+    try:
+        while True:
+            now = time.time()
+            busy = set(running.values())
+            for name, account in by_name.items():
+                if name in busy or next_run[name] > now:
+                    continue
+                if once and account_stats[name]["runs"]:
+                    continue
+                running[executor.submit(label_account, account)] = name
+
+            if not running:
+                if once:
+                    break
+                time.sleep(max(0, min(next_run.values()) - time.time()))
+                continue
+
+            timeout = None if once else max(1, min(next_run.values()) - now)
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            pool_broken = False
+            for future in done:
+                name = running.pop(future)
+                stats = account_stats[name]
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    pool_broken = True
+                    record_result(stats, error=e)
+                except Exception as e:
+                    record_result(stats, error=e)
+                else:
+                    record_result(stats, result=result)
+
+                if stats["consecutive_failures"]:
+                    delay = min(
+                        interval * 2 ** stats["consecutive_failures"],
+                        MAX_BACKOFF_SECONDS,
+                    )
+                    logger.error(
+                        f"Account '{name}' failed ({stats['last_error']}), retrying in {delay}s"
+                    )
+                else:
+                    delay = interval
+                    logger.info(
+                        f"Account '{name}': processed {result.get('processed', 0)}, "
+                        f"labeled {result.get('labeled', 0)}, errors {result.get('errors', 0)} "
+                        f"in {result.get('elapsed_seconds', 0):.2f}s"
+                    )
+                next_run[name] = time.time() + delay
+
+            if pool_broken:
+                # Every in-flight future fails with the pool; record them and restart it
+                logger.error("Worker process died, restarting process pool")
+                for future, name in running.items():
+                    record_result(account_stats[name], error="worker pool restarted")
+                    next_run[name] = time.time() + interval
+                running.clear()
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=workers)
+
+            if done:
+                totals = write_stats(account_stats)
+                logger.info(
+                    f"Totals: {totals['processed']} processed, {totals['labeled']} labeled, "
+                    f"{totals['errors']} errors, {totals['failures']} failed runs, "
+                    f"{totals['total_tokens']} tokens"
+                )
+    except KeyboardInterrupt:
+        logger.info("Stopping supervisor")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        write_stats(account_stats)
+
+    return account_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Label several Gmail accounts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="authorize and add an account")
+    add_parser.add_argument("name")
+    add_parser.add_argument("--max-emails", type=int, default=DEFAULT_MAX_EMAILS)
+    add_parser.add_argument("--requests-per-second", type=float)
+
+    run_parser = subparsers.add_parser("run", help="label all configured accounts")
+    run_parser.add_argument("--workers", type=int)
+    run_parser.add_argument("--interval", type=float, default=60)
+    run_parser.add_argument("--once", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "add":
+        add_account(args.name, args.max_emails, args.requests_per_second)
+    else:
+        run_supervisor(load_accounts(), args.workers, args.interval, args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+import os
+import time
+import socket
+import logging
+import argparse
+import multiprocessing
+from gmail_service import get_gmail_service
+from label_emails import (
+    batch_modify_labels,
+    classify_message_with_confidence,
+    get_label_map,
+    get_message_metadata,
+    get_or_create_label,
+    iter_primary_emails,
+    preload_classification_labels,
+)
+from utils.work_queue import DEFAULT_LEASE_SECONDS, get_work_queue
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("queue_worker")
+
+
+def enqueue_unlabeled(max_results=100):
+    """Queue the newest unlabeled primary emails for classification."""
+    service = get_gmail_service()
+    label_ids = preload_classification_labels(service, get_label_map(service))
+    messages = iter_primary_emails(
+        service,
+        max_results=max_results,
+        label_ids_to_exclude=list(label_ids.values()),
+    )
+    return get_work_queue().enqueue([msg.id for msg in messages])
+
+
+def process_batch(
+    service, queue, worker_id, message_ids, label_map, classification_label_ids
+):
+    """
+    Classify and label one leased batch. Messages that already have one of
+    classification_label_ids are acked without being classified. The rest
+    are labeled with one batchModify call per category; successes are acked
+    and failures nacked. A classification without a confidence means the
+    request failed and fell back to a default category, so it is nacked too.
+    label_map (from get_label_map) is used to look up or create the category
+    labels.
+    """
+    classification_label_ids = set(classification_label_ids)
+    metadata = get_message_metadata(service, message_ids)
+
+    done = []
+    by_category = {}
+    for msg_id in message_ids:
+        msg = metadata.get(msg_id)
+        if msg is None:
+            queue.nack(worker_id, msg_id, "Could not fetch message metadata")
+            continue
+        if classification_label_ids.intersection(msg.label_ids):
+            # Already labeled elsewhere (e.g. by a manual run)
+            done.append(msg_id)
+            continue
+        try:
+            category, confidence = classify_message_with_confidence(service, msg)
+            if confidence is None:
+                queue.nack(worker_id, msg_id, "Classification request failed")
+                continue
+            by_category.setdefault(category, []).append(msg_id)
+        except Exception as e:
+            logger.error(f"Error classifying message {msg_id}: {e}")
+            queue.nack(worker_id, msg_id, e)
+
+    for category, msg_ids in by_category.items():
+        try:
+            label_id = get_or_create_label(service, category, label_map)
+            batch_modify_labels(service, msg_ids, add_label_ids=[label_id])
+            done.extend(msg_ids)
+        except Exception as e:
+            logger.error(f"Error applying label '{category}': {e}")
+            for msg_id in msg_ids:
+                queue.nack(worker_id, msg_id, e)
+
+    queue.ack(worker_id, done)
+    return len(done)
+
+
+def run_worker(batch_size=10, lease_seconds=DEFAULT_LEASE_SECONDS, drain=False):
+    """
+    Lease batches from the work queue and process them until stopped, or until
+    the queue has nothing available when drain is set.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Starting queue worker {worker_id}")
+
+    queue = get_work_queue()
+    service = get_gmail_service(interactive=False)
+    label_map = get_label_map(service)
+    # Only these labels mean a message is done; label_map also holds system
+    # labels like INBOX that every message has
+    classification_label_ids = list(
+        preload_classification_labels(service, label_map).values()
+    )
+
+    processed = 0
+    start_time = time.time()
+    idle_sleep = 1
+    while True:
+        message_ids = queue.lease(worker_id, batch_size, lease_seconds)
+        if not message_ids:
+            if drain:
+                break
+            time.sleep(idle_sleep)
+            idle_sleep = min(idle_sleep * 2, 30)
+            continue
+
+        idle_sleep = 1
+        try:
+            processed += process_batch(
+                service,
+                queue,
+                worker_id,
+                message_ids,
+                label_map,
+                classification_label_ids,
+            )
+        except Exception as e:
+            # e.g. a transient Gmail error; nack is a no-op for items
+            # already acked or nacked
+            logger.error(f"Error processing batch: {e}")
+            for msg_id in message_ids:
+                queue.nack(worker_id, msg_id, e)
+            continue
+        elapsed = time.time() - start_time
+        logger.info(
+            f"Worker {worker_id}: {processed} labeled ({processed / elapsed * 60:.1f}/min)"
+        )
+
+    logger.info(f"Worker {worker_id} finished, {processed} messages labeled")
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classification work queue")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="queue unlabeled emails")
+    enqueue_parser.add_argument("--max", type=int, default=100)
+
+    work_parser = subparsers.add_parser("work", help="process queued emails")
+    work_parser.add_argument("--processes", type=int, default=1)
+    work_parser.add_argument("--batch-size", type=int, default=10)
+    work_parser.add_argument("--lease-seconds", type=int, default=DEFAULT_LEASE_SECONDS)
+    work_parser.add_argument("--drain", action="store_true")
+
+    subparsers.add_parser("stats", help="show queue counts")
+
+    requeue_parser = subparsers.add_parser(
+        "requeue-dead", help="retry dead-lettered emails"
+    )
+    requeue_parser.add_argument("message_ids", nargs="*")
+
+    args = parser.parse_args()
+    if args.command == "enqueue":
+        enqueue_unlabeled(args.max)
+    elif args.command == "work":
+        worker_args = (args.batch_size, args.lease_seconds, args.drain)
+        if args.processes == 1:
+            run_worker(*worker_args)
+            return
+        processes = [
+            multiprocessing.Process(target=run_worker, args=worker_args)
+            for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.command == "stats":
+        queue = get_work_queue()
+        print(queue.stats())
+        for item in queue.dead_letters():
+            print(
+                f"dead: {item['message_id']} ({item['attempts']}): {item['last_error']}"
+            )
+    else:
+        get_work_queue().requeue_dead(args.message_ids or None)
+
+
+if __name__ == "__main__":
+    main()
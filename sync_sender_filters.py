@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+import logging
+import argparse
+from datetime import datetime
+from gmail_service import SETTINGS_SCOPE, get_gmail_service
+from label_emails import get_label_map, get_or_create_label
+from utils.sender_filters import (
+    MIN_AGREEMENT,
+    MIN_MESSAGES,
+    evaluate,
+    find_sender_rules,
+    get_sender_category_counts,
+    list_filters,
+    mark_filter_removed,
+    match_counts,
+    record_filter,
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("sync_sender_filters")
+
+# Gmail allows 1,000 filters per account; leave room for the user's own
+MAX_FILTERS = 200
+
+
+def get_existing_from_criteria(service):
+    """Return the from criteria of every filter already in the mailbox."""
+    filters = (
+        service.users().settings().filters().list(userId="me").execute().get("filter")
+    )
+    return {f.get("criteria", {}).get("from") for f in filters or []}
+
+
+def create_filters(
+    service, rules, account=None, max_filters=MAX_FILTERS, dry_run=False
+):
+    """
+    Create a Gmail filter in the account's mailbox for each rule not already
+    covered by one, so Gmail labels matching mail on arrival and the
+    classifier never sees it. All filters created together share a run ID
+    for rollback. Returns (run ID, rules turned into filters).
+    """
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    active = list_filters(account, status="active")
+    existing = get_existing_from_criteria(service)
+    existing.update(row["match_from"] for row in active)
+    new_rules = [rule for rule in rules if rule["match_from"] not in existing]
+    new_rules = new_rules[: max(max_filters - len(active), 0)]
+    if dry_run:
+        return run_id, new_rules
+
+    label_map = get_label_map(service)
+    created = []
+    for rule in new_rules:
+        try:
+            label_id = get_or_create_label(service, rule["category"], label_map)
+            gmail_filter = (
+                service.users()
+                .settings()
+                .filters()
+                .create(
+                    userId="me",
+                    body={
+                        "criteria": {"from": rule["match_from"]},
+                        "action": {"addLabelIds": [label_id]},
+                    },
+                )
+                .execute()
+            )
+            record_filter(run_id, gmail_filter["id"], rule, label_id, account)
+            created.append(rule)
+            logger.info(f"Created filter {rule['match_from']} -> {rule['category']}")
+        except Exception as e:
+            logger.error(f"Error creating filter for {rule['match_from']}: {e}")
+    return run_id, created
+
+
+def rollback_filters(service, account=None, run_id=None, filter_ids=None):
+    """
+    Delete an account's active filters from Gmail, by run or by ID. Labels
+    the filters already applied stay on their messages. Returns the number
+    removed.
+    """
+    from googleapiclient.errors import HttpError
+
+    removed = 0
+    for row in list_filters(
+        account, status="active", run_id=run_id, filter_ids=filter_ids
+    ):
+        try:
+            service.users().settings().filters().delete(
+                userId="me", id=row["gmail_filter_id"]
+            ).execute()
+        except HttpError as e:
+            # Already deleted by hand in Gmail
+            if e.resp.status != 404:
+                logger.error(f"Error deleting filter {row['match_from']}: {e}")
+                continue
+        mark_filter_removed(row["id"])
+        removed += 1
+        logger.info(f"Removed filter {row['match_from']} -> {row['category']}")
+    return removed
+
+
+def print_rules(rules):
+    for rule in rules:
+        print(
+            f"  {rule['match_from']} -> {rule['category']} "
+            f"({rule['message_count']} messages, {rule['agreement']:.0%} agree)"
+        )
+
+
+def review_filters(account=None, min_agreement=MIN_AGREEMENT):
+    """
+    Print an account's active filters with the agreement they were created
+    at and their agreement now. Corrections made since can lower it; filters
+    below min_agreement are flagged for rollback.
+    """
+    counts = get_sender_category_counts(account)
+    for row in list_filters(account, status="active"):
+        categories = match_counts(counts, row["match_from"])
+        now = "no data"
+        flag = ""
+        if categories:
+            top_category, _, total, agreement = evaluate(categories)
+            now = f"now {agreement:.0%} of {total}"
+            if top_category != row["category"] or agreement < min_agreement:
+                flag = "  <- review"
+        print(
+            f"[{row['id']}] run {row['run_id']}: {row['match_from']} -> {row['category']} "
+            f"(created at {row['agreement']:.0%} of {row['message_count']}, {now}){flag}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Turn senders that are always classified the same way into Gmail filters"
+    )
+    parser.add_argument("--account", help="account name (default: the main account)")
+    parser.add_argument("--min-messages", type=int, default=MIN_MESSAGES)
+    parser.add_argument("--min-agreement", type=float, default=MIN_AGREEMENT)
+    parser.add_argument("--max-filters", type=int, default=MAX_FILTERS)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="list the filters without creating them"
+    )
+    parser.add_argument(
+        "--review", action="store_true", help="list the active filters and exit"
+    )
+    parser.add_argument("--rollback-run", help="remove the filters created by a run")
+    parser.add_argument(
+        "--rollback", type=int, nargs="+", metavar="ID", help="remove filters by ID"
+    )
+    args = parser.parse_args()
+
+    if args.review:
+        review_filters(args.account, args.min_agreement)
+        return
+
+    service = get_gmail_service(args.account, required_scopes=[SETTINGS_SCOPE])
+    if args.rollback_run or args.rollback:
+        removed = rollback_filters(
+            service, args.account, args.rollback_run, args.rollback
+        )
+        print(f"Removed {removed} filters")
+        return
+
+    rules = find_sender_rules(
+        get_sender_category_counts(args.account),
+        args.min_messages,
+        args.min_agreement,
+    )
+    run_id, created = create_filters(
+        service, rules, args.account, args.max_filters, args.dry_run
+    )
+    if args.dry_run:
+        print(f"Would create {len(created)} filters:")
+    else:
+        print(f"Run {run_id} created {len(created)} filters:")
+    print_rules(created)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import pytest
+import label_emails
+from utils.gmail_message import GmailMessage
+
+
+def test_get_message_raises_for_unfetchable_message(monkeypatch):
+    # batch_get_messages leaves out messages Gmail returned an error for
+    monkeypatch.setattr(
+        label_emails,
+        "get_message_metadata",
+        lambda service, ids: {"found": GmailMessage("found")},
+    )
+
+    assert label_emails.get_message(None, "found").id == "found"
+    with pytest.raises(label_emails.MessageNotFoundError, match="gone"):
+        label_emails.get_message(None, "gone")
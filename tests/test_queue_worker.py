@@ -0,0 +1,146 @@
+import pytest
+import queue_worker
+from utils.gmail_message import GmailMessage
+from utils.work_queue import WorkQueue
+
+
+class RecordingQueue(WorkQueue):
+    """In-memory queue that records acks and nacks."""
+
+    def __init__(self, batches=()):
+        self.batches = list(batches)
+        self.acked = []
+        self.nacked = []
+
+    def enqueue(self, message_ids):
+        return 0
+
+    def lease(self, worker_id, max_items=10, lease_seconds=300):
+        return self.batches.pop(0) if self.batches else []
+
+    def ack(self, worker_id, message_ids):
+        self.acked.extend(message_ids)
+        return len(message_ids)
+
+    def nack(self, worker_id, message_id, error=None):
+        self.nacked.append(message_id)
+
+    def dead_letters(self, limit=100):
+        return []
+
+    def requeue_dead(self, message_ids=None):
+        return 0
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def labeled(monkeypatch):
+    """Stub out Gmail and the classifier; returns {label ID: message IDs} applied."""
+    messages = {
+        "unlabeled": GmailMessage(
+            "unlabeled", label_ids=["INBOX", "UNREAD", "CATEGORY_PERSONAL"]
+        ),
+        "done": GmailMessage("done", label_ids=["INBOX", "Label_work"]),
+        "failed": GmailMessage("failed", label_ids=["INBOX"]),
+    }
+    applied = {}
+    monkeypatch.setattr(
+        queue_worker,
+        "get_message_metadata",
+        lambda service, ids: {i: messages[i] for i in ids if i in messages},
+    )
+    monkeypatch.setattr(
+        queue_worker,
+        "classify_message_with_confidence",
+        lambda service, msg: ("Other", None) if msg.id == "failed" else ("Work", 0.9),
+    )
+    monkeypatch.setattr(
+        queue_worker,
+        "get_or_create_label",
+        lambda service, name, label_map: label_map[name.lower()],
+    )
+
+    def batch_modify_labels(service, msg_ids, add_label_ids=None):
+        for label_id in add_label_ids:
+            applied.setdefault(label_id, []).extend(msg_ids)
+
+    monkeypatch.setattr(queue_worker, "batch_modify_labels", batch_modify_labels)
+    return applied
+
+
+def test_system_labels_do_not_count_as_classified(labeled):
+    label_map = {
+        "inbox": "INBOX",
+        "unread": "UNREAD",
+        "category_personal": "CATEGORY_PERSONAL",
+        "work": "Label_work",
+    }
+    work_queue = RecordingQueue()
+
+    done = queue_worker.process_batch(
+        None, work_queue, "w1", ["unlabeled", "done"], label_map, ["Label_work"]
+    )
+
+    assert labeled == {"Label_work": ["unlabeled"]}
+    assert sorted(work_queue.acked) == ["done", "unlabeled"]
+    assert work_queue.nacked == []
+    assert done == 2
+
+
+def test_missing_metadata_is_nacked(labeled):
+    work_queue = RecordingQueue()
+
+    queue_worker.process_batch(
+        None, work_queue, "w1", ["gone"], {"work": "Label_work"}, ["Label_work"]
+    )
+
+    assert work_queue.nacked == ["gone"]
+    assert work_queue.acked == []
+
+
+def test_failed_classification_is_nacked_not_labeled(labeled):
+    work_queue = RecordingQueue()
+
+    queue_worker.process_batch(
+        None, work_queue, "w1", ["failed"], {"work": "Label_work"}, ["Label_work"]
+    )
+
+    assert labeled == {}
+    assert work_queue.nacked == ["failed"]
+    assert work_queue.acked == []
+
+
+def test_worker_nacks_failed_batch_and_keeps_going(labeled, monkeypatch):
+    work_queue = RecordingQueue([["boom"], ["unlabeled"]])
+    monkeypatch.setattr(queue_worker, "get_work_queue", lambda: work_queue)
+    monkeypatch.setattr(queue_worker, "get_gmail_service", lambda **kwargs: None)
+    monkeypatch.setattr(
+        queue_worker, "get_label_map", lambda service: {"work": "Label_work"}
+    )
+    monkeypatch.setattr(
+        queue_worker,
+        "preload_classification_labels",
+        lambda service, label_map: {"Work": "Label_work"},
+    )
+
+    def get_message_metadata(service, ids):
+        if ids == ["boom"]:
+            raise ConnectionError("Gmail unavailable")
+        return {"unlabeled": GmailMessage("unlabeled", label_ids=["INBOX"])}
+
+    monkeypatch.setattr(queue_worker, "get_message_metadata", get_message_metadata)
+
+    assert queue_worker.run_worker(drain=True) == 1
+    assert work_queue.nacked == ["boom"]
+    assert work_queue.acked == ["unlabeled"]
+
+
+def test_work_queue_backends_must_implement_every_method():
+    class PartialQueue(WorkQueue):
+        def enqueue(self, message_ids):
+            return 0
+
+    with pytest.raises(TypeError):
+        PartialQueue()
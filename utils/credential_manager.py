@@ -0,0 +1,196 @@
+import os
+import json
+import pickle
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger("credential_manager")
+
+# Refresh this long before the access token expires. It's more than
+# google-auth's own threshold (3m45s), so requests never have to refresh.
+REFRESH_MARGIN = timedelta(minutes=5)
+# Re-check at least this often, to pick up tokens refreshed by other processes
+CHECK_INTERVAL = 600
+RETRY_SECONDS = 30
+MAX_RETRY_SECONDS = 600
+
+
+def _utcnow():
+    # google-auth stores expiry as a naive UTC datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def load_token_file(path, scopes):
+    """
+    Read authorized-user credentials from a JSON token file. The scopes
+    saved with the token are kept, so callers can tell which were granted;
+    scopes is only used for files that don't list them.
+    """
+    from google.oauth2.credentials import Credentials
+
+    with open(path, "r") as f:
+        info = json.load(f)
+    return Credentials.from_authorized_user_info(
+        info, None if info.get("scopes") else scopes
+    )
+
+
+def save_token_file(path, creds):
+    """Write credentials as JSON, atomically and readable only by the owner."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(creds.to_json())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CredentialManager:
+    """
+    Owns one account's OAuth credentials. The same Credentials object is
+    handed to every caller and refreshed in place, so services built from it
+    always see the current token. Refreshes are serialized: callers that
+    arrive while one is in flight wait for it and reuse its token. Refreshed
+    tokens are written back to the token file, and tokens written by other
+    processes are picked up before refreshing again.
+    """
+
+    def __init__(self, token_path, scopes, legacy_path=None):
+        self.token_path = token_path
+        self.scopes = scopes
+        self.legacy_path = legacy_path
+        self._creds = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresh_thread = None
+
+    def _migrate_legacy_token(self):
+        logger.info(f"Converting {self.legacy_path} to {self.token_path}")
+        # Only the file this application wrote itself is ever unpickled, once
+        with open(self.legacy_path, "rb") as f:
+            creds = pickle.load(f)
+        save_token_file(self.token_path, creds)
+        os.remove(self.legacy_path)
+
+    def _load(self):
+        """Re-read the token file if it changed. Called with the lock held."""
+        if (
+            self.legacy_path
+            and not os.path.exists(self.token_path)
+            and os.path.exists(self.legacy_path)
+        ):
+            self._migrate_legacy_token()
+        try:
+            mtime = os.stat(self.token_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+
+        loaded = load_token_file(self.token_path, self.scopes)
+        if self._creds is None:
+            self._creds = loaded
+        elif loaded.expiry and (
+            not self._creds.expiry or loaded.expiry > self._creds.expiry
+        ):
+            # Another process refreshed; adopt its token in place
+            self._creds.token = loaded.token
+            self._creds.expiry = loaded.expiry
+        self._mtime = mtime
+
+    def _needs_refresh(self):
+        if not self._creds or not self._creds.refresh_token:
+            return False
+        if not self._creds.token or not self._creds.expiry:
+            return not self._creds.token
+        return self._creds.expiry - REFRESH_MARGIN <= _utcnow()
+
+    def _refresh(self):
+        from google.auth.transport.requests import Request
+
+        logger.info(f"Refreshing credentials for {self.token_path}")
+        self._creds.refresh(Request())
+        save_token_file(self.token_path, self._creds)
+        self._mtime = os.stat(self.token_path).st_mtime_ns
+
+    def get_credentials(self):
+        """
+        Return the shared credentials (None if none are saved), refreshing
+        them first if they expire soon.
+        """
+        with self._lock:
+            self._load()
+            if self._needs_refresh():
+                self._refresh()
+            return self._creds
+
+    def refresh(self, stale_token=None):
+        """
+        Refresh now. With stale_token (e.g. after a 401), the refresh is
+        skipped if the token has already been replaced by another caller.
+        """
+        with self._lock:
+            self._load()
+            if self._creds is None:
+                return None
+            if stale_token is None or self._creds.token == stale_token:
+                self._refresh()
+            return self._creds
+
+    def save(self, creds):
+        """Store newly authorized credentials."""
+        with self._lock:
+            save_token_file(self.token_path, creds)
+            self._mtime = os.stat(self.token_path).st_mtime_ns
+            self._creds = creds
+
+    def _seconds_until_refresh(self):
+        with self._lock:
+            if not self._creds or not self._creds.expiry:
+                return CHECK_INTERVAL
+            due_at = self._creds.expiry - REFRESH_MARGIN
+        return min(max((due_at - _utcnow()).total_seconds(), 0), CHECK_INTERVAL)
+
+    def _refresh_loop(self):
+        failures = 0
+        while not self._stop.wait(self._seconds_until_refresh()):
+            try:
+                self.get_credentials()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                delay = min(RETRY_SECONDS * 2 ** (failures - 1), MAX_RETRY_SECONDS)
+                logger.error(
+                    f"Background refresh of {self.token_path} failed: {e} (retrying in {delay}s)"
+                )
+                self._stop.wait(delay)
+
+    def start_background_refresh(self):
+        """Keep the token fresh from a daemon thread (started once)."""
+        with self._lock:
+            if self._refresh_thread is None:
+                self._refresh_thread = threading.Thread(
+                    target=self._refresh_loop,
+                    name=f"credential-refresh-{os.path.basename(self.token_path)}",
+                    daemon=True,
+                )
+                self._refresh_thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_credential_manager(token_path, scopes, legacy_path=None):
+    """Return the process-wide manager for a token file."""
+    with _managers_lock:
+        if token_path not in _managers:
+            _managers[token_path] = CredentialManager(token_path, scopes, legacy_path)
+        return _managers[token_path]
@@ -0,0 +1,88 @@
+import re
+import html
+import base64
+import logging
+
+logger = logging.getLogger("email_body")
+
+# Default amount of body text to extract, in characters
+BODY_MAX_CHARS = 2000
+# Markup makes up most of an HTML body, so more of it is decoded to get the
+# same amount of text
+HTML_BYTES_PER_CHAR = 8
+
+_CHARSET = re.compile(r'charset="?([\w.:-]+)', re.IGNORECASE)
+_HTML_SKIPPED = re.compile(
+    r"<(script|style|head)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL
+)
+_HTML_TAG = re.compile(r"<[^>]*>")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def iter_text_parts(payload):
+    """Yield the leaf parts of a Gmail message payload in order, skipping attachments."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        if part.get("parts"):
+            stack.extend(reversed(part["parts"]))
+        elif not part.get("filename") and part.get("body", {}).get("data"):
+            yield part
+
+
+def decode_prefix(data, max_bytes):
+    """Decode only the first max_bytes of a base64url body."""
+    # Every 4 base64 characters hold 3 bytes
+    data = data[: -(-max_bytes // 3) * 4]
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))[:max_bytes]
+
+
+def get_charset(part):
+    for header in part.get("headers", []):
+        if header["name"].lower() == "content-type":
+            match = _CHARSET.search(header["value"])
+            if match:
+                return match.group(1)
+    return "utf-8"
+
+
+def html_to_text(markup):
+    """Cheap HTML to text: drop scripts, styles and tags, then unescape entities."""
+    # A body cut off by the budget can end inside a tag
+    if markup.rfind("<") > markup.rfind(">"):
+        markup = markup[: markup.rfind("<")]
+    text = _HTML_SKIPPED.sub(" ", markup)
+    return html.unescape(_HTML_TAG.sub(" ", text))
+
+
+def extract_body_text(payload, max_chars=BODY_MAX_CHARS):
+    """
+    Return up to max_chars of a message's body text from a full-format Gmail
+    payload. The text/plain part is used if there is one, otherwise the
+    text/html part converted to text. Only as much of the part as the budget
+    needs is decoded. Returns "" if there is no text body.
+    """
+    plain = html_part = None
+    for part in iter_text_parts(payload):
+        mime_type = part.get("mimeType", "").lower()
+        if mime_type == "text/plain":
+            plain = part
+            break
+        if mime_type == "text/html" and html_part is None:
+            html_part = part
+
+    part = plain or html_part
+    if part is None:
+        return ""
+
+    # UTF-8 needs up to 4 bytes per character
+    max_bytes = max_chars * (4 if part is plain else HTML_BYTES_PER_CHAR)
+    raw = decode_prefix(part["body"]["data"], max_bytes)
+    try:
+        text = raw.decode(get_charset(part), errors="replace")
+    except LookupError:
+        logger.warning(f"Unknown charset in {part.get('mimeType')} part, using UTF-8")
+        text = raw.decode("utf-8", errors="replace")
+    if part is html_part:
+        text = html_to_text(text)
+    return _WHITESPACE.sub(" ", text).strip()[:max_chars]
@@ -1,53 +1,128 @@
 # utils/excel_utils.py
 
+import sqlite3
 import pandas as pd
-import email.header
-from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
+import xlsxwriter
+from utils import feedback_db
+from utils.gmail_message import decode_mime_header
 
+CHUNK_SIZE = 10000
+SNIPPET_CHARS = 150
+# Excel's limits
+MAX_ROWS = 1048576
+MAX_COLUMN_WIDTH = 255
 
-def convert_csv_to_excel(csv_file_path, excel_file_path="cleaned_email_data.xlsx"):
-    # Load raw CSV
-    df = pd.read_csv(csv_file_path)
-
-    # Decode MIME-encoded subject lines
-    def decode_subject(subject):
-        try:
-            decoded, charset = email.header.decode_header(subject)[0]
-            if isinstance(decoded, bytes):
-                return decoded.decode(charset or "utf-8")
-            return decoded
-        except Exception:
-            return subject
-
-    df["Subject"] = df["Subject"].apply(decode_subject)
-
-    # Clean whitespaces and truncate long snippets
-    df["Snippet"] = df["Snippet"].fillna("").apply(lambda x: " ".join(str(x).split()))
-    df["Snippet"] = df["Snippet"].apply(
-        lambda x: x[:150] + "..." if len(x) > 150 else x
-    )
+# Presentation names for the exported columns
+COLUMN_NAMES = {
+    "Subject": "Email Subject",
+    "From": "Sender",
+    "Snippet": "Email Snippet",
+    "AI_Category": "Predicted Category",
+    "User_Category": "User Category",
+}
+
+
+def clean_chunk(df):
+    """Decode subjects, tidy snippets and rename columns for one chunk of rows."""
+    if "Subject" in df and pd.api.types.is_string_dtype(df["Subject"]):
+        # Only MIME-encoded subjects need the (per-value) decoder
+        subjects = df["Subject"]
+        encoded = subjects.str.contains("=?", regex=False, na=False)
+        if encoded.any():
+            subjects = subjects.copy()
+            subjects[encoded] = subjects[encoded].map(decode_mime_header)
+            df["Subject"] = subjects
 
-    # Rename columns for presentation
-    df = df.rename(
-        columns={
-            "Subject": "Email Subject",
-            "From": "Sender",
-            "Snippet": "Email Snippet",
-            "AI_Category": "Predicted Category",
-            "User_Category": "User Category",
-        }
+    if "Snippet" in df:
+        # Clean whitespaces and truncate long snippets
+        snippets = (
+            df["Snippet"]
+            .fillna("")
+            .astype(str)
+            .str.replace(r"\s+", " ", regex=True)
+            .str.strip()
+        )
+        df["Snippet"] = snippets.where(
+            snippets.str.len() <= SNIPPET_CHARS,
+            snippets.str.slice(0, SNIPPET_CHARS) + "...",
+        )
+
+    return df.rename(columns=COLUMN_NAMES)
+
+
+def write_excel(chunks, excel_file_path):
+    """
+    Write DataFrame chunks to an xlsx file in one pass. Rows are streamed to
+    disk (constant memory mode) and column widths are tracked as they are
+    written. Rows beyond Excel's limit continue on another sheet.
+    Returns the number of rows written.
+    """
+    workbook = xlsxwriter.Workbook(
+        excel_file_path, {"constant_memory": True, "strings_to_urls": False}
     )
+    sheets = []
+    columns = None
+    widths = []
+    row = MAX_ROWS
+    total = 0
+
+    for chunk in chunks:
+        chunk = clean_chunk(chunk)
+        if columns is None:
+            columns = list(chunk.columns)
+            widths = [len(str(name)) for name in columns]
 
-    # Save cleaned version to Excel
-    df.to_excel(excel_file_path, index=False)
+        for i, name in enumerate(columns):
+            lengths = chunk[name].dropna().astype(str).str.len()
+            if not lengths.empty:
+                widths[i] = max(widths[i], int(lengths.max()))
 
-    # Auto-adjust column widths
-    wb = load_workbook(excel_file_path)
-    ws = wb.active
-    for col in ws.columns:
-        max_len = max((len(str(cell.value)) for cell in col if cell.value), default=0)
-        ws.column_dimensions[get_column_letter(col[0].column)].width = max_len + 2
-    wb.save(excel_file_path)
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for record in values.itertuples(index=False, name=None):
+            if row == MAX_ROWS:
+                sheets.append(workbook.add_worksheet())
+                sheets[-1].write_row(0, 0, columns)
+                row = 1
+            sheets[-1].write_row(row, 0, record)
+            row += 1
+        total += len(chunk)
+
+    if not sheets:
+        workbook.add_worksheet()
+    # Column settings are stored separately from row data, so they can be set last
+    for sheet in sheets:
+        for i, width in enumerate(widths):
+            sheet.set_column(i, i, min(width + 2, MAX_COLUMN_WIDTH))
+    workbook.close()
+    return total
+
+
+def convert_csv_to_excel(csv_file_path, excel_file_path="cleaned_email_data.xlsx"):
+    # Read the CSV a chunk at a time so memory doesn't grow with the file
+    chunks = pd.read_csv(csv_file_path, chunksize=CHUNK_SIZE)
+    write_excel(chunks, excel_file_path)
 
     print(f"✅ Cleaned Excel saved as: {excel_file_path}")
+
+
+def export_feedback_to_excel(excel_file_path="feedback_export.xlsx"):
+    """Export all classification feedback from the database straight to Excel."""
+    conn = sqlite3.connect(feedback_db.DB_PATH)
+    try:
+        chunks = pd.read_sql_query(
+            """
+        SELECT subject AS Subject, sender AS "From", snippet AS Snippet,
+               ai_category AS AI_Category, user_category AS User_Category,
+               timestamp AS Timestamp
+        FROM classification_feedback
+        ORDER BY id
+        """,
+            conn,
+            chunksize=CHUNK_SIZE,
+        )
+        count = write_excel(chunks, excel_file_path)
+    finally:
+        conn.close()
+
+    print(f"✅ Exported {count} feedback entries to: {excel_file_path}")
+    return count
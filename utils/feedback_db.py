@@ -2,6 +2,7 @@ import sqlite3
 import os
 import logging
 import json
+import threading
 from datetime import datetime
 
 # Configure logging
@@ -51,28 +52,222 @@ def init_db():
     """
     )
 
+    # Every classification made by the labeling commands, for mining
+    # sender rules; the latest row per message is the one that counts.
+    # account is NULL for the default account.
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS classification_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id TEXT,
+        sender TEXT,
+        category TEXT,
+        confidence REAL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        account TEXT
+    )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_history_message ON classification_history (message_id, id)"
+    )
+
+    # Gmail filters created from sender rules, kept for review and rollback
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS gmail_filters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id TEXT,
+        gmail_filter_id TEXT,
+        match_from TEXT,
+        category TEXT,
+        label_id TEXT,
+        message_count INTEGER,
+        agreement REAL,
+        status TEXT DEFAULT 'active',
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        removed_at DATETIME,
+        account TEXT
+    )
+    """
+    )
+
+    # Databases created before history and filters were kept per account
+    for table in ("classification_history", "gmail_filters"):
+        columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        if "account" not in columns:
+            logger.info(f"Adding account column to {table}")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN account TEXT")
+
+    # Databases created before the sender column was added
+    columns = {
+        row[1] for row in cursor.execute("PRAGMA table_info(classification_feedback)")
+    }
+    if "sender" not in columns:
+        logger.info("Adding sender column to classification_feedback")
+        cursor.execute("ALTER TABLE classification_feedback ADD COLUMN sender TEXT")
+
+    # Lets the prompt updater page through unprocessed feedback by ID
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_feedback_unprocessed ON classification_feedback (is_processed, id)"
+    )
+
+    # Dashboard queries: time-bucketed series read only this index, and the
+    # misclassified drill-down pages through a partial index of just those rows
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_feedback_timestamp ON classification_feedback (timestamp, ai_category, user_category)"
+    )
+    cursor.execute(
+        """
+    CREATE INDEX IF NOT EXISTS idx_feedback_misclassified
+    ON classification_feedback (id) WHERE ai_category != user_category
+    """
+    )
+
+    # Running count of unprocessed misclassifications, kept up to date on
+    # every write so update triggers never have to scan the table
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS feedback_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER
+    )
+    """
+    )
+    cursor.execute(
+        """
+    INSERT OR IGNORE INTO feedback_counters (name, value)
+    SELECT 'unprocessed_incorrect', COUNT(*) FROM classification_feedback
+    WHERE is_processed = 0 AND ai_category != user_category
+    """
+    )
+
     conn.commit()
     conn.close()
     logger.info("Database initialization complete")
 
 
-def store_feedback(message_id, subject, snippet, ai_category, user_category):
+_db_initialized = False
+_init_lock = threading.Lock()
+
+
+def ensure_db():
+    """Run init_db once per process, for commands that don't call it themselves."""
+    global _db_initialized
+    with _init_lock:
+        if not _db_initialized:
+            init_db()
+            _db_initialized = True
+
+
+_feedback_listeners = []
+
+
+def add_feedback_listener(listener):
+    """
+    Register a callable run after feedback is stored, with the current number
+    of unprocessed misclassifications.
+    """
+    _feedback_listeners.append(listener)
+
+
+def _notify_feedback_listeners(conn):
+    if not _feedback_listeners:
+        return
+    count = _read_incorrect_counter(conn)
+    for listener in _feedback_listeners:
+        try:
+            listener(count)
+        except Exception as e:
+            logger.error(f"Feedback listener failed: {e}")
+
+
+def _read_incorrect_counter(conn):
+    row = conn.execute(
+        "SELECT value FROM feedback_counters WHERE name = 'unprocessed_incorrect'"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def _adjust_incorrect_counter(conn, message_ids, new_incorrect):
+    """
+    Add the misclassifications being written to the running counter, minus
+    the unprocessed ones they replace. Runs inside the write's transaction.
+    """
+    replaced = conn.execute(
+        """
+    SELECT COUNT(*) FROM classification_feedback
+    WHERE message_id IN (SELECT value FROM json_each(?))
+    AND is_processed = 0 AND ai_category != user_category
+    """,
+        (json.dumps(list(message_ids)),),
+    ).fetchone()[0]
+    conn.execute(
+        "UPDATE feedback_counters SET value = value + ? WHERE name = 'unprocessed_incorrect'",
+        (new_incorrect - replaced,),
+    )
+
+
+def _recount_incorrect_counter(conn):
+    conn.execute(
+        """
+    UPDATE feedback_counters SET value = (
+        SELECT COUNT(*) FROM classification_feedback
+        WHERE is_processed = 0 AND ai_category != user_category
+    )
+    WHERE name = 'unprocessed_incorrect'
+    """
+    )
+
+
+def get_unprocessed_incorrect_count():
+    """Return the number of unprocessed misclassifications without a table scan."""
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        count = _read_incorrect_counter(conn)
+        conn.close()
+        return count
+    except Exception as e:
+        logger.error(f"Error reading misclassification counter: {e}")
+        return 0
+
+
+# A write without a sender keeps the one already stored for the message
+_KEEP_SENDER = """COALESCE(NULLIF(?, ''), (
+            SELECT sender FROM classification_feedback WHERE message_id = ?
+        ))"""
+
+
+def store_feedback(
+    message_id, subject, snippet, ai_category, user_category, sender=None
+):
     """Store user feedback about classification."""
     logger.info(f"Storing feedback for message {message_id}")
     try:
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
 
+        _adjust_incorrect_counter(conn, [message_id], int(ai_category != user_category))
         cursor.execute(
-            """
+            f"""
         INSERT OR REPLACE INTO classification_feedback 
-        (message_id, subject, snippet, ai_category, user_category, timestamp)
-        VALUES (?, ?, ?, ?, ?, ?)
+        (message_id, subject, snippet, sender, ai_category, user_category, timestamp)
+        VALUES (?, ?, ?, {_KEEP_SENDER}, ?, ?, ?)
         """,
-            (message_id, subject, snippet, ai_category, user_category, datetime.now()),
+            (
+                message_id,
+                subject,
+                snippet,
+                sender,
+                message_id,
+                ai_category,
+                user_category,
+                datetime.now(),
+            ),
         )
 
         conn.commit()
+        _notify_feedback_listeners(conn)
         conn.close()
         logger.info(f"Feedback stored successfully for message {message_id}")
         return True
@@ -81,6 +276,58 @@ def store_feedback(message_id, subject, snippet, ai_category, user_category):
         return False
 
 
+def store_feedback_batch(entries):
+    """Store many feedback entries in a single transaction.
+
+    Each entry is a dict with message_id, subject, snippet, ai_category and
+    user_category keys, and optionally the sender's address.
+    """
+    if not entries:
+        return True
+
+    logger.info(f"Storing {len(entries)} feedback entries in one transaction")
+    try:
+        now = datetime.now()
+        rows = [
+            (
+                entry["message_id"],
+                entry.get("subject", ""),
+                entry.get("snippet", ""),
+                entry.get("sender"),
+                entry["message_id"],
+                entry["ai_category"],
+                entry["user_category"],
+                now,
+            )
+            for entry in entries
+        ]
+
+        # The last entry for a message is the one that ends up stored
+        latest = {entry["message_id"]: entry for entry in entries}
+        new_incorrect = sum(
+            entry["ai_category"] != entry["user_category"] for entry in latest.values()
+        )
+
+        conn = sqlite3.connect(DB_PATH)
+        with conn:
+            _adjust_incorrect_counter(conn, latest, new_incorrect)
+            conn.executemany(
+                f"""
+            INSERT OR REPLACE INTO classification_feedback
+            (message_id, subject, snippet, sender, ai_category, user_category, timestamp)
+            VALUES (?, ?, ?, {_KEEP_SENDER}, ?, ?, ?)
+            """,
+                rows,
+            )
+        _notify_feedback_listeners(conn)
+        conn.close()
+        logger.info(f"Stored {len(rows)} feedback entries successfully")
+        return True
+    except Exception as e:
+        logger.error(f"Error storing feedback batch: {e}")
+        return False
+
+
 def get_unprocessed_feedback(limit=100):
     """Retrieve unprocessed feedback for prompt improvement."""
     logger.info("Retrieving unprocessed feedback")
@@ -110,6 +357,94 @@ def get_unprocessed_feedback(limit=100):
         return []
 
 
+def count_unprocessed_feedback():
+    """Return the number of feedback entries not yet used for a prompt update."""
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        count = conn.execute(
+            "SELECT COUNT(*) FROM classification_feedback WHERE is_processed = 0"
+        ).fetchone()[0]
+        conn.close()
+        return count
+    except Exception as e:
+        logger.error(f"Error counting unprocessed feedback: {e}")
+        return 0
+
+
+def iter_unprocessed_feedback(page_size=500, max_id=None):
+    """
+    Yield every unprocessed feedback entry in ID order, reading one page at a
+    time (keyset pagination on id) so memory use doesn't grow with the table.
+    Entries with an ID above max_id are skipped.
+    """
+    upper_id = max_id if max_id is not None else 2**63 - 1
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    last_id = 0
+    try:
+        while True:
+            rows = conn.execute(
+                """
+            SELECT * FROM classification_feedback
+            WHERE is_processed = 0 AND id > ? AND id <= ?
+            ORDER BY id
+            LIMIT ?
+            """,
+                (last_id, upper_id, page_size),
+            ).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+            last_id = rows[-1]["id"]
+    finally:
+        conn.close()
+
+
+def get_max_feedback_id():
+    """Return the highest feedback ID (0 if there is none)."""
+    conn = sqlite3.connect(DB_PATH)
+    max_id = conn.execute("SELECT MAX(id) FROM classification_feedback").fetchone()[0]
+    conn.close()
+    return max_id or 0
+
+
+def get_prompt_update_count():
+    """Return the number of prompt updates made so far."""
+    conn = sqlite3.connect(DB_PATH)
+    count = conn.execute("SELECT COUNT(*) FROM prompt_updates").fetchone()[0]
+    conn.close()
+    return count
+
+
+def mark_feedback_processed_through(max_id, skip_parity=None):
+    """
+    Mark every unprocessed feedback entry with an ID up to max_id as
+    processed, except entries whose ID has the parity skip_parity.
+    """
+    logger.info(f"Marking feedback entries up to ID {max_id} as processed")
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        with conn:
+            cursor = conn.execute(
+                """
+            UPDATE classification_feedback
+            SET is_processed = 1
+            WHERE is_processed = 0 AND id <= ? AND id % 2 IS NOT ?
+            """,
+                (max_id, skip_parity),
+            )
+            _recount_incorrect_counter(conn)
+        conn.close()
+        logger.info(
+            f"Successfully marked {cursor.rowcount} feedback entries as processed"
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Error marking feedback as processed: {e}")
+        return False
+
+
 def mark_feedback_as_processed(feedback_ids):
     """Mark feedback as processed after using it for prompt improvement."""
     if not feedback_ids:
@@ -129,6 +464,7 @@ def mark_feedback_as_processed(feedback_ids):
         """,
             feedback_ids,
         )
+        _recount_incorrect_counter(conn)
 
         conn.commit()
         conn.close()
@@ -141,6 +477,30 @@ def mark_feedback_as_processed(feedback_ids):
         return False
 
 
+def record_classification(message_id, sender, category, confidence=None, account=None):
+    """
+    Add a classification made by the labeling commands to the history.
+    account is the mailbox's account name (None for the default account).
+    """
+    try:
+        ensure_db()
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        with conn:
+            conn.execute(
+                """
+            INSERT INTO classification_history
+            (message_id, sender, category, confidence, timestamp, account)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+                (message_id, sender, category, confidence, datetime.now(), account),
+            )
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error recording classification of {message_id}: {e}")
+        return False
+
+
 def store_prompt_update(old_prompt, new_prompt, feedback_count, performance_metrics):
     """Store history of prompt updates."""
     logger.info("Storing prompt update")
@@ -242,3 +602,96 @@ def get_feedback_stats():
             "category_distribution": {},
             "common_errors": [],
         }
+
+
+def get_feedback_version():
+    """
+    Return a value that changes whenever feedback is stored, for invalidating
+    cached statistics. Replaced entries get a new ID, so the highest ID is enough.
+    """
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        version = conn.execute(
+            "SELECT MAX(id) FROM classification_feedback"
+        ).fetchone()[0]
+        conn.close()
+        return version or 0
+    except Exception as e:
+        logger.error(f"Error reading feedback version: {e}")
+        return 0
+
+
+# SQL expression for each time bucket, from finest to coarsest. Timestamps
+# are stored as ISO strings, so prefixes are cheaper than strftime.
+TIME_BUCKETS = {
+    "hour": "substr(timestamp, 1, 13) || ':00'",
+    "day": "substr(timestamp, 1, 10)",
+    "week": "strftime('%Y-W%W', timestamp)",
+    "month": "substr(timestamp, 1, 7)",
+}
+
+
+def get_feedback_time_series(bucket="day", since=None):
+    """
+    Get feedback volume and accuracy per time bucket, aggregated in SQLite so
+    only one row per bucket is returned. Optionally only feedback stored since
+    the given datetime is included.
+    """
+    logger.info(f"Retrieving feedback time series by {bucket}")
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        rows = conn.execute(
+            f"""
+        SELECT {TIME_BUCKETS[bucket]} AS bucket,
+               COUNT(*) AS total,
+               SUM(ai_category != user_category) AS incorrect
+        FROM classification_feedback
+        WHERE timestamp >= ?
+        GROUP BY bucket
+        ORDER BY bucket
+        """,
+            (since or "",),
+        ).fetchall()
+        conn.close()
+
+        return [
+            {
+                "bucket": row[0],
+                "total": row[1],
+                "incorrect": row[2],
+                "accuracy": (row[1] - row[2]) / row[1],
+            }
+            for row in rows
+        ]
+    except Exception as e:
+        logger.error(f"Error retrieving feedback time series: {e}")
+        return []
+
+
+def get_misclassified_feedback(limit=50, before_id=None, user_category=None):
+    """
+    Get one page of misclassified feedback, newest first. Pass the last ID of
+    the previous page as before_id to get the next one (keyset pagination, so
+    deep pages cost the same as the first).
+    """
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        query = """
+        SELECT id, message_id, subject, snippet, sender, ai_category, user_category, timestamp
+        FROM classification_feedback
+        WHERE ai_category != user_category AND id < ?
+        """
+        params = [before_id if before_id is not None else 2**63 - 1]
+        if user_category:
+            query += " AND user_category = ?"
+            params.append(user_category)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Error retrieving misclassified feedback: {e}")
+        return []
@@ -0,0 +1,157 @@
+import atexit
+import logging
+import threading
+from utils.feedback_db import store_feedback_batch
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("feedback_writer")
+
+# Flush when this many distinct messages are waiting...
+MAX_BATCH_SIZE = 100
+# ...and otherwise every FLUSH_INTERVAL seconds
+FLUSH_INTERVAL = 2.0
+
+
+class FeedbackWriter:
+    """
+    Write-behind buffer for classification feedback. Callers only enqueue; a
+    background thread coalesces entries by message_id (the latest correction
+    wins) and writes them with store_feedback_batch on size or time thresholds.
+    """
+
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="feedback-writer", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"Feedback writer started (batch size: {max_batch_size}, interval: {flush_interval}s)"
+        )
+
+    def enqueue(
+        self, message_id, subject, snippet, ai_category, user_category, sender=None
+    ):
+        """
+        Queue feedback for a message, replacing any pending entry for it.
+        Returns False once the writer is closed.
+        """
+        entry = {
+            "message_id": message_id,
+            "subject": subject,
+            "snippet": snippet,
+            "sender": sender,
+            "ai_category": ai_category,
+            "user_category": user_category,
+        }
+
+        # Checked under the lock close() sets _closed with, so every entry
+        # accepted here is still pending for its final flush
+        with self._lock:
+            if self._closed:
+                logger.warning(f"Feedback writer closed, dropping {message_id}")
+                return False
+            self._pending[message_id] = entry
+            pending_count = len(self._pending)
+
+        logger.debug(
+            f"Queued feedback for message {message_id} ({pending_count} pending)"
+        )
+        if pending_count >= self.max_batch_size:
+            self._wake.set()
+        return True
+
+    def store_now(self, entries):
+        """
+        Write entries synchronously, in order with the buffer. Pending entries
+        for the same messages are older, so they are dropped instead of being
+        flushed over these later. Returns False if the write failed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                replaced = [
+                    self._pending.pop(entry["message_id"])
+                    for entry in entries
+                    if entry["message_id"] in self._pending
+                ]
+
+            if store_feedback_batch(entries):
+                return True
+
+            with self._lock:
+                for entry in replaced:
+                    self._pending.setdefault(entry["message_id"], entry)
+            return False
+
+    def pending_count(self):
+        """Return the number of messages waiting to be written."""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write all pending feedback now. Returns False if the write failed."""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending.values())
+                self._pending.clear()
+
+            if not batch:
+                return True
+
+            logger.info(f"Flushing {len(batch)} buffered feedback entries")
+            if store_feedback_batch(batch):
+                return True
+
+            # Put the entries back for the next attempt unless a newer
+            # correction for the same message arrived in the meantime
+            with self._lock:
+                for entry in batch:
+                    self._pending.setdefault(entry["message_id"], entry)
+            logger.error(f"Failed to flush {len(batch)} feedback entries, will retry")
+            return False
+
+    def close(self, timeout=10):
+        """Stop the background thread and write everything still pending."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        logger.info("Closing feedback writer")
+        self._wake.set()
+        self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Unexpected error in feedback writer: {e}")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_feedback_writer():
+    """Return the process-wide feedback writer, starting it on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = FeedbackWriter()
+            # Flush whatever is still buffered when the interpreter exits
+            atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,116 @@
+import email.header
+import email.utils
+
+# Headers kept from a Gmail payload; everything else is dropped when parsing
+DEFAULT_HEADERS = ("subject", "from", "date")
+
+NO_SUBJECT = "(No Subject)"
+NO_SENDER = "(No Sender)"
+
+
+def decode_mime_header(value):
+    """Decode an RFC 2047 encoded header (e.g. =?UTF-8?B?...?=) to text."""
+    if not isinstance(value, str) or "=?" not in value:
+        return value
+    try:
+        return str(email.header.make_header(email.header.decode_header(value)))
+    except Exception:
+        return value
+
+
+class GmailMessage:
+    """
+    Compact, parsed view of a Gmail message resource. Headers are parsed once
+    into a case-insensitive map holding only the headers we use, and encoded
+    subjects and sender names are decoded lazily on first access.
+    """
+
+    __slots__ = (
+        "id",
+        "thread_id",
+        "internal_date",
+        "label_ids",
+        "snippet",
+        "history_id",
+        "_headers",
+        "_subject",
+        "_sender_name",
+    )
+
+    def __init__(
+        self,
+        id,
+        thread_id=None,
+        internal_date=0,
+        label_ids=(),
+        snippet="",
+        history_id=None,
+        headers=None,
+    ):
+        self.id = id
+        self.thread_id = thread_id
+        self.internal_date = int(internal_date or 0)
+        self.label_ids = list(label_ids)
+        self.snippet = snippet or ""
+        self.history_id = history_id
+        self._headers = headers or {}
+        self._subject = None
+        self._sender_name = None
+
+    @classmethod
+    def from_resource(cls, msg, header_names=DEFAULT_HEADERS):
+        """Parse a Gmail API message resource (metadata or full format)."""
+        wanted = set(header_names)
+        headers = {}
+        for header in msg.get("payload", {}).get("headers", []):
+            name = header["name"].lower()
+            if name in wanted and name not in headers:
+                headers[name] = header["value"]
+
+        return cls(
+            msg["id"],
+            thread_id=msg.get("threadId"),
+            internal_date=msg.get("internalDate", 0),
+            label_ids=msg.get("labelIds", []),
+            snippet=msg.get("snippet", ""),
+            history_id=msg.get("historyId"),
+            headers=headers,
+        )
+
+    def header(self, name, default=None):
+        """Return a raw header value by case-insensitive name."""
+        return self._headers.get(name.lower(), default)
+
+    @property
+    def subject(self):
+        """Decoded Subject header, or "(No Subject)" if there is none."""
+        if self._subject is None:
+            raw = self._headers.get("subject")
+            self._subject = NO_SUBJECT if raw is None else decode_mime_header(raw)
+        return self._subject
+
+    @property
+    def sender(self):
+        """From header as sent, or "(No Sender)" if there is none."""
+        return self._headers.get("from", NO_SENDER)
+
+    @property
+    def sender_name(self):
+        """Decoded display name of the sender, falling back to the address."""
+        if self._sender_name is None:
+            name, address = email.utils.parseaddr(self._headers.get("from", ""))
+            self._sender_name = decode_mime_header(name) or address or NO_SENDER
+        return self._sender_name
+
+    @property
+    def sender_address(self):
+        """Lower-cased email address of the sender ("" if unknown)."""
+        return email.utils.parseaddr(self._headers.get("from", ""))[1].lower()
+
+    @property
+    def date(self):
+        """Date header as sent ("" if missing)."""
+        return self._headers.get("date", "")
+
+    def __repr__(self):
+        return f"GmailMessage(id={self.id!r}, subject={self.subject!r})"
@@ -0,0 +1,288 @@
+import os
+import socket
+import sqlite3
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("job_queue")
+
+DB_PATH = "jobs.db"
+
+# Number of emails processed concurrently and how many may wait in the queue
+MAX_WORKERS = int(os.environ.get("CLASSIFY_JOB_WORKERS", 4))
+MAX_PENDING = int(os.environ.get("CLASSIFY_JOB_MAX_PENDING", 1000))
+# Unfinished jobs owned by another host are only failed after this long
+# without progress, since there's no way to tell if their process is alive
+STALE_JOB_SECONDS = 3600
+
+
+class QueueFullError(Exception):
+    """Raised when a job would exceed the number of pending emails allowed."""
+
+
+def get_owner():
+    """Identify this process as the owner of the jobs it runs."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_job_abandoned(owner, updated_at, stale_before):
+    """
+    Whether an unfinished job's process has gone: checked directly for
+    processes on this host, otherwise assumed once the job has made no
+    progress since stale_before.
+    """
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname():
+        return updated_at < stale_before
+    try:
+        os.kill(int(pid), 0)
+    except (ProcessLookupError, ValueError):
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def init_job_db():
+    """
+    Create the job tables and fail unfinished jobs whose process has gone.
+    Several processes (workers, reloaders, both apps) share jobs.db, so jobs
+    that a live process is still running are left alone.
+    """
+    logger.info("Initializing job database")
+    conn = sqlite3.connect(DB_PATH)
+    with conn:
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS classification_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT,
+            total INTEGER,
+            created_at DATETIME,
+            updated_at DATETIME,
+            owner TEXT
+        )
+        """
+        )
+        # Databases created before jobs recorded their owner
+        columns = {
+            row[1] for row in conn.execute("PRAGMA table_info(classification_jobs)")
+        }
+        if "owner" not in columns:
+            conn.execute("ALTER TABLE classification_jobs ADD COLUMN owner TEXT")
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS classification_job_items (
+            job_id TEXT,
+            email_id TEXT,
+            status TEXT,
+            category TEXT,
+            error TEXT,
+            updated_at DATETIME,
+            PRIMARY KEY (job_id, email_id)
+        )
+        """
+        )
+
+        # Work queued in memory is lost when its process stops
+        now = datetime.now()
+        stale_before = str(now - timedelta(seconds=STALE_JOB_SECONDS))
+        unfinished = conn.execute(
+            """
+        SELECT id, owner, updated_at FROM classification_jobs
+        WHERE status IN ('queued', 'running')
+        """
+        ).fetchall()
+        stale_ids = [
+            job_id
+            for job_id, owner, updated_at in unfinished
+            if is_job_abandoned(owner, updated_at, stale_before)
+        ]
+        if stale_ids:
+            logger.info(f"Failing {len(stale_ids)} jobs interrupted by a restart")
+        conn.executemany(
+            """
+        UPDATE classification_job_items
+        SET status = 'failed', error = 'Interrupted by server restart', updated_at = ?
+        WHERE job_id = ? AND status IN ('queued', 'running')
+        """,
+            [(now, job_id) for job_id in stale_ids],
+        )
+        conn.executemany(
+            "UPDATE classification_jobs SET status = 'failed', updated_at = ? WHERE id = ?",
+            [(now, job_id) for job_id in stale_ids],
+        )
+    conn.close()
+    logger.info("Job database initialization complete")
+
+
+def create_job(email_ids):
+    """Record a new job for the given email IDs and return its ID."""
+    job_id = uuid.uuid4().hex
+    now = datetime.now()
+    conn = sqlite3.connect(DB_PATH)
+    with conn:
+        conn.execute(
+            """
+        INSERT INTO classification_jobs
+        (id, status, total, created_at, updated_at, owner)
+        VALUES (?, 'queued', ?, ?, ?, ?)
+        """,
+            (job_id, len(email_ids), now, now, get_owner()),
+        )
+        conn.executemany(
+            """
+        INSERT OR IGNORE INTO classification_job_items
+        (job_id, email_id, status, updated_at)
+        VALUES (?, ?, 'queued', ?)
+        """,
+            [(job_id, email_id, now) for email_id in email_ids],
+        )
+    conn.close()
+    logger.info(f"Created job {job_id} for {len(email_ids)} emails")
+    return job_id
+
+
+def update_job_item(job_id, email_id, status, category=None, error=None):
+    """Record the state of one email in a job and refresh the job status."""
+    now = datetime.now()
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    with conn:
+        conn.execute(
+            """
+        UPDATE classification_job_items
+        SET status = ?, category = ?, error = ?, updated_at = ?
+        WHERE job_id = ? AND email_id = ?
+        """,
+            (status, category, error, now, job_id, email_id),
+        )
+
+        counts = dict(
+            conn.execute(
+                """
+            SELECT status, COUNT(*) FROM classification_job_items
+            WHERE job_id = ?
+            GROUP BY status
+            """,
+                (job_id,),
+            ).fetchall()
+        )
+        if counts.get("queued", 0) + counts.get("running", 0) > 0:
+            job_status = "running"
+        elif counts.get("completed", 0) == 0:
+            job_status = "failed"
+        else:
+            job_status = "completed"
+
+        conn.execute(
+            "UPDATE classification_jobs SET status = ?, updated_at = ? WHERE id = ?",
+            (job_status, now, job_id),
+        )
+    conn.close()
+
+
+def get_job(job_id):
+    """Return a job with its per-email results, or None if it doesn't exist."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    job = conn.execute(
+        "SELECT * FROM classification_jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+    if job is None:
+        conn.close()
+        return None
+
+    items = conn.execute(
+        """
+    SELECT email_id, status, category, error FROM classification_job_items
+    WHERE job_id = ?
+    ORDER BY rowid
+    """,
+        (job_id,),
+    ).fetchall()
+    conn.close()
+
+    results = [dict(item) for item in items]
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "total": job["total"],
+        "completed": sum(1 for item in results if item["status"] == "completed"),
+        "failed": sum(1 for item in results if item["status"] == "failed"),
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "results": results,
+    }
+
+
+class ClassificationJobQueue:
+    """
+    Runs classification jobs on a bounded thread pool. Each worker thread keeps
+    its own Gmail service because the underlying HTTP client is not thread-safe.
+    """
+
+    def __init__(
+        self,
+        process_email,
+        service_factory,
+        max_workers=MAX_WORKERS,
+        max_pending=MAX_PENDING,
+    ):
+        self.process_email = process_email
+        self.service_factory = service_factory
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="classify-job"
+        )
+        self._local = threading.local()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, email_ids):
+        """Queue the emails as one job and return the job ID."""
+        email_ids = list(dict.fromkeys(email_ids))
+        with self._lock:
+            if self._pending + len(email_ids) > self.max_pending:
+                raise QueueFullError(
+                    f"Too many emails queued ({self._pending} pending, limit {self.max_pending})"
+                )
+            self._pending += len(email_ids)
+
+        try:
+            job_id = create_job(email_ids)
+        except Exception:
+            with self._lock:
+                self._pending -= len(email_ids)
+            raise
+        for email_id in email_ids:
+            self._executor.submit(self._run_item, job_id, email_id)
+        return job_id
+
+    def _get_service(self):
+        if getattr(self._local, "service", None) is None:
+            self._local.service = self.service_factory()
+        return self._local.service
+
+    def _run_item(self, job_id, email_id):
+        try:
+            update_job_item(job_id, email_id, "running")
+            category = self.process_email(self._get_service(), email_id)
+            update_job_item(job_id, email_id, "completed", category=category)
+        except Exception as e:
+            logger.error(f"Job {job_id}: error processing email {email_id}: {e}")
+            try:
+                update_job_item(job_id, email_id, "failed", error=str(e))
+            except Exception as db_error:
+                logger.error(f"Job {job_id}: could not record failure: {db_error}")
+        finally:
+            with self._lock:
+                self._pending -= 1
@@ -0,0 +1,302 @@
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from utils.gmail_message import GmailMessage
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("message_store")
+
+DB_PATH = "messages.db"
+
+# Headers we keep for every message; everything else in the payload is dropped
+STORED_HEADERS = ("Subject", "From", "Date")
+
+
+_initialized_paths = set()
+_init_lock = threading.Lock()
+
+
+def connect():
+    """Open the store, creating its tables the first time in this process."""
+    with _init_lock:
+        if DB_PATH not in _initialized_paths:
+            init_message_store()
+            _initialized_paths.add(DB_PATH)
+    return sqlite3.connect(DB_PATH, timeout=30)
+
+
+def init_message_store():
+    """Initialize the local message metadata mirror if it doesn't exist."""
+    logger.info("Initializing message store")
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    with conn:
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            thread_id TEXT,
+            internal_date INTEGER,
+            subject TEXT,
+            sender TEXT,
+            date TEXT,
+            snippet TEXT,
+            history_id TEXT,
+            updated_at DATETIME
+        )
+        """
+        )
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS message_labels (
+            message_id TEXT,
+            label_id TEXT,
+            PRIMARY KEY (message_id, label_id)
+        )
+        """
+        )
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_internal_date ON messages (internal_date DESC)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_message_labels_label ON message_labels (label_id, message_id)"
+        )
+    conn.close()
+    logger.info("Message store initialization complete")
+
+
+def upsert_messages(messages, history_id=None):
+    """Store GmailMessage records in the mirror, replacing their label sets."""
+    if not messages:
+        return
+
+    now = datetime.now()
+    rows = []
+    label_rows = []
+    for msg in messages:
+        rows.append(
+            (
+                msg.id,
+                msg.thread_id,
+                msg.internal_date,
+                msg.header("subject"),
+                msg.header("from"),
+                msg.header("date"),
+                msg.snippet,
+                msg.history_id or history_id,
+                now,
+            )
+        )
+        label_rows.extend((msg.id, label_id) for label_id in msg.label_ids)
+
+    conn = connect()
+    with conn:
+        conn.executemany(
+            """
+        INSERT OR REPLACE INTO messages
+        (id, thread_id, internal_date, subject, sender, date, snippet, history_id, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            rows,
+        )
+        conn.executemany(
+            "DELETE FROM message_labels WHERE message_id = ?",
+            [(row[0],) for row in rows],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO message_labels (message_id, label_id) VALUES (?, ?)",
+            label_rows,
+        )
+    conn.close()
+    logger.debug(f"Stored metadata for {len(rows)} messages")
+
+
+def _rows_to_messages(conn, rows):
+    """Build GmailMessage records from stored rows, keyed by ID."""
+    if not rows:
+        return {}
+
+    labels = {}
+    for message_id, label_id in conn.execute(
+        """
+    SELECT message_id, label_id FROM message_labels
+    WHERE message_id IN (SELECT value FROM json_each(?))
+    """,
+        (_json_ids([row["id"] for row in rows]),),
+    ):
+        labels.setdefault(message_id, []).append(label_id)
+
+    messages = {}
+    for row in rows:
+        headers = {
+            name: value
+            for name, value in (
+                ("subject", row["subject"]),
+                ("from", row["sender"]),
+                ("date", row["date"]),
+            )
+            if value is not None
+        }
+        messages[row["id"]] = GmailMessage(
+            row["id"],
+            thread_id=row["thread_id"],
+            internal_date=row["internal_date"],
+            label_ids=labels.get(row["id"], []),
+            snippet=row["snippet"],
+            history_id=row["history_id"],
+            headers=headers,
+        )
+    return messages
+
+
+def _json_ids(msg_ids):
+    # Passing IDs as one JSON array avoids SQLite's bound-parameter limit
+    return json.dumps(list(msg_ids))
+
+
+def get_messages(msg_ids):
+    """Return stored messages as a dict of ID to GmailMessage."""
+    if not msg_ids:
+        return {}
+
+    conn = connect()
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(
+        "SELECT * FROM messages WHERE id IN (SELECT value FROM json_each(?))",
+        (_json_ids(msg_ids),),
+    ).fetchall()
+    messages = _rows_to_messages(conn, rows)
+    conn.close()
+    return messages
+
+
+def query_messages(msg_ids=None, exclude_label_ids=None, limit=None):
+    """
+    Return stored GmailMessages newest first using the internal_date index,
+    optionally restricted to msg_ids and skipping messages with any of
+    exclude_label_ids.
+    """
+    conditions = []
+    params = []
+    if msg_ids is not None:
+        conditions.append("m.id IN (SELECT value FROM json_each(?))")
+        params.append(_json_ids(msg_ids))
+    if exclude_label_ids:
+        conditions.append(
+            """NOT EXISTS (
+            SELECT 1 FROM message_labels l
+            WHERE l.message_id = m.id
+            AND l.label_id IN (SELECT value FROM json_each(?))
+        )"""
+        )
+        params.append(_json_ids(exclude_label_ids))
+
+    query = "SELECT m.* FROM messages m"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY m.internal_date DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    conn = connect()
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(query, params).fetchall()
+    messages = _rows_to_messages(conn, rows)
+    conn.close()
+    return [messages[row["id"]] for row in rows]
+
+
+def update_message_labels(msg_ids, add_label_ids=None, remove_label_ids=None):
+    """Mirror a messages.modify/batchModify call in the local store."""
+    conn = connect()
+    with conn:
+        if remove_label_ids:
+            conn.executemany(
+                "DELETE FROM message_labels WHERE message_id = ? AND label_id = ?",
+                [(m, label) for m in msg_ids for label in remove_label_ids],
+            )
+        if add_label_ids:
+            # Only track labels for messages we have metadata for
+            conn.executemany(
+                """
+            INSERT OR IGNORE INTO message_labels (message_id, label_id)
+            SELECT id, ? FROM messages WHERE id = ?
+            """,
+                [(label, m) for m in msg_ids for label in add_label_ids],
+            )
+    conn.close()
+
+
+def set_message_labels(label_sets):
+    """Replace the label sets of stored messages ({message_id: [label_id]})."""
+    conn = connect()
+    with conn:
+        for msg_id, label_ids in label_sets.items():
+            conn.execute("DELETE FROM message_labels WHERE message_id = ?", (msg_id,))
+            conn.executemany(
+                """
+            INSERT OR IGNORE INTO message_labels (message_id, label_id)
+            SELECT id, ? FROM messages WHERE id = ?
+            """,
+                [(label_id, msg_id) for label_id in label_ids],
+            )
+    conn.close()
+
+
+def delete_messages(msg_ids):
+    """Remove messages (e.g. deleted in Gmail) from the mirror."""
+    conn = connect()
+    with conn:
+        conn.executemany(
+            "DELETE FROM messages WHERE id = ?", [(msg_id,) for msg_id in msg_ids]
+        )
+        conn.executemany(
+            "DELETE FROM message_labels WHERE message_id = ?",
+            [(msg_id,) for msg_id in msg_ids],
+        )
+    conn.close()
+
+
+def clear_messages():
+    """Drop all mirrored messages, e.g. when the history window has expired."""
+    logger.warning("Clearing message store")
+    conn = connect()
+    with conn:
+        conn.execute("DELETE FROM messages")
+        conn.execute("DELETE FROM message_labels")
+    conn.close()
+
+
+def get_sync_history_id():
+    """Return the mailbox historyId the mirror was last synced to."""
+    conn = connect()
+    row = conn.execute(
+        "SELECT value FROM sync_state WHERE key = 'history_id'"
+    ).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def set_sync_history_id(history_id):
+    conn = connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('history_id', ?)",
+            (str(history_id),),
+        )
+    conn.close()
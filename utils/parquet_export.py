@@ -0,0 +1,166 @@
+import os
+import json
+import sqlite3
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from utils import feedback_db
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("parquet_export")
+
+EXPORT_DIR = os.environ.get("ANALYTICS_EXPORT_DIR", "analytics")
+STATE_FILE = "_export_state.json"
+BATCH_SIZE = 50000
+
+# Append-only tables to export, each with the Arrow schema of its files. Rows
+# are exported once, by ID, so columns that change after insert (like
+# is_processed) are left out. Every table has an id and a timestamp column;
+# files are partitioned by the timestamp's date.
+TABLES = {
+    "classification_feedback": pa.schema(
+        [
+            ("id", pa.int64()),
+            ("message_id", pa.string()),
+            ("subject", pa.string()),
+            ("snippet", pa.string()),
+            ("sender", pa.string()),
+            ("ai_category", pa.string()),
+            ("user_category", pa.string()),
+            ("timestamp", pa.timestamp("us")),
+        ]
+    ),
+    "classification_history": pa.schema(
+        [
+            ("id", pa.int64()),
+            ("message_id", pa.string()),
+            ("sender", pa.string()),
+            ("category", pa.string()),
+            ("confidence", pa.float64()),
+            ("timestamp", pa.timestamp("us")),
+            ("account", pa.string()),
+        ]
+    ),
+    "prompt_updates": pa.schema(
+        [
+            ("id", pa.int64()),
+            ("old_prompt", pa.string()),
+            ("new_prompt", pa.string()),
+            ("timestamp", pa.timestamp("us")),
+            ("feedback_count", pa.int64()),
+            ("performance_metrics", pa.string()),
+        ]
+    ),
+}
+
+
+def _read_state(export_dir):
+    try:
+        with open(os.path.join(export_dir, STATE_FILE), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_state(export_dir, state):
+    path = os.path.join(export_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _connect_readonly(db_path):
+    # Read-only connections never take write locks on the live database
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+
+
+def _write_partitions(export_dir, table, schema, df):
+    """Write one batch of rows as one file per date partition."""
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601")
+    dates = df["timestamp"].dt.strftime("%Y-%m-%d").fillna("unknown")
+    for date, part in df.groupby(dates, sort=False):
+        partition_dir = os.path.join(export_dir, table, f"date={date}")
+        os.makedirs(partition_dir, exist_ok=True)
+        # Named after the first row so a batch re-exported after a crash
+        # overwrites its earlier file instead of duplicating it
+        name = f"part-{int(part['id'].iloc[0]):012d}.parquet"
+        # Readers skip dot files, so a partly written file is never read
+        tmp_path = os.path.join(partition_dir, f".{name}.tmp")
+        arrow_table = pa.Table.from_pandas(part, schema=schema, preserve_index=False)
+        pq.write_table(arrow_table.replace_schema_metadata(None), tmp_path)
+        os.replace(tmp_path, os.path.join(partition_dir, name))
+
+
+def export_table(table, db_path=None, export_dir=EXPORT_DIR, batch_size=BATCH_SIZE):
+    """
+    Append rows added to a table since the last export to its Parquet
+    dataset. The highest exported ID is saved after each batch, so an
+    interrupted export resumes where it stopped. Returns the rows exported.
+    """
+    schema = TABLES[table]
+    db_path = db_path or feedback_db.DB_PATH
+    os.makedirs(export_dir, exist_ok=True)
+    state = _read_state(export_dir)
+    last_id = state.get(table, 0)
+    columns = ", ".join(schema.names)
+
+    conn = _connect_readonly(db_path)
+    exported = 0
+    try:
+        while True:
+            df = pd.read_sql_query(
+                f"SELECT {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                conn,
+                params=(last_id, batch_size),
+            )
+            if df.empty:
+                break
+            _write_partitions(export_dir, table, schema, df)
+            last_id = int(df["id"].iloc[-1])
+            exported += len(df)
+            state[table] = last_id
+            _write_state(export_dir, state)
+    finally:
+        conn.close()
+
+    logger.info(f"Exported {exported} new rows from {table} (through ID {last_id})")
+    return exported
+
+
+def export_all(export_dir=EXPORT_DIR):
+    """Export new rows from every table. Returns {table: rows exported}."""
+    results = {}
+    for table in TABLES:
+        try:
+            results[table] = export_table(table, export_dir=export_dir)
+        except Exception as e:
+            logger.error(f"Error exporting {table}: {e}")
+            results[table] = None
+    return results
+
+
+def read_table(table, columns=None, filters=None, export_dir=EXPORT_DIR):
+    """
+    Read an exported table for offline analysis. Files are memory-mapped, and
+    filters on the date partition column skip whole files, e.g.
+    read_table("classification_feedback", filters=[("date", ">=", "2025-01-01")]).
+    Feedback that was corrected again appears once per correction; keep the
+    highest id per message_id for the latest label.
+    """
+    path = os.path.join(export_dir, table)
+    if not os.path.isdir(path):
+        return TABLES[table].empty_table()
+    return pq.read_table(
+        path,
+        columns=columns,
+        filters=filters,
+        memory_map=True,
+        partitioning=ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive"),
+    )
@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email_classifier import (
+    build_messages,
+    get_completion_options,
+    get_openai,
+    parse_category,
+    split_prompt,
+)
+from utils import feedback_db
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("prompt_eval")
+
+CACHE_PATH = "prompt_eval_cache.db"
+
+EVAL_SAMPLE_SIZE = int(os.environ.get("PROMPT_EVAL_SAMPLE_SIZE", 200))
+EVAL_CONCURRENCY = int(os.environ.get("PROMPT_EVAL_CONCURRENCY", 8))
+# Cached results keep the latency of the run that first requested them, so
+# latency is compared on this many rows that both prompts are re-timed on
+LATENCY_SAMPLE_SIZE = int(os.environ.get("PROMPT_EVAL_LATENCY_SAMPLE_SIZE", 20))
+
+# How much a candidate may exceed the current prompt before it is rejected.
+# Some slack is needed: added examples cost tokens and latency is noisy.
+MAX_TOKEN_INCREASE = 0.10
+MAX_LATENCY_INCREASE = 0.10
+
+_cache_lock = threading.Lock()
+_cache_initialized = False
+
+
+def _connect_cache():
+    global _cache_initialized
+
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    with _cache_lock:
+        if not _cache_initialized:
+            with conn:
+                conn.execute(
+                    """
+                CREATE TABLE IF NOT EXISTS eval_results (
+                    key TEXT PRIMARY KEY,
+                    category TEXT,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    latency REAL
+                )
+                """
+                )
+            _cache_initialized = True
+    return conn
+
+
+def get_holdout_parity():
+    """
+    Return the parity of the feedback IDs held out for evaluation. It flips
+    with every prompt update, so rows held out of one update feed the next.
+    """
+    return feedback_db.get_prompt_update_count() % 2
+
+
+def is_holdout(feedback_id, parity):
+    """
+    Whether a feedback row is held out for evaluation. Held-out rows aren't
+    used to generate the candidate prompt, so it isn't scored on the feedback
+    it was written from.
+    """
+    return feedback_id % 2 == parity
+
+
+def load_eval_rows(limit=EVAL_SAMPLE_SIZE, parity=None):
+    """
+    Return the most recent held-out feedback rows; user_category is the
+    ground truth.
+    """
+    if parity is None:
+        parity = get_holdout_parity()
+    conn = sqlite3.connect(feedback_db.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    # Same rows as is_holdout
+    rows = conn.execute(
+        """
+    SELECT id, subject, snippet, user_category FROM classification_feedback
+    WHERE id % 2 = ?
+    ORDER BY id DESC
+    LIMIT ?
+    """,
+        (parity, limit),
+    ).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def classify_for_eval(prompt_parts, row, use_cache=True):
+    """
+    Classify one feedback row with the given prompt. Results are cached by
+    request content, so unchanged prompts are never sent twice; cached results
+    keep the latency measured when they were first requested. With
+    use_cache=False the request is always sent, to time it.
+    """
+    messages = build_messages(row["subject"], row["snippet"], prompt_parts)
+    options = get_completion_options(prompt_parts)
+    key = hashlib.sha1(
+        json.dumps([messages, options], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+    conn = _connect_cache()
+    cached = (
+        use_cache
+        and conn.execute(
+            """
+    SELECT category, prompt_tokens, completion_tokens, latency
+    FROM eval_results WHERE key = ?
+    """,
+            (key,),
+        ).fetchone()
+    )
+    if cached:
+        conn.close()
+        return dict(
+            zip(("category", "prompt_tokens", "completion_tokens", "latency"), cached)
+        )
+
+    start = time.time()
+    response = get_openai().chat.completions.create(messages=messages, **options)
+    result = {
+        "category": parse_category(
+            response.choices[0].message.content, prompt_parts[2]
+        ),
+        "prompt_tokens": response.usage.prompt_tokens,
+        "completion_tokens": response.usage.completion_tokens,
+        "latency": time.time() - start,
+    }
+    with conn:
+        conn.execute(
+            """
+        INSERT OR REPLACE INTO eval_results
+        (key, category, prompt_tokens, completion_tokens, latency)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+            (key, *result.values()),
+        )
+    conn.close()
+    return result
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def build_report(rows, results):
+    """Summarize classification results against the feedback labels."""
+    confusion = {}
+    correct = 0
+    errors = 0
+    prompt_tokens = []
+    completion_tokens = []
+    latencies = []
+    for row, result in zip(rows, results):
+        if result is None:
+            errors += 1
+            continue
+        expected = row["user_category"]
+        predicted = result["category"]
+        correct += predicted == expected
+        confusion.setdefault(expected, {})
+        confusion[expected][predicted] = confusion[expected].get(predicted, 0) + 1
+        prompt_tokens.append(result["prompt_tokens"])
+        completion_tokens.append(result["completion_tokens"])
+        if result["latency"] is not None:
+            latencies.append(result["latency"])
+
+    evaluated = len(rows) - errors
+    per_category = {
+        expected: {
+            "total": sum(predictions.values()),
+            "correct": predictions.get(expected, 0),
+            "recall": predictions.get(expected, 0) / sum(predictions.values()),
+        }
+        for expected, predictions in confusion.items()
+    }
+    return {
+        "evaluated": evaluated,
+        "errors": errors,
+        "accuracy": correct / evaluated if evaluated else 0.0,
+        "prompt_tokens_per_email": (
+            sum(prompt_tokens) / evaluated if evaluated else 0.0
+        ),
+        "completion_tokens_per_email": (
+            sum(completion_tokens) / evaluated if evaluated else 0.0
+        ),
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p95": _percentile(latencies, 95),
+        "per_category": per_category,
+        "confusion": confusion,
+    }
+
+
+def compare_prompts(current_prompt, candidate_prompt, rows=None):
+    """
+    Replay feedback rows against both prompts concurrently and return
+    (current_report, candidate_report). Latency is only reported for the first
+    LATENCY_SAMPLE_SIZE rows, which both prompts are re-timed on in this run.
+    """
+    if rows is None:
+        rows = load_eval_rows()
+    logger.info(f"Evaluating current and candidate prompts on {len(rows)} emails")
+
+    def run(prompt_parts, row, timed):
+        try:
+            result = classify_for_eval(prompt_parts, row, use_cache=not timed)
+        except Exception as e:
+            logger.error(f"Evaluation request failed for feedback {row['id']}: {e}")
+            return None
+        return result if timed else {**result, "latency": None}
+
+    prompts = [split_prompt(current_prompt), split_prompt(candidate_prompt)]
+    with ThreadPoolExecutor(max_workers=EVAL_CONCURRENCY) as executor:
+        # Interleave the two prompts so both see the same API conditions
+        futures = [
+            [
+                executor.submit(run, parts, row, i < LATENCY_SAMPLE_SIZE)
+                for parts in prompts
+            ]
+            for i, row in enumerate(rows)
+        ]
+        results = [[future.result() for future in pair] for pair in futures]
+
+    return tuple(
+        build_report(rows, [pair[i] for pair in results]) for i in range(len(prompts))
+    )
+
+
+def should_promote(current, candidate):
+    """
+    Decide whether a candidate prompt may replace the current one: it must be
+    at least as accurate and no more than slightly more expensive or slower.
+    Returns (promote, reasons).
+    """
+    reasons = []
+    if not candidate["evaluated"]:
+        reasons.append("candidate could not be evaluated")
+        return False, reasons
+    if candidate["errors"] > current["errors"]:
+        reasons.append(
+            f"more failed requests ({candidate['errors']} vs {current['errors']})"
+        )
+    if candidate["accuracy"] < current["accuracy"]:
+        reasons.append(
+            f"lower accuracy ({candidate['accuracy']:.3f} vs {current['accuracy']:.3f})"
+        )
+    if candidate["prompt_tokens_per_email"] > current["prompt_tokens_per_email"] * (
+        1 + MAX_TOKEN_INCREASE
+    ):
+        reasons.append(
+            f"more prompt tokens ({candidate['prompt_tokens_per_email']:.1f} vs {current['prompt_tokens_per_email']:.1f})"
+        )
+    if (
+        current["latency_p95"] is not None
+        and candidate["latency_p95"] is not None
+        and candidate["latency_p95"]
+        > current["latency_p95"] * (1 + MAX_LATENCY_INCREASE)
+    ):
+        reasons.append(
+            f"slower p95 latency ({candidate['latency_p95']:.3f}s vs {current['latency_p95']:.3f}s)"
+        )
+    return not reasons, reasons
@@ -1,13 +1,23 @@
 import os
 import logging
-import openai
 from datetime import datetime
 import re
+from collections import Counter
+from email_classifier import count_tokens, get_openai
 from utils.feedback_db import (
-    get_unprocessed_feedback,
-    mark_feedback_as_processed,
+    count_unprocessed_feedback,
+    get_max_feedback_id,
+    iter_unprocessed_feedback,
+    mark_feedback_processed_through,
     store_prompt_update,
 )
+from utils.prompt_eval import (
+    compare_prompts,
+    get_holdout_parity,
+    is_holdout,
+    load_eval_rows,
+    should_promote,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -19,6 +29,15 @@ logger = logging.getLogger("prompt_updater")
 
 PROMPT_FILE = "email_classifier_prompt.txt"
 
+# Feedback is read in pages and summarized so the update request stays the
+# same size however much feedback has been collected
+FEEDBACK_PAGE_SIZE = 500
+SUMMARY_TOKEN_BUDGET = 3000
+EXAMPLES_PER_CLUSTER = 3
+EXAMPLE_SNIPPET_CHARS = 120
+SENDERS_PER_CLUSTER = 3
+MIN_SENDER_CORRECTIONS = 3
+
 
 def read_current_prompt():
     """Read the current prompt from file."""
@@ -41,9 +60,13 @@ def write_updated_prompt(new_prompt):
                 f.write(current_prompt)
             logger.info(f"Backup created: {PROMPT_FILE}.{timestamp}.bak")
 
-        # Write the new prompt
-        with open(PROMPT_FILE, "w") as f:
+        # Write the new prompt atomically so readers never see a partial file
+        tmp_path = f"{PROMPT_FILE}.tmp"
+        with open(tmp_path, "w") as f:
             f.write(new_prompt)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, PROMPT_FILE)
         logger.info(f"Updated prompt written to {PROMPT_FILE}")
         return True
     except Exception as e:
@@ -73,29 +96,134 @@ def extract_categories_from_prompt(prompt_text):
     return []
 
 
-def generate_improved_prompt(feedback_data, current_prompt):
-    """Use OpenAI to generate an improved prompt based on feedback."""
-    logger.info(
-        f"Generating improved prompt based on {len(feedback_data)} feedback entries"
-    )
-
-    # Extract current examples and categories
-    current_examples = extract_examples_from_prompt(current_prompt)
-    current_categories = extract_categories_from_prompt(current_prompt)
-
-    # Prepare feedback for the AI
-    feedback_examples = []
-    for item in feedback_data:
-        if item["ai_category"] != item["user_category"]:
-            feedback_examples.append(
+def normalize_subject(subject):
+    """Reduce a subject to a key that groups near-duplicates (numbers, case)."""
+    subject = re.sub(r"\d+", "#", (subject or "").lower())
+    return re.sub(r"\s+", " ", subject).strip()
+
+
+def summarize_feedback(feedback_rows):
+    """
+    Fold a stream of feedback rows into misclassification clusters keyed by
+    (ai_category, user_category). Each cluster keeps its size, sender counts
+    and a few distinct example emails, so memory grows with the number of
+    categories and senders rather than rows. Corrections are also counted per
+    sender to find senders that always belong to one category.
+    """
+    clusters = {}
+    sender_corrections = {}
+    total = 0
+    incorrect = 0
+    for row in feedback_rows:
+        total += 1
+        if row["ai_category"] == row["user_category"]:
+            continue
+        incorrect += 1
+
+        key = (row["ai_category"], row["user_category"])
+        cluster = clusters.setdefault(
+            key, {"count": 0, "senders": Counter(), "examples": [], "seen": set()}
+        )
+        cluster["count"] += 1
+        sender = (row.get("sender") or "").lower()
+        if sender:
+            cluster["senders"][sender] += 1
+            sender_corrections.setdefault(sender, Counter())[row["user_category"]] += 1
+
+        # Keep distinct examples, preferring ones from different senders
+        subject_key = normalize_subject(row["subject"])
+        if (
+            len(cluster["examples"]) < EXAMPLES_PER_CLUSTER
+            and subject_key not in cluster["seen"]
+            and (not sender or sender not in cluster["seen"])
+        ):
+            cluster["seen"].update({subject_key, sender})
+            cluster["examples"].append(
                 {
-                    "subject": item["subject"],
-                    "snippet": item["snippet"],
-                    "ai_prediction": item["ai_category"],
-                    "correct_category": item["user_category"],
+                    "subject": row["subject"] or "",
+                    "snippet": (row["snippet"] or "")[:EXAMPLE_SNIPPET_CHARS],
                 }
             )
 
+    return {
+        "total": total,
+        "incorrect": incorrect,
+        "clusters": clusters,
+        "sender_corrections": sender_corrections,
+    }
+
+
+def _estimate_tokens(text):
+    # count_tokens returns 0 if the encoding is unavailable; fall back to ~4 chars/token
+    return count_tokens(text) or len(text) // 4 + 1
+
+
+def format_feedback_summary(summary, token_budget=SUMMARY_TOKEN_BUDGET):
+    """
+    Render the clusters, largest first, and sender rules as compact text that
+    fits within token_budget. Clusters that don't fit are counted instead.
+    """
+    lines = [
+        f"{summary['incorrect']} of {summary['total']} reviewed emails were misclassified."
+    ]
+    used = _estimate_tokens(lines[0])
+
+    # Leave room for the sender rules after the clusters
+    cluster_budget = token_budget * 3 // 4
+    omitted = 0
+    clusters = sorted(
+        summary["clusters"].items(), key=lambda item: item[1]["count"], reverse=True
+    )
+    for (ai_category, user_category), cluster in clusters:
+        senders = ", ".join(
+            f"{sender} ({count})"
+            for sender, count in cluster["senders"].most_common(SENDERS_PER_CLUSTER)
+        )
+        block = [
+            f"- Predicted {ai_category}, correct category {user_category}: {cluster['count']} emails"
+            + (f"; frequent senders: {senders}" if senders else "")
+        ]
+        block += [
+            f'    e.g. "{example["subject"]}" - {example["snippet"]}'
+            for example in cluster["examples"]
+        ]
+        block_tokens = _estimate_tokens("\n".join(block))
+        if used + block_tokens > cluster_budget:
+            omitted += 1
+            continue
+        lines.extend(block)
+        used += block_tokens
+    if omitted:
+        lines.append(f"({omitted} smaller misclassification groups omitted)")
+
+    # Senders whose corrections nearly always point at the same category
+    rules = []
+    for sender, categories in summary["sender_corrections"].items():
+        category, count = categories.most_common(1)[0]
+        total = sum(categories.values())
+        if count >= MIN_SENDER_CORRECTIONS and count / total >= 0.8:
+            rules.append((count, sender, category))
+    rules.sort(reverse=True)
+    if rules:
+        lines.append("Senders that were consistently corrected to one category:")
+        used += _estimate_tokens(lines[-1])
+        for count, sender, category in rules:
+            line = f"- {sender} -> {category} ({count} corrections)"
+            line_tokens = _estimate_tokens(line)
+            if used + line_tokens > token_budget:
+                break
+            lines.append(line)
+            used += line_tokens
+
+    return "\n".join(lines)
+
+
+def generate_improved_prompt(feedback_summary, current_prompt):
+    """Use OpenAI to generate an improved prompt from a feedback summary."""
+    logger.info("Generating improved prompt from feedback summary")
+
+    current_categories = extract_categories_from_prompt(current_prompt)
+
     # Create the prompt for OpenAI
     system_prompt = """You are an expert at creating effective prompts for email classification. 
 Your task is to improve a classification prompt based on feedback data where the AI made incorrect predictions.
@@ -109,8 +237,8 @@ Analyze the patterns in the misclassifications and suggest improvements to the p
 Here are the current categories:
 {', '.join(current_categories)}
 
-Here are examples where the AI made incorrect predictions:
-{feedback_examples[:20]}  # Limit to 20 examples to avoid token limits
+Here is a summary of the AI's incorrect predictions, grouped by predicted and correct category:
+{feedback_summary}
 
 Based on these misclassifications, please:
 1. Identify patterns in the misclassifications
@@ -122,7 +250,7 @@ The updated prompt should follow the exact same format as the original, with app
 """
 
     try:
-        response = openai.chat.completions.create(
+        response = get_openai().chat.completions.create(
             model="gpt-4",  # Using GPT-4 for better reasoning
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -151,12 +279,10 @@ def update_prompt_from_feedback(min_feedback_count=50):
     """Main function to update the prompt based on collected feedback."""
     logger.info(f"Checking for prompt updates (minimum feedback: {min_feedback_count})")
 
-    # Get unprocessed feedback
-    feedback = get_unprocessed_feedback(limit=100)
-
-    if len(feedback) < min_feedback_count:
+    unprocessed_count = count_unprocessed_feedback()
+    if unprocessed_count < min_feedback_count:
         logger.info(
-            f"Not enough feedback for prompt update. Have {len(feedback)}, need {min_feedback_count}"
+            f"Not enough feedback for prompt update. Have {unprocessed_count}, need {min_feedback_count}"
         )
         return False
 
@@ -166,12 +292,48 @@ def update_prompt_from_feedback(min_feedback_count=50):
         logger.error("Failed to read current prompt")
         return False
 
+    # Stream all unprocessed feedback up to now into a bounded summary, leaving
+    # out the rows held out to evaluate the result. They stay unprocessed and
+    # feed the next update, which holds out the other half.
+    max_id = get_max_feedback_id()
+    parity = get_holdout_parity()
+    summary = summarize_feedback(
+        row
+        for row in iter_unprocessed_feedback(FEEDBACK_PAGE_SIZE, max_id)
+        if not is_holdout(row["id"], parity)
+    )
+    logger.info(
+        f"Summarized {summary['total']} feedback entries into {len(summary['clusters'])} misclassification groups"
+    )
+    if not summary["incorrect"]:
+        logger.info("No misclassifications in the feedback, prompt left unchanged")
+        mark_feedback_processed_through(max_id, skip_parity=parity)
+        return False
+
     # Generate improved prompt
-    improved_prompt = generate_improved_prompt(feedback, current_prompt)
+    improved_prompt = generate_improved_prompt(
+        format_feedback_summary(summary), current_prompt
+    )
     if not improved_prompt:
         logger.error("Failed to generate improved prompt")
         return False
 
+    # Only promote the candidate if it does at least as well on labeled feedback
+    try:
+        current_report, candidate_report = compare_prompts(
+            current_prompt, improved_prompt, load_eval_rows(parity=parity)
+        )
+    except Exception as e:
+        logger.error(f"Failed to evaluate improved prompt: {e}")
+        return False
+    promote, reasons = should_promote(current_report, candidate_report)
+    if not promote:
+        logger.warning(f"Improved prompt rejected: {'; '.join(reasons)}")
+        return False
+    logger.info(
+        f"Improved prompt accepted: accuracy {current_report['accuracy']:.3f} -> {candidate_report['accuracy']:.3f}"
+    )
+
     # Write updated prompt
     success = write_updated_prompt(improved_prompt)
     if not success:
@@ -180,16 +342,18 @@ def update_prompt_from_feedback(min_feedback_count=50):
 
     # Store prompt update history
     performance_metrics = {
-        "feedback_count": len(feedback),
+        "feedback_count": summary["total"],
+        "incorrect_count": summary["incorrect"],
+        "misclassification_groups": len(summary["clusters"]),
         "update_date": datetime.now().isoformat(),
+        "evaluation": {"current": current_report, "candidate": candidate_report},
     }
     store_prompt_update(
-        current_prompt, improved_prompt, len(feedback), performance_metrics
+        current_prompt, improved_prompt, summary["total"], performance_metrics
     )
 
-    # Mark feedback as processed
-    feedback_ids = [item["id"] for item in feedback]
-    mark_feedback_as_processed(feedback_ids)
+    # Mark the summarized feedback as processed
+    mark_feedback_processed_through(max_id, skip_parity=parity)
 
     logger.info("Prompt update completed successfully")
     return True
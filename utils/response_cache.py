@@ -0,0 +1,71 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("response_cache")
+
+PROMPT_FILE = "email_classifier_prompt.txt"
+
+
+def get_mailbox_history_id(service):
+    """Return the mailbox's current historyId with one getProfile call."""
+    profile = service.users().getProfile(userId="me").execute()
+    return profile["historyId"]
+
+
+def get_prompt_version():
+    """Return a value that changes whenever the classification prompt does."""
+    try:
+        return os.stat(PROMPT_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ResponseCache:
+    """
+    LRU cache of JSON payloads for the email listing endpoints. Entries are
+    keyed by endpoint, query parameters, the mailbox historyId and the prompt
+    version, so any mailbox change or prompt update produces a new key instead
+    of needing explicit invalidation.
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(endpoint, params, history_id):
+        return (
+            endpoint,
+            tuple(sorted((key, str(value)) for key, value in params.items())),
+            str(history_id),
+            get_prompt_version(),
+        )
+
+    @staticmethod
+    def make_etag(key):
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                logger.info(f"Response cache hit for {key[0]}")
+            return payload
+
+    def put(self, key, payload):
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
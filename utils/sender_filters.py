@@ -0,0 +1,214 @@
+import sqlite3
+import logging
+from collections import defaultdict
+from datetime import datetime
+from utils import feedback_db
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("sender_filters")
+
+# A sender or domain becomes a rule once this many of its messages are
+# labeled and at least this share of them got the same category
+MIN_MESSAGES = 20
+MIN_AGREEMENT = 0.95
+# A single address proves little about the rest of its domain
+MIN_DOMAIN_SENDERS = 2
+# Mail from these domains comes from unrelated people, so they never get
+# a domain rule (their senders can still get rules of their own)
+SHARED_DOMAINS = {
+    "aol.com",
+    "gmail.com",
+    "googlemail.com",
+    "hotmail.com",
+    "icloud.com",
+    "live.com",
+    "me.com",
+    "outlook.com",
+    "proton.me",
+    "protonmail.com",
+    "yahoo.com",
+}
+
+
+def get_sender_category_counts(account=None):
+    """
+    Return {sender address: {category: messages}} for one account's mailbox
+    (None for the default account). Each message counts once, with its
+    latest label: the user's correction if there is one, otherwise its
+    latest classification. Feedback is only collected for the default
+    account, so other accounts are mined from their history alone.
+    """
+    feedback_db.ensure_db()
+    conn = sqlite3.connect(feedback_db.DB_PATH, timeout=30)
+    try:
+        # SQLite takes the bare columns from the row with MAX(h.id)
+        rows = conn.execute(
+            """
+        SELECT lower(sender), category, COUNT(*) FROM (
+            SELECT h.sender AS sender,
+                   COALESCE(f.user_category, h.category) AS category,
+                   MAX(h.id)
+            FROM classification_history h
+            LEFT JOIN classification_feedback f
+                ON f.message_id = h.message_id AND h.account IS NULL
+            WHERE h.account IS :account
+            GROUP BY h.message_id
+            UNION ALL
+            SELECT f.sender, f.user_category, NULL
+            FROM classification_feedback f
+            WHERE :account IS NULL AND NOT EXISTS (
+                SELECT 1 FROM classification_history h
+                WHERE h.message_id = f.message_id AND h.account IS NULL
+            )
+        )
+        WHERE sender IS NOT NULL AND sender != ''
+        GROUP BY lower(sender), category
+        """,
+            {"account": account},
+        ).fetchall()
+    finally:
+        conn.close()
+
+    counts = defaultdict(dict)
+    for sender, category, messages in rows:
+        counts[sender][category] = messages
+    return dict(counts)
+
+
+def get_domain(address):
+    return address.rpartition("@")[2]
+
+
+def match_counts(counts, match_from):
+    """Return {category: messages} for the senders a filter's from criterion matches."""
+    totals = defaultdict(int)
+    for sender, categories in counts.items():
+        if sender == match_from or (
+            match_from.startswith("@") and get_domain(sender) == match_from[1:]
+        ):
+            for category, messages in categories.items():
+                totals[category] += messages
+    return dict(totals)
+
+
+def evaluate(categories):
+    """Return (top category, its message count, total messages, agreement)."""
+    total = sum(categories.values())
+    category, top = max(categories.items(), key=lambda item: item[1])
+    return category, top, total, top / total
+
+
+def find_sender_rules(
+    counts,
+    min_messages=MIN_MESSAGES,
+    min_agreement=MIN_AGREEMENT,
+    min_domain_senders=MIN_DOMAIN_SENDERS,
+):
+    """
+    Find senders whose mail is consistently labeled one category. A domain
+    gets one rule when its senders agree as a whole; otherwise individual
+    senders get rules. Returns dicts with match_from (an address, or
+    "@domain"), category, message_count and agreement, busiest first.
+    """
+    by_domain = defaultdict(list)
+    for sender in counts:
+        by_domain[get_domain(sender)].append(sender)
+
+    def make_rule(match_from, categories):
+        category, _, total, agreement = evaluate(categories)
+        if total >= min_messages and agreement >= min_agreement:
+            return {
+                "match_from": match_from,
+                "category": category,
+                "message_count": total,
+                "agreement": agreement,
+            }
+        return None
+
+    rules = []
+    for domain, senders in by_domain.items():
+        rule = None
+        if domain and domain not in SHARED_DOMAINS:
+            if len(senders) >= min_domain_senders:
+                rule = make_rule(f"@{domain}", match_counts(counts, f"@{domain}"))
+        if rule:
+            rules.append(rule)
+            continue
+        for sender in senders:
+            rule = make_rule(sender, counts[sender])
+            if rule:
+                rules.append(rule)
+
+    rules.sort(key=lambda rule: rule["message_count"], reverse=True)
+    return rules
+
+
+def record_filter(run_id, gmail_filter_id, rule, label_id, account=None):
+    """Record a Gmail filter created for a rule in an account's mailbox."""
+    conn = sqlite3.connect(feedback_db.DB_PATH, timeout=30)
+    with conn:
+        conn.execute(
+            """
+        INSERT INTO gmail_filters
+        (run_id, gmail_filter_id, match_from, category, label_id,
+         message_count, agreement, created_at, account)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                run_id,
+                gmail_filter_id,
+                rule["match_from"],
+                rule["category"],
+                label_id,
+                rule["message_count"],
+                rule["agreement"],
+                datetime.now(),
+                account,
+            ),
+        )
+    conn.close()
+
+
+def list_filters(account=None, status=None, run_id=None, filter_ids=None):
+    """
+    Return the filters recorded for an account's mailbox (None for the
+    default account) as dicts, oldest first, optionally narrowed down.
+    """
+    feedback_db.ensure_db()
+    conditions, params = ["account IS ?"], [account]
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if run_id:
+        conditions.append("run_id = ?")
+        params.append(run_id)
+    if filter_ids:
+        conditions.append(f"id IN ({', '.join('?' * len(filter_ids))})")
+        params.extend(filter_ids)
+    where = f"WHERE {' AND '.join(conditions)}"
+
+    conn = sqlite3.connect(feedback_db.DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(
+            f"SELECT * FROM gmail_filters {where} ORDER BY id", params
+        ).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def mark_filter_removed(filter_id):
+    """Mark a recorded filter as removed from Gmail."""
+    conn = sqlite3.connect(feedback_db.DB_PATH, timeout=30)
+    with conn:
+        conn.execute(
+            "UPDATE gmail_filters SET status = 'removed', removed_at = ? WHERE id = ?",
+            (datetime.now(), filter_id),
+        )
+    conn.close()
@@ -0,0 +1,26 @@
+import json
+
+STREAM_MIMETYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+# Disable caching and proxy buffering so events reach the client immediately
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def get_stream_format(args, headers):
+    """Return "ndjson" or "sse" if the client asked for a streamed response."""
+    stream = args.get("stream", "").lower()
+    if stream in STREAM_MIMETYPES:
+        return stream
+
+    accept = headers.get("Accept", "")
+    for stream_format, mimetype in STREAM_MIMETYPES.items():
+        if mimetype in accept:
+            return stream_format
+    return None
+
+
+def format_stream_event(stream_format, event, payload):
+    """Serialize one event as an NDJSON line or a server-sent event."""
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({"type": event, **payload}) + "\n"
@@ -0,0 +1,159 @@
+import os
+import time
+import logging
+import threading
+from utils.feedback_db import add_feedback_listener, get_unprocessed_incorrect_count
+from utils.prompt_updater import update_prompt_from_feedback
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process single-flight is available
+    fcntl = None
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("update_trigger")
+
+UPDATE_THRESHOLD = int(os.environ.get("PROMPT_UPDATE_THRESHOLD", 20))
+DEBOUNCE_SECONDS = float(os.environ.get("PROMPT_UPDATE_DEBOUNCE", 30))
+# Don't keep postponing an update while feedback streams in continuously
+MAX_DELAY_SECONDS = 300
+LOCK_FILE = "prompt_update.lock"
+
+_update_lock = threading.Lock()
+
+
+def run_prompt_update(min_feedback_count=UPDATE_THRESHOLD):
+    """
+    Run update_prompt_from_feedback unless another update is already running
+    in this process or, where file locks are available, in another one.
+    Returns the update's result, or None if it was skipped.
+    """
+    if not _update_lock.acquire(blocking=False):
+        logger.info("Prompt update already running, skipping")
+        return None
+    lock_file = None
+    try:
+        if fcntl is not None:
+            lock_file = open(LOCK_FILE, "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("Prompt update running in another process, skipping")
+                return None
+        return update_prompt_from_feedback(min_feedback_count=min_feedback_count)
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+        _update_lock.release()
+
+
+class PromptUpdateTrigger:
+    """
+    Starts a prompt update on a background thread once the running count of
+    unprocessed misclassifications reaches the threshold. Bursts of feedback
+    are debounced into one update, and after an update that didn't go through
+    (e.g. rejected by evaluation) another threshold's worth of corrections is
+    needed before retrying.
+    """
+
+    def __init__(
+        self,
+        threshold=UPDATE_THRESHOLD,
+        debounce_seconds=DEBOUNCE_SECONDS,
+        max_delay_seconds=MAX_DELAY_SECONDS,
+    ):
+        self.threshold = threshold
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._retry_at_count = threshold
+        self._due_at = None
+        self._first_due_at = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="prompt-update-trigger", daemon=True
+        )
+        self._thread.start()
+
+    def attach(self):
+        """Listen for feedback stored by this process."""
+        add_feedback_listener(self.notify)
+        return self
+
+    def check(self):
+        """Read the stored counter (one row) and schedule an update if due."""
+        self.notify(get_unprocessed_incorrect_count())
+
+    def notify(self, incorrect_count):
+        """Called with the current number of unprocessed misclassifications."""
+        if incorrect_count < self._retry_at_count:
+            return
+        with self._condition:
+            now = time.monotonic()
+            if self._first_due_at is None:
+                logger.info(
+                    f"{incorrect_count} misclassifications, scheduling prompt update"
+                )
+                self._first_due_at = now
+            self._due_at = min(
+                now + self.debounce_seconds,
+                self._first_due_at + self.max_delay_seconds,
+            )
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and (
+                    self._due_at is None or time.monotonic() < self._due_at
+                ):
+                    timeout = (
+                        None
+                        if self._due_at is None
+                        else self._due_at - time.monotonic()
+                    )
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+                self._due_at = None
+                self._first_due_at = None
+
+            count = get_unprocessed_incorrect_count()
+            try:
+                result = run_prompt_update(min_feedback_count=self.threshold)
+            except Exception as e:
+                logger.error(f"Prompt update failed: {e}")
+                result = False
+            if result is None:
+                # Skipped because another update holds the lock; nothing was
+                # attempted, so the next check() can schedule again
+                logger.info("Prompt update skipped, retry threshold unchanged")
+            elif not result:
+                self._retry_at_count = count + self.threshold
+                logger.info(
+                    f"Prompt not updated; next attempt at {self._retry_at_count} misclassifications"
+                )
+            else:
+                self._retry_at_count = self.threshold
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+
+_trigger = None
+
+
+def get_update_trigger():
+    """Return the process-wide trigger, attached to feedback writes."""
+    global _trigger
+    if _trigger is None:
+        _trigger = PromptUpdateTrigger().attach()
+    return _trigger
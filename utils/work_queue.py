@@ -0,0 +1,294 @@
+import os
+import time
+import sqlite3
+import logging
+from abc import ABC, abstractmethod
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("work_queue")
+
+DB_PATH = os.environ.get("WORK_QUEUE_DB", "work_queue.db")
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 5
+# Failed items are retried after RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+RETRY_BASE_SECONDS = 30
+
+
+class WorkQueue(ABC):
+    """
+    Durable queue of message IDs shared by classification workers.
+
+    Workers lease items for a limited time; an item that isn't acknowledged
+    before its lease expires becomes available to other workers again. Items
+    that fail max_attempts times are moved to the dead-letter state. Backends
+    other than SQLite (e.g. for workers on separate hosts without a shared
+    filesystem) implement these methods.
+    """
+
+    @abstractmethod
+    def enqueue(self, message_ids):
+        """Add message IDs that aren't queued yet; returns how many were added."""
+
+    @abstractmethod
+    def lease(self, worker_id, max_items=10, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Claim up to max_items available message IDs for worker_id."""
+
+    @abstractmethod
+    def ack(self, worker_id, message_ids):
+        """Mark leased items done; returns how many were still held by worker_id."""
+
+    @abstractmethod
+    def nack(self, worker_id, message_id, error=None):
+        """Release a failed item for retry, or dead-letter it after max_attempts."""
+
+    @abstractmethod
+    def dead_letters(self, limit=100):
+        """Return dead-lettered items with their last error."""
+
+    @abstractmethod
+    def requeue_dead(self, message_ids=None):
+        """Move dead-lettered items (all if message_ids is None) back to pending."""
+
+    @abstractmethod
+    def stats(self):
+        """Return item counts by status."""
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """WorkQueue stored in a SQLite file shared by worker processes on one host."""
+
+    def __init__(self, db_path=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = db_path or DB_PATH
+        self.max_attempts = max_attempts
+        self._init_db()
+
+    def _connect(self):
+        # Autocommit mode so lease() can take the write lock with BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS work_items (
+            message_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            lease_owner TEXT,
+            lease_expires REAL,
+            last_error TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
+        """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_work_items_available ON work_items (status, available_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_work_items_lease ON work_items (status, lease_expires)"
+        )
+        conn.close()
+
+    def enqueue(self, message_ids):
+        if not message_ids:
+            return 0
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.executemany(
+            """
+        INSERT OR IGNORE INTO work_items (message_id, available_at, created_at, updated_at)
+        VALUES (?, ?, ?, ?)
+        """,
+            [(message_id, now, now, now) for message_id in message_ids],
+        )
+        added = cursor.rowcount
+        conn.execute("COMMIT")
+        conn.close()
+        logger.info(f"Enqueued {added} of {len(message_ids)} message IDs")
+        return added
+
+    def lease(self, worker_id, max_items=10, lease_seconds=DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        conn = self._connect()
+        try:
+            # Holding the write lock makes select-then-claim atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+
+            # Items whose worker died while holding them count as failed attempts
+            conn.execute(
+                """
+            UPDATE work_items
+            SET status = 'dead', lease_owner = NULL, last_error = 'Lease expired', updated_at = ?
+            WHERE status = 'leased' AND lease_expires <= ? AND attempts >= ?
+            """,
+                (now, now, self.max_attempts),
+            )
+
+            rows = conn.execute(
+                """
+            SELECT message_id FROM work_items
+            WHERE (status = 'pending' AND available_at <= ?)
+            OR (status = 'leased' AND lease_expires <= ?)
+            ORDER BY available_at
+            LIMIT ?
+            """,
+                (now, now, max_items),
+            ).fetchall()
+            message_ids = [row[0] for row in rows]
+
+            conn.executemany(
+                """
+            UPDATE work_items
+            SET status = 'leased', lease_owner = ?, lease_expires = ?,
+                attempts = attempts + 1, updated_at = ?
+            WHERE message_id = ?
+            """,
+                [
+                    (worker_id, now + lease_seconds, now, message_id)
+                    for message_id in message_ids
+                ],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        if message_ids:
+            logger.info(f"Worker {worker_id} leased {len(message_ids)} items")
+        return message_ids
+
+    def ack(self, worker_id, message_ids):
+        if not message_ids:
+            return 0
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        # A lease that expired and was taken by another worker is not ours to ack
+        cursor = conn.executemany(
+            """
+        UPDATE work_items
+        SET status = 'done', lease_owner = NULL, last_error = NULL, updated_at = ?
+        WHERE message_id = ? AND status = 'leased' AND lease_owner = ?
+        """,
+            [(now, message_id, worker_id) for message_id in message_ids],
+        )
+        acked = cursor.rowcount
+        conn.execute("COMMIT")
+        conn.close()
+        if acked < len(message_ids):
+            logger.warning(
+                f"Worker {worker_id} lost the lease on {len(message_ids) - acked} items"
+            )
+        return acked
+
+    def nack(self, worker_id, message_id, error=None):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            """
+        SELECT attempts FROM work_items
+        WHERE message_id = ? AND status = 'leased' AND lease_owner = ?
+        """,
+            (message_id, worker_id),
+        ).fetchone()
+        if row is None:
+            conn.execute("ROLLBACK")
+            conn.close()
+            return False
+
+        attempts = row[0]
+        if attempts >= self.max_attempts:
+            status, available_at = "dead", now
+            logger.error(
+                f"Dead-lettering {message_id} after {attempts} attempts: {error}"
+            )
+        else:
+            status = "pending"
+            available_at = now + RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+        conn.execute(
+            """
+        UPDATE work_items
+        SET status = ?, available_at = ?, lease_owner = NULL, last_error = ?, updated_at = ?
+        WHERE message_id = ?
+        """,
+            (status, available_at, str(error) if error else None, now, message_id),
+        )
+        conn.execute("COMMIT")
+        conn.close()
+        return True
+
+    def dead_letters(self, limit=100):
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(
+            """
+        SELECT message_id, attempts, last_error, updated_at FROM work_items
+        WHERE status = 'dead'
+        ORDER BY updated_at DESC
+        LIMIT ?
+        """,
+            (limit,),
+        ).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def requeue_dead(self, message_ids=None):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        if message_ids is None:
+            cursor = conn.execute(
+                """
+            UPDATE work_items
+            SET status = 'pending', attempts = 0, available_at = ?, updated_at = ?
+            WHERE status = 'dead'
+            """,
+                (now, now),
+            )
+        else:
+            cursor = conn.executemany(
+                """
+            UPDATE work_items
+            SET status = 'pending', attempts = 0, available_at = ?, updated_at = ?
+            WHERE status = 'dead' AND message_id = ?
+            """,
+                [(now, now, message_id) for message_id in message_ids],
+            )
+        requeued = cursor.rowcount
+        conn.execute("COMMIT")
+        conn.close()
+        logger.info(f"Requeued {requeued} dead-lettered items")
+        return requeued
+
+    def stats(self):
+        conn = self._connect()
+        counts = dict(
+            conn.execute(
+                "SELECT status, COUNT(*) FROM work_items GROUP BY status"
+            ).fetchall()
+        )
+        conn.close()
+        return {
+            status: counts.get(status, 0)
+            for status in ("pending", "leased", "done", "dead")
+        }
+
+
+def get_work_queue():
+    """Return the configured work queue backend."""
+    return SQLiteWorkQueue()